@@ -0,0 +1,113 @@
+import hashlib
+from datetime import timezone
+
+from flask import Blueprint, Response, current_app, jsonify, request
+from sqlalchemy import func, select
+
+from app.models import Role, User
+from app.replica import read_replica
+
+api_bp = Blueprint('api', __name__, url_prefix='/api')
+
+# поля, которые можно запросить через ?fields=; пароль и служебные колонки наружу не отдаются
+USER_FIELDS = {
+    'id': User.id,
+    'login': User.login,
+    'last_name': User.last_name,
+    'first_name': User.first_name,
+    'patronymic': User.patronymic,
+    'full_name': User.full_name,
+    'role_id': User.role_id,
+    'role': Role.name,
+    'created_at': User.created_at,
+    'updated_at': User.updated_at,
+    'version': User.version,
+}
+DEFAULT_FIELDS = ('id', 'login', 'full_name', 'role')
+# у строк, не менявшихся после добавления updated_at, временем изменения считается создание
+LAST_MODIFIED = func.coalesce(User.updated_at, User.created_at)
+
+
+@api_bp.record_once
+def _setup(state):
+    state.app.config.setdefault('API_PAGE_SIZE', 50)
+    state.app.config.setdefault('API_MAX_PAGE_SIZE', 500)
+
+
+def _error(message, status):
+    return jsonify(error=message), status
+
+
+def _fields():
+    """Запрошенные поля в порядке запроса; None, если среди них есть неизвестные."""
+    raw = request.args.get('fields')
+    if not raw:
+        return DEFAULT_FIELDS
+    fields = tuple(dict.fromkeys(name.strip() for name in raw.split(',') if name.strip()))
+    if not fields or any(name not in USER_FIELDS for name in fields):
+        return None
+    return fields
+
+
+def _select(fields, *extra):
+    """SELECT только нужных колонок; роль присоединяется, только если её запросили."""
+    query = select(*(USER_FIELDS[name].label(name) for name in fields), *extra).where(User.not_deleted())
+    if 'role' in fields:
+        query = query.select_from(User).outerjoin(Role, User.role_id == Role.id)
+    return query
+
+
+def _item(row, fields):
+    item = {}
+    for name in fields:
+        value = getattr(row, name)
+        item[name] = value.isoformat() if hasattr(value, 'isoformat') else value
+    return item
+
+
+@api_bp.route('/users')
+def users():
+    """Живые пользователи по id, keyset-пагинация: ?after=<id последнего>&limit=N&fields=a,b."""
+    fields = _fields()
+    if fields is None:
+        return _error(f'unknown field; allowed: {", ".join(USER_FIELDS)}', 400)
+    config = current_app.config
+    limit = min(max(request.args.get('limit', config['API_PAGE_SIZE'], type=int), 1), config['API_MAX_PAGE_SIZE'])
+    query = _select(fields, User.id.label('_id')).order_by(User.id).limit(limit + 1)
+    after = request.args.get('after', type=int)
+    if after is not None:
+        query = query.where(User.id > after)
+    rows = read_replica.session.execute(query).all()
+    next_after = rows[limit - 1]._id if len(rows) > limit else None
+    return jsonify(items=[_item(row, fields) for row in rows[:limit]], next=next_after)
+
+
+@api_bp.route('/users/<int:user_id>')
+def user(user_id):
+    """Один пользователь с ETag и Last-Modified; на совпавший If-None-Match — 304 без тела."""
+    fields = _fields()
+    if fields is None:
+        return _error(f'unknown field; allowed: {", ".join(USER_FIELDS)}', 400)
+    query = _select(fields, User.version.label('_version'), LAST_MODIFIED.label('_modified'))
+    row = read_replica.session.execute(query.where(User.id == user_id)).first()
+    if row is None:
+        return _error('not found', 404)
+    # набор полей — часть тега: у разных проекций разные тела
+    tag = f'{user_id}:{row._version}:{row._modified.isoformat()}:{",".join(fields)}'
+    if 'role' in fields:
+        # переименование роли не меняет ни version, ни updated_at пользователя
+        tag += f':{row.role}'
+    etag = hashlib.blake2s(tag.encode(), digest_size=12).hexdigest()
+    modified = row._modified.replace(tzinfo=timezone.utc)
+    if request.if_none_match:
+        not_modified = request.if_none_match.contains(etag)
+    else:
+        # HTTP-даты с точностью до секунды
+        not_modified = (request.if_modified_since is not None
+                        and modified.replace(microsecond=0) <= request.if_modified_since)
+    response = Response(status=304) if not_modified else jsonify(_item(row, fields))
+    response.set_etag(etag)
+    response.last_modified = modified
+    # клиент может хранить ответ, но перед использованием переспрашивает с If-None-Match
+    response.cache_control.no_cache = True
+    return response
@@ -1,15 +1,35 @@
+import math
 import random
 from flask import Flask, request, abort, render_template, redirect, url_for, make_response, flash, session
+from flask import Response, stream_template, get_flashed_messages, jsonify
 from flask_login import LoginManager, UserMixin, login_user, logout_user, current_user, login_required
 from werkzeug.security import generate_password_hash, check_password_hash
 from flask_sqlalchemy import SQLAlchemy
 from datetime import timedelta, datetime
 import werkzeug
+from werkzeug.middleware.proxy_fix import ProxyFix
 from functools import lru_cache
 from faker import Faker
 import re
-from app.models import db, User as DBUser, Role
+from app.models import db, User as DBUser, Role, Post, Comment, schema_lock, upgrade_schema
 from app.users import users_bp
+from app.api import api_bp
+from app.replica import read_replica
+from app import purge
+from app import request_limits
+from app import datagen
+from app import view_context
+from app.comments import comment_stats, comment_page
+from app.posts import seed_posts, feed_page, get_post_or_404
+from app.shared_cache import shared_cache
+from app.jobs import jobs
+from app.audit import audit
+from app.profiling import profiling_bp, request_profiler, stack_sampler
+from app.sqlstats import query_stats
+from app.http_cache import http_cache
+from app.health import health_bp, warm_up
+from app.ratelimit import LoginThrottle
+from app.passwords import LoginVerifier
 from pathlib import Path
 import os
 
@@ -30,8 +50,8 @@ db_file = Path(app.instance_path) / 'app.db'
 # для логов и отладки — покажем путь в лог gunicorn
 app.logger.info(f"Using sqlite DB at: {db_file.resolve()} (exists: {db_file.exists()})")
 
-# используем абсолютный путь в URI
-app.config['SQLALCHEMY_DATABASE_URI'] = f"sqlite:///{db_file.resolve()}"
+# используем абсолютный путь в URI; DATABASE_URL задаёт другую БД (тесты берут SQLite в памяти)
+app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('DATABASE_URL') or f"sqlite:///{db_file.resolve()}"
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 
 # (опционально) если хочешь отключить проверку same-thread (необязательно для gunicorn workers)
@@ -39,8 +59,45 @@ app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 
 
 db.init_app(app)
+# статистика SQL по формам запросов и лог медленных запросов (/admin/sql)
+query_stats.init_app(app)
+# кеш, общий для всех воркеров хоста (лента постов, роли)
+shared_cache.init_app(app)
+# отдельный пул только для чтения для страниц-списков, см. app/replica.py
+read_replica.init_app(app)
+
+# миграция и начальные данные — под блокировкой: процессы хоста, стартующие вместе, проходят по очереди
+SCHEMA_LOCK = os.path.join(app.instance_path, 'schema.lock')
+
+# старые БД (созданные по lab4_init.sql) дополняем новыми колонками
+with app.app_context(), schema_lock(SCHEMA_LOCK):
+    upgrade_schema()
 
 app.register_blueprint(users_bp)
+# JSON API для интеграций: /api/users
+app.register_blueprint(api_bp)
+# профилирование запросов администратором и семплирование стеков (app/profiling.py);
+# подключается первым, чтобы в профиль попадали и остальные before_request
+request_profiler.init_app(app)
+stack_sampler.init_app(app)
+app.register_blueprint(profiling_bp)
+# очистка мягко удалённых пользователей — задача воркера очереди (app/purge.py)
+purge.init_app(app)
+# очередь фоновых задач (уведомления о событиях пользователей), воркер — `flask jobs-worker` (worker в Procfile)
+jobs.init_app(app)
+# журнал действий над пользователями, пишется пачками в фоне
+audit.init_app(app)
+# лимиты на размер входных данных для страниц лабы 2
+request_limits.init_app(app)
+# Cache-Control для публичных страниц: анонимам — общий кеш reverse proxy, вошедшим — private
+http_cache.init_app(app)
+# прогрев воркера (хук в gunicorn.conf.py) и проверка готовности /readyz
+warm_up.init_app(app)
+app.register_blueprint(health_bp)
+
+# сколько постов в ленте и комментариев (и ответов) отдавать за раз
+app.config.setdefault('POSTS_PAGE_SIZE', 10)
+app.config.setdefault('COMMENTS_PAGE_SIZE', 20)
 
 images_ids = ['7d4e9175-95ea-4c5f-8be5-92a6b708bb3c',
               '2d2ab7df-cdbc-48a8-a936-35bba702def5',
@@ -48,6 +105,9 @@ images_ids = ['7d4e9175-95ea-4c5f-8be5-92a6b708bb3c',
               'afc2cfe7-5cac-4b80-9b9a-d5c65ef0c728',
               'cab5b7f2-774e-4884-a200-0c0180fa777f']
 
+# `flask gen-data` — большой детерминированный набор данных для нагрузочных проверок
+datagen.init_app(app, images_ids)
+
 
 
 
@@ -72,43 +132,55 @@ def generate_post(i):
         'author': fake.name(),
         'date': fake.date_time_between(start_date='-2y', end_date='now'),
         'image_id': f'{images_ids[i]}.jpg',
-        'comments': generate_comments()
     }
 
-@lru_cache
-def posts_list():
-    return sorted([generate_post(i) for i in range(5)], key=lambda p: p['date'], reverse=True)
+# посты хранятся в БД; при первом запуске таблица заполняется сгенерированными
+with app.app_context(), schema_lock(SCHEMA_LOCK):
+    seed_posts(generate_post)
 
 @app.route('/')
+@http_cache.public
 def index():
     return render_template('index.html')
 
 @app.route('/posts')
+@http_cache.public
 def posts():
-    return render_template('posts.html', title='Посты', posts=posts_list())
-
-@app.route('/posts/<int:index>')
-def post(index):
-    posts = posts_list()
-    if index < 0 or index >= len(posts):
+    rows, next_after = feed_page(after=request.args.get('after', type=int), limit=app.config['POSTS_PAGE_SIZE'])
+    return render_template('posts.html', title='Посты', posts=rows, next_after=next_after)
+
+@app.route('/posts/<int:post_id>')
+@http_cache.public
+def post(post_id):
+    p = get_post_or_404(post_id)
+    # на странице только первая страница комментариев верхнего уровня, ответы подгружаются по запросу
+    stats = comment_stats(p.id, generate_comments)
+    comments, next_after = comment_page(p.id, limit=app.config['COMMENTS_PAGE_SIZE'])
+    return render_template('post.html', title=p.title, post=p,
+                           comments=comments, comment_count=stats.top_level, next_after=next_after)
+
+@app.route('/posts/<int:post_id>/comments')
+def post_comments(post_id):
+    get_post_or_404(post_id)
+    comments, next_after = comment_page(post_id, after=request.args.get('after', 0, type=int),
+                                        limit=app.config['COMMENTS_PAGE_SIZE'])
+    return jsonify(items=[c.to_dict() for c in comments], next=next_after)
+
+@app.route('/comments/<int:comment_id>/replies')
+def comment_replies(comment_id):
+    parent = db.session.get(Comment, comment_id)
+    if parent is None:
         abort(404)
-    p = posts[index]
-    return render_template('post.html', title=p['title'], post=p)
+    replies, next_after = comment_page(parent.post_id, parent.id, after=request.args.get('after', 0, type=int),
+                                       limit=app.config['COMMENTS_PAGE_SIZE'])
+    return jsonify(items=[c.to_dict() for c in replies], next=next_after)
 
 @app.route('/about')
+@http_cache.public
 def about():
     return render_template('about.html', title='Об авторе')
 
 
-@app.route('/posts/<int:index>')
-def show_post(index):
-    posts = posts_list()
-    try:
-        p = posts[index]
-    except IndexError:
-        abort(404)
-    return render_template('post.html', title=p['title'], post=p)
-
 
 
 
@@ -117,42 +189,45 @@ def show_post(index):
 
 
 
+def _params_page(title, items, **context):
+    """Страница show_params.html с потоковым рендером таблицы: строки уходят клиенту по мере генерации."""
+    # flash-сообщения забираем до начала потока: после отправки заголовков сессию уже не сохранить
+    get_flashed_messages()
+    return Response(stream_template('show_params.html', title=title, items=items, **context))
+
 # вывод параметров url
 @app.route('/show/url')
 def show_url_params():
-    params = request.args.to_dict(flat=False)  # сохраняем все значения
-    return render_template('show_params.html', title='Параметры URL', items=params)
+    return _params_page('Параметры URL', request_limits.query_items())
 
 # отображение хедера
 @app.route('/show/headers')
 def show_headers():
-    # request.headers — объект, приводим к dict
-    headers = dict(request.headers)
-    return render_template('show_params.html', title='Заголовки запроса', items=headers)
+    return _params_page('Заголовки запроса', request_limits.header_items())
 
 # сookie: устанавливаем, если нет; удаляем, если есть
 COOKIE_NAME = 'lab2_cookie'
 @app.route('/show/cookies')
 def show_cookies():
     cookies = request.cookies
-    resp = make_response(render_template('show_params.html', title='Cookie', items=dict(cookies)))
-    if COOKIE_NAME in cookies:
+    had_cookie = COOKIE_NAME in cookies
+    # шаблон рендерится один раз; пары cookie берутся прямо из request.cookies, без копии в dict
+    resp = _params_page('Cookie', cookies.items(multi=True),
+                        message='Cookie удалено' if had_cookie else 'Cookie установлено')
+    if had_cookie:
         # удалить cookie
         resp.set_cookie(COOKIE_NAME, '', max_age=0)
-        # для явности добавить флаг, чтобы в шаблоне показать, что удалено
-        resp.set_data(render_template('show_params.html', title='Cookie', items=dict(cookies), message='Cookie удалено'))
     else:
         # установить cookie
         resp.set_cookie(COOKIE_NAME, '1', max_age=60*60*24*30)  # месяц
-        resp.set_data(render_template('show_params.html', title='Cookie', items=dict(cookies), message='Cookie установлено'))
     return resp
 
 # параметры формы: отображаем то, что пришло в POST
 @app.route('/show/form', methods=['GET','POST'])
 def show_form_params():
     if request.method == 'POST':
-        form = request.form.to_dict(flat=False)
-        return render_template('show_params.html', title='Параметры формы', items=form)
+        # размер и число полей ограничены, лишнее отклоняется с 413 (см. app/request_limits.py)
+        return _params_page('Параметры формы', request_limits.form_items())
     return render_template('form_submit.html')  # простая форма для тестов
 
 # валидация и форматирование номера телефона
@@ -233,15 +308,29 @@ app.config['REMEMBER_COOKIE_DURATION'] = timedelta(days=7)
 # Flask-Login
 login_manager = LoginManager()
 login_manager.init_app(app)
+# current_user и is_authenticated в шаблонах — значения, посчитанные один раз за запрос
+view_context.init_app(app)
 login_manager.login_view = 'login'
 login_manager.login_message = 'Для доступа к запрашиваемой странице необходимо войти в систему.'
 login_manager.login_message_category = 'warning'
 
+# сколько reverse proxy стоят перед приложением (app/http_cache.py); 0 — X-Forwarded-For не доверяем.
+# Иначе адрес клиента (request.remote_addr, ключ ограничения входа по IP) берётся из заголовков этих прокси,
+# а не адрес самого прокси, общий для всех посетителей
+app.config.setdefault('TRUSTED_PROXIES', int(os.environ.get('TRUSTED_PROXIES', 0)))
+if app.config['TRUSTED_PROXIES']:
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=app.config['TRUSTED_PROXIES'], x_proto=app.config['TRUSTED_PROXIES'])
+
+# ограничение попыток входа (по IP и по логину), см. app/ratelimit.py
+login_throttle = LoginThrottle(app)
+# проверка пароля с выровненным временем ответа, см. app/passwords.py
+login_verifier = LoginVerifier(app)
+
 @login_manager.user_loader
 def load_user(user_id):
     # user_id приходит как строка — в БД id integer
     try:
-        return DBUser.query.get(int(user_id))
+        return DBUser.query.filter(DBUser.id == int(user_id), DBUser.not_deleted()).first()
     except Exception:
         return None
 
@@ -260,8 +349,16 @@ def login():
         username = request.form.get('username','').strip()
         password = request.form.get('password','')
         remember = bool(request.form.get('remember'))
-        user = DBUser.query.filter_by(login=username).first()
-        if user and check_password_hash(user.password_hash, password):
+        ip = request.remote_addr or ''
+        # отсекаем перебор до запроса в БД и дорогой проверки хеша
+        retry_after = login_throttle.try_acquire(ip, username)
+        if retry_after:
+            flash('Слишком много попыток входа. Попробуйте позже.', 'danger')
+            return render_template('login.html'), 429, {'Retry-After': str(math.ceil(retry_after))}
+        user = DBUser.query.filter(DBUser.login == username, DBUser.not_deleted()).first()
+        if login_verifier.verify(username, user, password):
+            login_throttle.succeeded(ip, username)
+            login_verifier.upgrade_hash(user, password)
             login_user(user, remember=remember)
             flash('Вход выполнен успешно.', 'success')
             next_page = request.args.get('next')
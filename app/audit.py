@@ -0,0 +1,136 @@
+import atexit
+import os
+import threading
+from collections import deque
+from datetime import datetime
+
+from sqlalchemy import event, insert, select, tuple_
+from sqlalchemy.orm import aliased
+
+from app.models import db, AuditEvent, User
+
+
+class AuditLog:
+    """Журнал действий с пакетной записью.
+
+    Событие, записанное через on_commit(), после commit основной сессии попадает в буфер в памяти,
+    а в таблицу audit_log его пишет фоновый поток: раз в AUDIT_FLUSH_INTERVAL секунд или как только
+    накопилось AUDIT_FLUSH_SIZE событий, весь буфер — одной транзакцией. Транзакции самих изменений
+    пользователей от этого не удлиняются. При падении процесса теряется не больше одного интервала;
+    при обычном завершении буфер сбрасывается (atexit). AUDIT_FLUSH_INTERVAL = 0 — писать сразу после commit.
+    """
+
+    def __init__(self, app=None):
+        self.app = None
+        self._buffer = deque()
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread_pid = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('AUDIT_FLUSH_INTERVAL', float(os.environ.get('AUDIT_FLUSH_INTERVAL', 1.0)))
+        app.config.setdefault('AUDIT_FLUSH_SIZE', 100)
+        app.config.setdefault('AUDIT_PAGE_SIZE', 50)
+        self.app = app
+        self.flush_interval = app.config['AUDIT_FLUSH_INTERVAL']
+        self.flush_size = app.config['AUDIT_FLUSH_SIZE']
+        app.extensions['audit'] = self
+        event.listen(db.session, 'after_commit', self._buffer_pending)
+        event.listen(db.session, 'after_rollback', self._drop_pending)
+        atexit.register(self.flush)
+
+    def on_commit(self, action, actor_id=None, target_id=None):
+        """Записать событие, если текущая транзакция db.session закоммитится."""
+        db.session.info.setdefault('pending_audit', []).append(
+            {'at': datetime.utcnow(), 'actor_id': actor_id, 'action': action, 'target_id': target_id})
+
+    def _buffer_pending(self, session):
+        events = session.info.pop('pending_audit', None)
+        if not events:
+            return
+        with self._lock:
+            self._buffer.extend(events)
+            size = len(self._buffer)
+        if not self.flush_interval:
+            try:
+                self.flush()
+            except Exception:
+                # изменение уже закоммичено — не роняем запрос, события остались в буфере
+                self.app.logger.exception('audit flush failed')
+            return
+        self._ensure_thread()
+        if size >= self.flush_size:
+            self._wakeup.set()
+
+    def _drop_pending(self, session):
+        session.info.pop('pending_audit', None)
+
+    def flush(self):
+        """Записать буфер одной транзакцией. Возвращает число записанных событий."""
+        with self._lock:
+            events = list(self._buffer)
+            self._buffer.clear()
+        if not events or self.app is None:
+            return 0
+        try:
+            with self.app.app_context(), db.engine.begin() as conn:
+                conn.execute(insert(AuditEvent), events)
+        except Exception:
+            # вернём события в начало буфера, запишем со следующей попыткой
+            with self._lock:
+                self._buffer.extendleft(reversed(events))
+            raise
+        return len(events)
+
+    def _ensure_thread(self):
+        # поток свой в каждом процессе: после fork у воркера gunicorn его нет
+        if self._thread_pid == os.getpid():
+            return
+        self._thread_pid = os.getpid()
+        threading.Thread(target=self._run, name='audit-flush', daemon=True).start()
+
+    def _run(self):
+        while True:
+            self._wakeup.wait(self.flush_interval or None)
+            self._wakeup.clear()
+            try:
+                self.flush()
+            except Exception:
+                self.app.logger.exception('audit flush failed')
+
+
+def audit_page(session, actor=None, target=None, since=None, until=None, after=None, limit=50):
+    """Страница журнала: новые события первыми, keyset-пагинация по (at, id).
+
+    Фильтры по автору и цели идут по индексам ix_audit_actor / ix_audit_target, диапазон времени —
+    по at в тех же индексах. after — id последней записи предыдущей страницы.
+    Возвращает (строки, id для следующей страницы); в строках есть ФИО автора и цели, если они ещё есть в users.
+    """
+    actor_user, target_user = aliased(User), aliased(User)
+    query = (
+        select(AuditEvent.id, AuditEvent.at, AuditEvent.action, AuditEvent.actor_id, AuditEvent.target_id,
+               actor_user.full_name.label('actor_name'), target_user.full_name.label('target_name'))
+        .outerjoin(actor_user, actor_user.id == AuditEvent.actor_id)
+        .outerjoin(target_user, target_user.id == AuditEvent.target_id)
+        .order_by(AuditEvent.at.desc(), AuditEvent.id.desc())
+        .limit(limit + 1)
+    )
+    if actor is not None:
+        query = query.where(AuditEvent.actor_id == actor)
+    if target is not None:
+        query = query.where(AuditEvent.target_id == target)
+    if since is not None:
+        query = query.where(AuditEvent.at >= since)
+    if until is not None:
+        query = query.where(AuditEvent.at < until)
+    if after is not None:
+        anchor = select(AuditEvent.at).where(AuditEvent.id == after).scalar_subquery()
+        query = query.where(tuple_(AuditEvent.at, AuditEvent.id) < tuple_(anchor, after))
+    rows = session.execute(query).all()
+    next_after = rows[limit - 1].id if len(rows) > limit else None
+    return rows[:limit], next_after
+
+
+audit = AuditLog()
@@ -0,0 +1,58 @@
+from sqlalchemy import select
+from sqlalchemy.exc import IntegrityError
+
+from app.models import db, Comment, CommentStats
+
+
+def seed_comments(post_id, tree):
+    """Один раз сохраняет дерево комментариев поста (в формате generate_comments).
+
+    Строка comment_stats добавляется в той же транзакции и служит меткой «уже заполнено»:
+    если другой воркер успел раньше, вставка упрётся в первичный ключ и мы просто откатимся.
+    """
+    total = 0
+
+    def add(items, parent):
+        nonlocal total
+        for c in items:
+            replies = c.get('replies', [])
+            row = Comment(post_id=post_id, parent=parent, author=c['author'], text=c['text'],
+                          reply_count=len(replies))
+            db.session.add(row)
+            total += 1
+            add(replies, row)
+
+    stats = CommentStats(post_id=post_id, top_level=len(tree))
+    db.session.add(stats)
+    add(tree, None)
+    stats.total = total
+    try:
+        db.session.commit()
+    except IntegrityError:
+        db.session.rollback()
+        return db.session.get(CommentStats, post_id)
+    return stats
+
+
+def comment_stats(post_id, generate):
+    """Счётчики комментариев поста; при первом обращении комментарии создаются через generate()."""
+    stats = db.session.get(CommentStats, post_id)
+    if stats is None:
+        stats = seed_comments(post_id, generate())
+    return stats
+
+
+def comment_page(post_id, parent_id=None, after=0, limit=20):
+    """Страница комментариев одного уровня (keyset по id) и id, с которого начнётся следующая.
+
+    parent_id=None — комментарии верхнего уровня, иначе — ответы на комментарий parent_id.
+    """
+    level = Comment.parent_id.is_(None) if parent_id is None else Comment.parent_id == parent_id
+    rows = db.session.scalars(
+        select(Comment)
+        .where(Comment.post_id == post_id, level, Comment.id > after)
+        .order_by(Comment.id)
+        .limit(limit + 1)
+    ).all()
+    next_after = rows[limit - 1].id if len(rows) > limit else None
+    return rows[:limit], next_after
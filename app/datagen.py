@@ -0,0 +1,206 @@
+import random
+import secrets
+import time
+from datetime import datetime, timedelta
+from itertools import islice
+
+import click
+from sqlalchemy import create_engine
+
+from app.models import db, name_key
+from app.passwords import hash_password
+
+# сколько строк отдавать в один executemany
+CHUNK = 50000
+# даты создаются назад от этой точки, чтобы результат не зависел от дня запуска
+EPOCH = datetime(2025, 1, 1)
+
+ROLES = [('admin', 'Администратор системы'), ('user', 'Обычный пользователь'),
+         ('moderator', 'Модератор'), ('editor', 'Редактор')]
+
+# фамилии в мужской форме; женская получается окончанием
+SURNAMES = [
+    'Иванов', 'Смирнов', 'Кузнецов', 'Попов', 'Васильев', 'Петров', 'Соколов', 'Михайлов', 'Новиков',
+    'Фёдоров', 'Морозов', 'Волков', 'Алексеев', 'Лебедев', 'Семёнов', 'Егоров', 'Павлов', 'Козлов',
+    'Степанов', 'Николаев', 'Орлов', 'Андреев', 'Макаров', 'Никитин', 'Захаров', 'Зайцев', 'Соловьёв',
+    'Борисов', 'Яковлев', 'Григорьев', 'Романов', 'Воробьёв', 'Сергеев', 'Кузьмин', 'Фролов',
+    'Александров', 'Дмитриев', 'Королёв', 'Гусев', 'Киселёв', 'Ильин', 'Максимов', 'Поляков',
+    'Сорокин', 'Виноградов', 'Ковалёв', 'Белов', 'Медведев', 'Антонов', 'Тарасов', 'Жуков', 'Баранов',
+]
+MALE_NAMES = [
+    'Александр', 'Алексей', 'Андрей', 'Антон', 'Артём', 'Борис', 'Вадим', 'Василий', 'Виктор',
+    'Владимир', 'Григорий', 'Денис', 'Дмитрий', 'Евгений', 'Егор', 'Иван', 'Игорь', 'Илья', 'Кирилл',
+    'Константин', 'Максим', 'Михаил', 'Никита', 'Николай', 'Олег', 'Павел', 'Пётр', 'Роман', 'Сергей',
+    'Степан', 'Тимофей', 'Фёдор', 'Юрий', 'Ярослав',
+]
+FEMALE_NAMES = [
+    'Александра', 'Алина', 'Анастасия', 'Анна', 'Валентина', 'Валерия', 'Вера', 'Виктория', 'Дарья',
+    'Евгения', 'Екатерина', 'Елена', 'Елизавета', 'Ирина', 'Ксения', 'Любовь', 'Людмила', 'Марина',
+    'Мария', 'Надежда', 'Наталья', 'Нина', 'Ольга', 'Полина', 'Светлана', 'София', 'Татьяна', 'Юлия',
+]
+# отчество: (мужское, женское) от имени отца
+PATRONYMICS = [
+    ('Александрович', 'Александровна'), ('Алексеевич', 'Алексеевна'), ('Андреевич', 'Андреевна'),
+    ('Борисович', 'Борисовна'), ('Васильевич', 'Васильевна'), ('Викторович', 'Викторовна'),
+    ('Владимирович', 'Владимировна'), ('Дмитриевич', 'Дмитриевна'), ('Евгеньевич', 'Евгеньевна'),
+    ('Иванович', 'Ивановна'), ('Игоревич', 'Игоревна'), ('Ильич', 'Ильинична'),
+    ('Константинович', 'Константиновна'), ('Михайлович', 'Михайловна'), ('Николаевич', 'Николаевна'),
+    ('Олегович', 'Олеговна'), ('Павлович', 'Павловна'), ('Петрович', 'Петровна'),
+    ('Сергеевич', 'Сергеевна'), ('Юрьевич', 'Юрьевна'),
+]
+WORDS = (
+    'система данные пользователь запрос ответ сервер страница работа время задача результат проект '
+    'вопрос решение процесс модель значение пример таблица индекс поиск список запись журнал отчёт '
+    'быстро медленно важно просто сложно новый старый большой малый основной общий отдельный'
+).split()
+
+
+def female_surname(surname):
+    if surname.endswith(('ов', 'ев', 'ёв', 'ин')):
+        return surname + 'а'
+    return surname
+
+
+def fio(rng):
+    """(фамилия, имя, отчество) с согласованным родом; отчество есть не у всех."""
+    surname = rng.choice(SURNAMES)
+    male = rng.random() < 0.5
+    patronymic = rng.choice(PATRONYMICS)[0 if male else 1] if rng.random() < 0.9 else None
+    if male:
+        return surname, rng.choice(MALE_NAMES), patronymic
+    return female_surname(surname), rng.choice(FEMALE_NAMES), patronymic
+
+
+def sentence(rng, words):
+    text = ' '.join(rng.choice(WORDS) for _ in range(words))
+    return text[0].upper() + text[1:] + '.'
+
+
+def _ts(value):
+    # тот же формат, в котором DateTime хранит SQLAlchemy, чтобы сравнения строк в SQL были верными
+    return value.strftime('%Y-%m-%d %H:%M:%S.%f')
+
+
+def _chunks(rows):
+    rows = iter(rows)
+    while True:
+        chunk = list(islice(rows, CHUNK))
+        if not chunk:
+            return
+        yield chunk
+
+
+def _relax(conn):
+    # на время загрузки: без fsync и с большим кешем; журнал остаётся, так что файл не портится
+    conn.execute('PRAGMA synchronous=OFF')
+    conn.execute('PRAGMA cache_size=-262144')
+    conn.execute('PRAGMA temp_store=MEMORY')
+
+
+def _next_id(conn, table):
+    return conn.execute(f'SELECT coalesce(max(id), 0) + 1 FROM {table}').fetchone()[0]
+
+
+def generate_users(conn, count, rng, password_hash):
+    conn.executemany('INSERT OR IGNORE INTO roles(name, description) VALUES (?, ?)', ROLES)
+    # администраторов генератор не создаёт
+    role_ids = [row[0] for row in conn.execute("SELECT id FROM roles WHERE lower(name) <> 'admin' ORDER BY id")]
+    start = _next_id(conn, 'users')
+
+    def rows():
+        for i in range(start, start + count):
+            last, first, patronymic = fio(rng)
+            created = EPOCH - timedelta(seconds=rng.randrange(3 * 365 * 86400))
+            # логин по id: уникален и при повторном запуске поверх уже заполненной БД
+            yield (i, f'user{i:07d}', password_hash, last, first, patronymic, name_key(last, first, patronymic),
+                   rng.choice(role_ids), _ts(created))
+
+    for chunk in _chunks(rows()):
+        conn.executemany('INSERT INTO users(id, login, password_hash, last_name, first_name, patronymic, '
+                         'full_name_key, role_id, created_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)', chunk)
+
+
+def generate_posts(conn, count, comments, rng, image_ids):
+    """Посты и деревья комментариев в формате seed_comments: верхний уровень и до трёх ответов."""
+    post_id = _next_id(conn, 'posts')
+    comment_id = _next_id(conn, 'comments')
+    posts, rows, stats = [], [], []
+
+    def flush():
+        conn.executemany('INSERT INTO posts(id, title, text, author, date, image_id) VALUES (?, ?, ?, ?, ?, ?)', posts)
+        conn.executemany('INSERT INTO comments(id, post_id, parent_id, author, text, created_at, reply_count) '
+                         'VALUES (?, ?, ?, ?, ?, ?, ?)', rows)
+        conn.executemany('INSERT INTO comment_stats(post_id, top_level, total) VALUES (?, ?, ?)', stats)
+        posts.clear()
+        rows.clear()
+        stats.clear()
+
+    for _ in range(count):
+        date = EPOCH - timedelta(seconds=rng.randrange(2 * 365 * 86400))
+        posts.append((post_id, sentence(rng, 5)[:-1], ' '.join(sentence(rng, 12) for _ in range(rng.randint(5, 40))),
+                      ' '.join(p for p in fio(rng) if p), _ts(date), f'{rng.choice(image_ids)}.jpg'))
+        total = 0
+        for _ in range(comments):
+            parent = comment_id
+            replies = rng.randint(0, 3)
+            created = date + timedelta(minutes=rng.randrange(60 * 24 * 30))
+            rows.append((parent, post_id, None, ' '.join(fio(rng)[:2]), sentence(rng, 10),
+                         _ts(created), replies))
+            comment_id += 1
+            for _ in range(replies):
+                created += timedelta(minutes=rng.randrange(1, 600))
+                rows.append((comment_id, post_id, parent, ' '.join(fio(rng)[:2]), sentence(rng, 8),
+                             _ts(created), 0))
+                comment_id += 1
+            total += 1 + replies
+        stats.append((post_id, comments, total))
+        post_id += 1
+        if len(rows) >= CHUNK or len(posts) >= CHUNK:
+            flush()
+    flush()
+
+
+def generate(engine, users=0, posts=0, comments=5, seed=42, image_ids=(), password_hash=None):
+    """Заполняет БД детерминированными данными: один seed — одни и те же строки.
+
+    У всех пользователей один password_hash (считается один раз на прогон); без него — hash_password
+    от случайного пароля, для этого нужен контекст приложения.
+
+    Всё пишется одной транзакцией пачками executemany на «сыром» соединении sqlite3,
+    с отключённым fsync. Схема должна уже существовать.
+    """
+    rng = random.Random(seed)
+    raw = engine.raw_connection()
+    try:
+        conn = raw.driver_connection
+        _relax(conn)
+        if users:
+            generate_users(conn, users, rng, password_hash or hash_password(secrets.token_urlsafe(16)))
+        if posts:
+            generate_posts(conn, posts, comments, rng, image_ids)
+        conn.commit()
+        conn.execute('PRAGMA synchronous=NORMAL')
+        conn.execute('ANALYZE')
+    finally:
+        raw.close()
+
+
+def init_app(app, image_ids):
+    @app.cli.command('gen-data')
+    @click.option('--users', default=0, show_default=True, help='сколько пользователей добавить')
+    @click.option('--posts', default=0, show_default=True, help='сколько постов добавить')
+    @click.option('--comments', default=5, show_default=True, help='комментариев верхнего уровня на пост')
+    @click.option('--seed', default=42, show_default=True)
+    # БД приложения генератор не трогает: только отдельный файл
+    @click.option('--database', type=click.Path(dir_okay=False), required=True,
+                  help='отдельный файл SQLite (например, для бенчмарков)')
+    @click.option('--password', help='пароль всех сгенерированных пользователей; по умолчанию случайный')
+    def gen_data_command(users, posts, comments, seed, database, password):
+        """Заполнить отдельную БД большим объёмом детерминированных тестовых данных."""
+        engine = create_engine(f'sqlite:///{database}')
+        db.metadata.create_all(engine)
+        start = time.perf_counter()
+        generate(engine, users, posts, comments, seed, image_ids,
+                 hash_password(password or secrets.token_urlsafe(16)))
+        click.echo(f'users: {users}, posts: {posts} ({comments} top-level comments each) '
+                   f'in {time.perf_counter() - start:.1f}s')
@@ -0,0 +1,196 @@
+import os
+import threading
+import time
+
+from flask import Blueprint, current_app, jsonify
+from sqlalchemy import text
+from werkzeug.wsgi import ClosingIterator
+
+from app.http_cache import http_cache
+from app.models import db
+from app.posts import feed_page
+from app.replica import read_replica
+
+health_bp = Blueprint('health', __name__)
+
+
+class WarmUp:
+    """Прогрев воркера до того, как он начнёт принимать запросы.
+
+    Вызывается из хука post_worker_init в gunicorn.conf.py: компилирует все шаблоны, открывает
+    соединения основного пула и пула реплики, считает фиктивный хеш LoginVerifier и строит первую
+    страницу ленты постов (она же ляжет в общий кеш). Без этого всё это оплачивали бы первые живые запросы нового воркера — а при
+    перезапуске воркеров по max_requests это происходит постоянно.
+    Если приложение запущено не через gunicorn, прогрев выполнит первая проверка /readyz.
+    """
+
+    def __init__(self, app=None):
+        self.done = False
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        # сколько соединений каждого пула открыть заранее; gunicorn.conf.py ставит по числу потоков воркера
+        app.config.setdefault('WARMUP_DB_CONNECTIONS', int(os.environ.get('WARMUP_DB_CONNECTIONS', 2)))
+        app.extensions['warmup'] = self
+
+    def run(self, app):
+        """Прогреть воркер. Возвращает True, если все шаги прошли; упавший шаг повторится при следующем вызове."""
+        # после прогрева — без блокировки: /readyz зовёт run на каждой пробе
+        if self.done:
+            return True
+        with self._lock:
+            if self.done:
+                return True
+            start = time.perf_counter()
+            with app.app_context():
+                try:
+                    templates = self._compile_templates(app)
+                    self._open_connections(db.engine, app.config['WARMUP_DB_CONNECTIONS'])
+                    if read_replica.engine is not db.engine:
+                        self._open_connections(read_replica.engine, app.config['WARMUP_DB_CONNECTIONS'])
+                    if 'login_verifier' in app.extensions:
+                        # иначе первый вход с несуществующим логином заплатил бы за два хеша
+                        app.extensions['login_verifier'].dummy_hash
+                    feed_page(limit=app.config['POSTS_PAGE_SIZE'])
+                except Exception:
+                    app.logger.exception('warm-up failed')
+                    return False
+                finally:
+                    db.session.remove()
+            self.done = True
+            app.logger.info('warm-up: %d templates, db pools, posts feed in %.0f ms',
+                            templates, (time.perf_counter() - start) * 1000)
+            return True
+
+    @staticmethod
+    def _compile_templates(app):
+        names = [name for name in app.jinja_env.list_templates() if name.endswith('.html')]
+        for name in names:
+            app.jinja_env.get_template(name)
+        return len(names)
+
+    @staticmethod
+    def _open_connections(engine, count):
+        # соединения открываются одновременно, иначе пул раз за разом отдавал бы одно и то же
+        conns = [engine.connect() for _ in range(count)]
+        try:
+            for conn in conns:
+                conn.execute(text('SELECT 1'))
+        finally:
+            for conn in conns:
+                conn.close()
+
+
+class InFlightCounter:
+    """Сколько запросов сейчас обрабатывает этот воркер (WSGI-обёртка вокруг app.wsgi_app).
+
+    Запрос считается до закрытия тела ответа, так что потоковые ответы тоже учитываются.
+    """
+
+    def __init__(self, app=None):
+        self.count = 0
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.wsgi_app = self._wrap(app.wsgi_app)
+        app.extensions['in_flight'] = self
+
+    def _wrap(self, wsgi_app):
+        def counted(environ, start_response):
+            with self._lock:
+                self.count += 1
+            try:
+                body = wsgi_app(environ, start_response)
+            except BaseException:
+                self._done()
+                raise
+            return ClosingIterator(body, self._done)
+        return counted
+
+    def _done(self):
+        with self._lock:
+            self.count -= 1
+
+
+def pool_status(engine):
+    """Занятость пула соединений или None для пулов без ограничения (SQLite в памяти)."""
+    pool = engine.pool
+    if not hasattr(pool, 'checkedout'):
+        return None
+    checked_out = pool.checkedout()
+    # max_overflow < 0 — переполнение не ограничено, пул не насыщается
+    max_overflow = getattr(pool, '_max_overflow', -1)
+    return {'size': pool.size(), 'checked_out': checked_out,
+            'saturated': max_overflow >= 0 and checked_out >= pool.size() + max_overflow}
+
+
+def check_db(engine, timeout):
+    """Время простого чтения из БД в мс; ожидание блокировки SQLite ограничено timeout секундами."""
+    start = time.perf_counter()
+    with engine.connect() as conn:
+        raw = conn.connection.driver_connection
+        previous = raw.execute('PRAGMA busy_timeout').fetchone()[0]
+        raw.execute(f'PRAGMA busy_timeout = {int(timeout * 1000)}')
+        try:
+            # sqlite_master — настоящее чтение файла БД под разделяемой блокировкой, в отличие от SELECT 1
+            raw.execute('SELECT count(*) FROM sqlite_master').fetchone()
+        finally:
+            raw.execute(f'PRAGMA busy_timeout = {previous}')
+    return (time.perf_counter() - start) * 1000
+
+
+warm_up = WarmUp()
+in_flight = InFlightCounter()
+
+
+@health_bp.record_once
+def _setup(state):
+    # пробы приходят часто: без разбора cookie, загрузки пользователя и Set-Cookie
+    http_cache.skip_session('/healthz', '/readyz')
+    state.app.config.setdefault('READY_DB_TIMEOUT', 0.5)
+    # 0 — не ограничивать; иначе при стольких запросах в работе воркер отвечает 503
+    state.app.config.setdefault('READY_MAX_IN_FLIGHT', 0)
+    in_flight.init_app(state.app)
+
+
+@health_bp.after_request
+def _no_store(response):
+    response.headers['Cache-Control'] = 'no-store'
+    return response
+
+
+@health_bp.route('/healthz')
+def healthz():
+    """Процесс жив и отвечает; без обращений к БД и файлам."""
+    return jsonify(status='ok')
+
+
+@health_bp.route('/readyz')
+def readyz():
+    """Воркер прогрет, БД отвечает за READY_DB_TIMEOUT, пул не исчерпан и воркер не перегружен."""
+    config = current_app.config
+    # сама проба тоже в работе — её не считаем
+    busy = in_flight.count - 1
+    body = {'status': 'ready', 'pid': os.getpid(), 'in_flight': busy}
+    if not warm_up.run(current_app._get_current_object()):
+        body['status'] = 'warming'
+        return jsonify(body), 503
+    pool = body['pool'] = pool_status(db.engine)
+    if pool is not None and pool['saturated']:
+        # проверка БД ждала бы свободного соединения
+        body['status'] = 'pool_saturated'
+        return jsonify(body), 503
+    try:
+        body['db_ms'] = round(check_db(db.engine, config['READY_DB_TIMEOUT']), 2)
+    except Exception as e:
+        current_app.logger.warning('readiness db check failed: %r', e)
+        body['status'] = 'db_error'
+        return jsonify(body), 503
+    if config['READY_MAX_IN_FLIGHT'] and busy >= config['READY_MAX_IN_FLIGHT']:
+        body['status'] = 'busy'
+        return jsonify(body), 503
+    return jsonify(body)
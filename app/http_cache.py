@@ -0,0 +1,80 @@
+from flask import current_app, g, request, session
+from flask.sessions import SecureCookieSessionInterface
+from flask_login import current_user
+
+
+class _SessionInterface(SecureCookieSessionInterface):
+    """Не переотправляет cookie сессии в ответах, которые можно кешировать в общем кеше,
+    и вовсе не разбирает её для адресов из skip_paths (проверки балансировщика)."""
+
+    def __init__(self):
+        self.skip_paths = set()
+
+    def open_session(self, app, request):
+        # эндпоинт ещё не сопоставлен — сессия открывается до маршрутизации, поэтому по пути
+        if request.path in self.skip_paths:
+            return self.make_null_session(app)
+        return super().open_session(app, request)
+
+    def should_set_cookie(self, app, session):
+        if g.get('public_cache') and not session.modified:
+            return False
+        return super().should_set_cookie(app, session)
+
+
+class HttpCachePolicy:
+    """Заголовки кеширования для страниц, одинаковых у всех анонимных посетителей.
+
+    Обработчик, помеченный @http_cache.public, для анонимного пользователя отдаётся с
+    `Cache-Control: public, max-age=0, s-maxage=…, stale-while-revalidate=…`: reverse proxy держит
+    страницу HTTP_CACHE_S_MAXAGE секунд и ещё HTTP_CACHE_STALE_WHILE_REVALIDATE отдаёт устаревшую,
+    пока обновляет её в фоне, а браузер каждый раз спрашивает заново (после входа навбар должен смениться).
+    Вошедшему пользователю тот же адрес отдаётся как private. Во всех случаях `Vary: Cookie`:
+    кешированная копия достаётся только запросам без cookie сессии.
+
+    Ответ остаётся private, если в запросе изменилась сессия (например, показано flash-сообщение),
+    и только в общих ответах cookie сессии не отправляется.
+    """
+
+    def __init__(self, app=None):
+        self.session_interface = _SessionInterface()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('HTTP_CACHE_ENABLED', True)
+        app.config.setdefault('HTTP_CACHE_S_MAXAGE', 60)
+        app.config.setdefault('HTTP_CACHE_STALE_WHILE_REVALIDATE', 300)
+        app.extensions['http_cache'] = self
+        app.session_interface = self.session_interface
+        app.after_request(self._apply)
+
+    def skip_session(self, *paths):
+        """Запросы по этим путям обходятся без сессии: cookie не разбирается и не отправляется."""
+        self.session_interface.skip_paths.update(paths)
+
+    @staticmethod
+    def public(view):
+        """Декоратор: ответ обработчика анонимному пользователю можно кешировать в общем кеше."""
+        view.public_cache = True
+        return view
+
+    def _apply(self, response):
+        config = current_app.config
+        view = current_app.view_functions.get(request.endpoint)
+        if (not config['HTTP_CACHE_ENABLED'] or not getattr(view, 'public_cache', False)
+                or request.method not in ('GET', 'HEAD') or response.status_code != 200):
+            return response
+        response.vary.add('Cookie')
+        if current_user.is_authenticated or session.modified:
+            response.headers['Cache-Control'] = 'private, max-age=0'
+            return response
+        # stale-while-revalidate у werkzeug нет среди атрибутов cache_control — заголовок целиком
+        response.headers['Cache-Control'] = (
+            f"public, max-age=0, s-maxage={config['HTTP_CACHE_S_MAXAGE']}, "
+            f"stale-while-revalidate={config['HTTP_CACHE_STALE_WHILE_REVALIDATE']}")
+        g.public_cache = True
+        return response
+
+
+http_cache = HttpCachePolicy()
@@ -0,0 +1,191 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from datetime import datetime
+
+import click
+from flask import current_app
+from sqlalchemy import event
+
+from app.models import db
+
+
+class LocalSink:
+    """Заглушка вместо почты и вебхуков: события дописываются строками JSON в файл.
+
+    Работает без сети, поэтому годится для разработки и тестов.
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+    def __call__(self, kind, payloads):
+        with open(self.path, 'a', encoding='utf-8') as f:
+            for payload in payloads:
+                f.write(json.dumps({'kind': kind, **payload}, ensure_ascii=False) + '\n')
+
+
+class JobQueue:
+    """Надёжная локальная очередь фоновых задач в SQLite-файле.
+
+    Обработчик запроса только кладёт задачу в очередь (одна короткая вставка), а почту, вебхуки
+    и прочие побочные эффекты выполняет отдельный процесс `flask jobs-worker`. Задачи, поставленные
+    через on_commit(), попадают в очередь только после успешного commit основной сессии.
+
+    Воркер забирает задачи пачками (с арендой на LEASE секунд — задачи упавшего воркера заберёт
+    другой) и отдаёт обработчику все задачи одного вида разом. Если обработчик упал, задачи
+    повторяются с экспоненциальной задержкой, после JOBS_MAX_ATTEMPTS попыток помечаются 'dead'.
+    """
+
+    LEASE = 60.0
+
+    def __init__(self, path=None, app=None):
+        self.path = path
+        self.handlers = {}
+        self.default_handler = None
+        self._local = threading.local()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('JOBS_QUEUE_PATH',
+                              os.environ.get('JOBS_QUEUE_PATH', os.path.join(app.instance_path, 'jobs.db')))
+        app.config.setdefault('JOBS_LOCAL_SINK_PATH',
+                              os.environ.get('JOBS_LOCAL_SINK_PATH', os.path.join(app.instance_path, 'outbox.jsonl')))
+        app.config.setdefault('JOBS_BATCH_SIZE', 50)
+        app.config.setdefault('JOBS_MAX_ATTEMPTS', 5)
+        # задержка перед повтором: JOBS_RETRY_DELAY * 2 ** (попытка - 1) секунд
+        app.config.setdefault('JOBS_RETRY_DELAY', 2.0)
+        app.config.setdefault('JOBS_POLL_INTERVAL', 1.0)
+        self.path = app.config['JOBS_QUEUE_PATH']
+        self.batch_size = app.config['JOBS_BATCH_SIZE']
+        self.max_attempts = app.config['JOBS_MAX_ATTEMPTS']
+        self.retry_delay = app.config['JOBS_RETRY_DELAY']
+        # пока настоящих отправителей нет, все события уходят в локальный файл
+        self.default_handler = LocalSink(app.config['JOBS_LOCAL_SINK_PATH'])
+        app.extensions['jobs'] = self
+
+        event.listen(db.session, 'after_commit', self._enqueue_pending)
+        event.listen(db.session, 'after_rollback', self._drop_pending)
+
+        @app.cli.command('jobs-worker')
+        @click.option('--once', is_flag=True, help='обработать готовые задачи и выйти')
+        def jobs_worker_command(once):
+            """Обрабатывать фоновые задачи из очереди."""
+            if once:
+                click.echo(f'processed: {self.work()}')
+            else:
+                self.run_worker(app.config['JOBS_POLL_INTERVAL'], logger=app.logger)
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.path != self.path:
+            conn = sqlite3.connect(self.path, timeout=5.0, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('CREATE TABLE IF NOT EXISTS jobs ('
+                         'id INTEGER PRIMARY KEY, kind TEXT NOT NULL, payload TEXT NOT NULL, '
+                         "status TEXT NOT NULL DEFAULT 'pending', attempts INTEGER NOT NULL DEFAULT 0, "
+                         'run_at REAL NOT NULL, locked_until REAL, last_error TEXT)')
+            conn.execute('CREATE INDEX IF NOT EXISTS ix_jobs_ready ON jobs(status, run_at)')
+            self._local.conn = conn
+            self._local.path = self.path
+        return conn
+
+    def handler(self, kind):
+        """Декоратор: обработчик задач вида kind, вызывается как fn(kind, payloads)."""
+        def decorator(fn):
+            self.handlers[kind] = fn
+            return fn
+        return decorator
+
+    def enqueue(self, kind, payload, now=None):
+        now = time.time() if now is None else now
+        self._connect().execute('INSERT INTO jobs(kind, payload, run_at) VALUES (?, ?, ?)',
+                                (kind, json.dumps(payload, ensure_ascii=False), now))
+
+    def on_commit(self, kind, payload):
+        """Поставить задачу, когда текущая транзакция db.session закоммитится; при rollback — забыть."""
+        db.session.info.setdefault('pending_jobs', []).append((kind, payload))
+
+    def _enqueue_pending(self, session):
+        for kind, payload in session.info.pop('pending_jobs', []):
+            try:
+                self.enqueue(kind, payload)
+            except sqlite3.Error:
+                # данные уже закоммичены — не роняем запрос из-за побочного эффекта
+                current_app.logger.exception('failed to enqueue %s job', kind)
+
+    def _drop_pending(self, session):
+        session.info.pop('pending_jobs', None)
+
+    def claim(self, limit, now=None):
+        """Забрать до limit готовых задач: [(id, kind, payload, attempts)]."""
+        now = time.time() if now is None else now
+        conn = self._connect()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            rows = conn.execute(
+                "SELECT id, kind, payload, attempts FROM jobs "
+                "WHERE (status = 'pending' AND run_at <= ?) OR (status = 'running' AND locked_until < ?) "
+                "ORDER BY id LIMIT ?", (now, now, limit)).fetchall()
+            conn.executemany("UPDATE jobs SET status = 'running', locked_until = ?, attempts = attempts + 1 "
+                             "WHERE id = ?", [(now + self.LEASE, row[0]) for row in rows])
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        return [(id, kind, json.loads(payload), attempts + 1) for id, kind, payload, attempts in rows]
+
+    def _complete(self, jobs):
+        self._connect().executemany('DELETE FROM jobs WHERE id = ?', [(job[0],) for job in jobs])
+
+    def _fail(self, jobs, error, now):
+        self._connect().executemany(
+            "UPDATE jobs SET status = ?, run_at = ?, locked_until = NULL, last_error = ? WHERE id = ?",
+            [('dead' if attempts >= self.max_attempts else 'pending',
+              now + self.retry_delay * 2 ** (attempts - 1), error, id)
+             for id, kind, payload, attempts in jobs])
+
+    def work(self, now=None):
+        """Обработать готовые задачи пачками по JOBS_BATCH_SIZE. Возвращает число успешно выполненных."""
+        done = 0
+        while True:
+            jobs = self.claim(self.batch_size, now)
+            if not jobs:
+                return done
+            by_kind = {}
+            for job in jobs:
+                by_kind.setdefault(job[1], []).append(job)
+            for kind, group in by_kind.items():
+                handle = self.handlers.get(kind, self.default_handler)
+                try:
+                    handle(kind, [job[2] for job in group])
+                except Exception as e:
+                    self._fail(group, repr(e), time.time() if now is None else now)
+                else:
+                    self._complete(group)
+                    done += len(group)
+
+    def counts(self):
+        return dict(self._connect().execute('SELECT status, count(*) FROM jobs GROUP BY status').fetchall())
+
+    def run_worker(self, poll_interval=1.0, stop=None, logger=None):
+        stop = stop or threading.Event()
+        while not stop.is_set():
+            try:
+                if not self.work():
+                    stop.wait(poll_interval)
+            except sqlite3.Error:
+                if logger:
+                    logger.exception('jobs worker iteration failed')
+                stop.wait(poll_interval)
+
+
+def user_event(user_id, actor_id=None):
+    """Данные события пользователя для очереди."""
+    return {'user_id': user_id, 'actor_id': actor_id, 'at': datetime.utcnow().isoformat(timespec='seconds')}
+
+
+jobs = JobQueue()
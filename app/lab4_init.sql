@@ -8,19 +8,31 @@ CREATE TABLE IF NOT EXISTS roles (
 -- Создание таблицы пользователей
 CREATE TABLE IF NOT EXISTS users (
     id INTEGER PRIMARY KEY AUTOINCREMENT,
-    login TEXT NOT NULL UNIQUE,
+    login TEXT NOT NULL,
     password_hash TEXT NOT NULL,
     last_name TEXT,
     first_name TEXT,
     patronymic TEXT,
     role_id INTEGER,
     created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+    updated_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+    version INTEGER NOT NULL DEFAULT 1,
+    deleted_at DATETIME,
+    full_name VARCHAR(400) GENERATED ALWAYS AS (trim(coalesce(' ' || nullif(last_name, ''), '')
+        || coalesce(' ' || nullif(first_name, ''), '') || coalesce(' ' || nullif(patronymic, ''), ''))) STORED,
+    -- ФИО после str.casefold() для сортировки; пустые значения приложение досчитает при запуске
+    full_name_key VARCHAR(400),
     FOREIGN KEY (role_id) REFERENCES roles(id)
 );
 
+-- Частичные индексы для мягкого удаления: логин уникален среди живых пользователей
+CREATE UNIQUE INDEX IF NOT EXISTS ux_users_login_live ON users (login) WHERE deleted_at IS NULL;
+CREATE INDEX IF NOT EXISTS ix_users_deleted ON users (deleted_at) WHERE deleted_at IS NOT NULL;
+CREATE INDEX IF NOT EXISTS ix_users_name_key ON users (full_name_key) WHERE deleted_at IS NULL;
+
 -- Добавляем тестовую роль
 INSERT INTO roles (name, description) VALUES ('Admin', 'Администратор системы');
 
 -- Добавляем тестового пользователя (пароль хеш: "Zalanet_514" через werkzeug)
-INSERT INTO users (login, password_hash, last_name, first_name, patronymic, role_id)
-VALUES ('admin', 'scrypt:32768:8:1$PuniRBOszMr3ls43$f3de290549df2da53893a326ad95f44cb2749bb2a97b02807f58ba374e2bd120f933d817e5743844a780639ba5718324b0417c93309684f50a2540499eeb58f8', 'Админов', 'Админ', 'Админович', 1);
+INSERT INTO users (login, password_hash, last_name, first_name, patronymic, role_id, full_name_key)
+VALUES ('admin', 'scrypt:32768:8:1$PuniRBOszMr3ls43$f3de290549df2da53893a326ad95f44cb2749bb2a97b02807f58ba374e2bd120f933d817e5743844a780639ba5718324b0417c93309684f50a2540499eeb58f8', 'Админов', 'Админ', 'Админович', 1, 'админов админ админович');
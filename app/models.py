@@ -1,10 +1,29 @@
 
+import fcntl
+from contextlib import contextmanager
 from flask_login import UserMixin
 from datetime import datetime
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import DDL, event, inspect, select, text, update
+from sqlalchemy.schema import CreateTable
 
 db = SQLAlchemy()
 
+# ФИО из непустых частей через пробел — то же, что раньше собирал User.fio() в Python
+FULL_NAME_SQL = ("trim(coalesce(' ' || nullif(last_name, ''), '') || coalesce(' ' || nullif(first_name, ''), '')"
+                 " || coalesce(' ' || nullif(patronymic, ''), ''))")
+NAME_PARTS = ('last_name', 'first_name', 'patronymic')
+
+
+def compose_full_name(last_name, first_name, patronymic):
+    # то же, что FULL_NAME_SQL
+    return ' '.join(p for p in (last_name, first_name, patronymic) if p).strip()
+
+
+def name_key(last_name, first_name, patronymic):
+    """Ключ сортировки по ФИО: casefold Python сворачивает регистр любых букв, а не только латиницы, как NOCASE."""
+    return compose_full_name(last_name, first_name, patronymic).casefold()
+
 class Role(db.Model):
     __tablename__ = 'roles'
     id = db.Column(db.Integer, primary_key=True)
@@ -14,20 +33,276 @@ class Role(db.Model):
 class User(UserMixin, db.Model):   # ← добавлен UserMixin
     __tablename__ = 'users'
     id = db.Column(db.Integer, primary_key=True)
-    login = db.Column(db.String(128), unique=True, nullable=False)
+    # уникален только среди живых пользователей — см. ux_users_login_live
+    login = db.Column(db.String(128), nullable=False)
     password_hash = db.Column(db.String(256), nullable=False)
     last_name = db.Column(db.String(128))
     first_name = db.Column(db.String(128))
     patronymic = db.Column(db.String(128))
     role_id = db.Column(db.Integer, db.ForeignKey('roles.id'), nullable=True)
     created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    # время последнего изменения строки (ETag/Last-Modified в /api/users); в старых строках пусто — там created_at
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, nullable=True)
+    # версия строки для оптимистичной блокировки, растёт при каждом UPDATE
+    version = db.Column(db.Integer, nullable=False, default=1, server_default='1')
+    # мягкое удаление: строка скрыта сразу, физически её удаляет очистка в воркере очереди (app/purge.py)
+    deleted_at = db.Column(db.DateTime, nullable=True)
+    # ФИО считает сама БД при каждой записи; по нему сортируем и его показываем
+    full_name = db.Column(db.String(400), db.Computed(FULL_NAME_SQL, persisted=True))
+    # name_key(ФИО); SQLite так не умеет, поэтому ключ пишет приложение: события ORM ниже и update_user_versioned
+    full_name_key = db.Column(db.String(400))
 
     role = db.relationship('Role', backref='users')
 
+    __table_args__ = (
+        # логин занят только живым пользователем: после мягкого удаления его можно создать заново, не дожидаясь очистки
+        db.Index('ux_users_login_live', 'login', unique=True, sqlite_where=text('deleted_at IS NULL')),
+        # удалённые — для очистки
+        db.Index('ix_users_deleted', 'deleted_at', sqlite_where=text('deleted_at IS NOT NULL')),
+        # сортировка списка по ФИО без учёта регистра; id в индексе неявно (это rowid)
+        db.Index('ix_users_name_key', 'full_name_key', sqlite_where=text('deleted_at IS NULL')),
+    )
+
+    @classmethod
+    def not_deleted(cls):
+        """Условие для выборок: пользователь не удалён."""
+        return cls.deleted_at.is_(None)
+
+    @property
+    def is_admin(self):
+        # роль администратора называется admin (в lab4_init.sql — Admin)
+        return self.role is not None and self.role.name.lower() == 'admin'
+
     def get_id(self):
         # UserMixin уже даёт реализацию, но на всякий случай:
         return str(self.id)
 
     def fio(self):
-        parts = [self.last_name or '', self.first_name or '', self.patronymic or '']
-        return ' '.join(p for p in parts if p).strip()
+        if self.full_name is not None:
+            return self.full_name
+        # объект ещё не сохранён — собираем так же, как FULL_NAME_SQL
+        return compose_full_name(self.last_name, self.first_name, self.patronymic)
+
+
+@event.listens_for(User, 'before_insert')
+@event.listens_for(User, 'before_update')
+def _set_name_key(mapper, connection, target):
+    target.full_name_key = name_key(target.last_name, target.first_name, target.patronymic)
+
+
+class Post(db.Model):
+    __tablename__ = 'posts'
+    id = db.Column(db.Integer, primary_key=True)
+    title = db.Column(db.String(255), nullable=False)
+    text = db.Column(db.Text, nullable=False)
+    author = db.Column(db.String(255), nullable=False)
+    date = db.Column(db.DateTime, nullable=False)
+    image_id = db.Column(db.String(255), nullable=False)
+
+    __table_args__ = (
+        # лента: ORDER BY date DESC, id DESC с keyset-пагинацией по (date, id)
+        db.Index('ix_posts_date_id', 'date', 'id'),
+    )
+
+
+class Comment(db.Model):
+    """Комментарий к посту; ответы ссылаются на родителя через parent_id."""
+    __tablename__ = 'comments'
+    id = db.Column(db.Integer, primary_key=True)
+    post_id = db.Column(db.Integer, db.ForeignKey('posts.id'), nullable=False)
+    parent_id = db.Column(db.Integer, db.ForeignKey('comments.id'), nullable=True)
+    author = db.Column(db.String(255), nullable=False)
+    text = db.Column(db.Text, nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    # число прямых ответов считается при записи, чтобы не делать COUNT на каждый комментарий
+    reply_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+
+    parent = db.relationship('Comment', remote_side=[id])
+
+    __table_args__ = (
+        # страница комментариев одного уровня: WHERE post_id = ? AND parent_id IS/= ? AND id > ? ORDER BY id
+        db.Index('ix_comments_thread', 'post_id', 'parent_id', 'id'),
+    )
+
+    def to_dict(self):
+        return {'id': self.id, 'author': self.author, 'text': self.text, 'reply_count': self.reply_count}
+
+
+class CommentStats(db.Model):
+    """Заранее посчитанные счётчики комментариев поста."""
+    __tablename__ = 'comment_stats'
+    post_id = db.Column(db.Integer, db.ForeignKey('posts.id'), primary_key=True)
+    top_level = db.Column(db.Integer, nullable=False, default=0)
+    total = db.Column(db.Integer, nullable=False, default=0)
+
+
+class AuditEvent(db.Model):
+    """Запись журнала действий: кто (actor_id), что сделал (action) и с кем (target_id).
+
+    Таблица только для добавления — UPDATE и DELETE запрещены триггерами. Ссылок на users нет:
+    записи должны пережить физическое удаление пользователей.
+    """
+    __tablename__ = 'audit_log'
+    id = db.Column(db.Integer, primary_key=True)
+    at = db.Column(db.DateTime, nullable=False)
+    actor_id = db.Column(db.Integer, nullable=True)
+    action = db.Column(db.String(64), nullable=False)
+    target_id = db.Column(db.Integer, nullable=True)
+
+    __table_args__ = (
+        # просмотр журнала: новые первыми, keyset-пагинация по (at, id), фильтры по автору и цели
+        db.Index('ix_audit_at', 'at', 'id'),
+        db.Index('ix_audit_actor', 'actor_id', 'at', 'id'),
+        db.Index('ix_audit_target', 'target_id', 'at', 'id'),
+    )
+
+
+for _op in ('UPDATE', 'DELETE'):
+    event.listen(AuditEvent.__table__, 'after_create', DDL(
+        f'CREATE TRIGGER IF NOT EXISTS audit_log_no_{_op.lower()} BEFORE {_op} ON audit_log '
+        "BEGIN SELECT RAISE(ABORT, 'audit_log is append-only'); END"))
+
+
+def update_user_versioned(user_id, version, **values):
+    """Точечный UPDATE users ... WHERE id = ? AND version = ?.
+
+    Возвращает False, если строку уже изменили (версия не совпала) или её нет.
+    Коммит остаётся за вызывающим кодом.
+    """
+    if any(name in values for name in NAME_PARTS):
+        # ключ сортировки считается из ФИО целиком — недостающие части берём из строки
+        current = db.session.execute(select(*(getattr(User, name) for name in NAME_PARTS))
+                                     .where(User.id == user_id)).first()
+        if current is None:
+            return False
+        parts = {**current._mapping, **values}
+        values['full_name_key'] = name_key(*(parts[name] for name in NAME_PARTS))
+    result = db.session.execute(
+        update(User)
+        .where(User.id == user_id, User.version == version, User.not_deleted())
+        .values(version=User.version + 1, **values)
+    )
+    return result.rowcount == 1
+
+
+class UserRow:
+    """Лёгкая строка пользователя для списков: только то, что показывается, без ORM-состояния.
+
+    fio() совместим с User.fio(), поэтому шаблоны работают с обоими типами.
+    """
+    __slots__ = ('id', 'full_name', 'role_name')
+
+    def __init__(self, id, full_name, role_name):
+        self.id = id
+        self.full_name = full_name
+        self.role_name = role_name
+
+    def fio(self):
+        return self.full_name or ''
+
+
+def user_rows(session=None, by_name=False):
+    """Живые пользователи с названием роли одним Core-запросом, по id или по ФИО.
+
+    В отличие от session.query(User) не заполняет identity map и не грузит relationship role.
+    Сортировка по ФИО — по full_name_key (индекс ix_users_name_key), без учёта регистра и для кириллицы.
+    """
+    session = session or db.session
+    order = (User.full_name_key, User.id) if by_name else (User.id,)
+    stmt = (
+        select(User.id, User.full_name, Role.name)
+        .outerjoin(Role, User.role_id == Role.id)
+        .where(User.not_deleted())
+        .order_by(*order)
+    )
+    return [UserRow(*row) for row in session.execute(stmt)]
+
+
+# колонки, появившиеся после lab4_init.sql: (таблица, колонка, DDL для ALTER TABLE ADD COLUMN)
+SCHEMA_UPGRADES = [
+    ('users', 'version', 'INTEGER NOT NULL DEFAULT 1'),
+    ('users', 'deleted_at', 'DATETIME'),
+    # ALTER TABLE не допускает DEFAULT с текущим временем — у старых строк NULL до первого изменения
+    ('users', 'updated_at', 'DATETIME'),
+    # ALTER TABLE в SQLite не добавляет STORED-колонки, поэтому в старых БД full_name — VIRTUAL;
+    # значение и индекс те же, оно лишь вычисляется при чтении строки
+    ('users', 'full_name', f'VARCHAR(400) GENERATED ALWAYS AS ({FULL_NAME_SQL}) VIRTUAL'),
+    # заполняет fill_name_keys
+    ('users', 'full_name_key', 'VARCHAR(400)'),
+]
+
+
+def fill_name_keys(conn, batch=1000):
+    """Досчитывает full_name_key у строк, записанных в обход приложения (старые БД, lab4_init.sql).
+
+    Обычным UPDATE без updated_at и version: ФИО не менялось, ETag в /api/users остаётся прежним.
+    """
+    while True:
+        rows = conn.execute(text('SELECT id, last_name, first_name, patronymic FROM users '
+                                 'WHERE full_name_key IS NULL LIMIT :batch'), {'batch': batch}).all()
+        if not rows:
+            return
+        conn.execute(text('UPDATE users SET full_name_key = :key WHERE id = :id'),
+                     [{'id': row.id, 'key': name_key(row.last_name, row.first_name, row.patronymic)} for row in rows])
+
+
+def _login_unique_constraint():
+    """True, если на users.login осталось старое ограничение UNIQUE на всю таблицу."""
+    for _, name, unique, origin, _ in db.session.execute(text('PRAGMA index_list(users)')):
+        if unique and origin == 'u':
+            columns = [row[2] for row in db.session.execute(text(f"PRAGMA index_info('{name}')"))]
+            if columns == ['login']:
+                return True
+    return False
+
+
+def _rebuild_users_table():
+    """Пересоздаёт users по текущей модели с копированием строк.
+
+    Ограничение UNIQUE в SQLite не снять ALTER TABLE, поэтому так, по обычной схеме SQLite:
+    новая таблица, INSERT ... SELECT, DROP, RENAME. Вычисляемые колонки не копируются — их посчитает БД,
+    индексы создаёт upgrade_schema после.
+    """
+    ddl = str(CreateTable(User.__table__).compile(db.engine))
+    ddl = ddl.replace('CREATE TABLE users ', 'CREATE TABLE users_rebuild ', 1)
+    columns = ', '.join(c.name for c in User.__table__.columns if c.computed is None)
+    db.session.execute(text(ddl))
+    db.session.execute(text(f'INSERT INTO users_rebuild ({columns}) SELECT {columns} FROM users'))
+    db.session.execute(text('DROP TABLE users'))
+    db.session.execute(text('ALTER TABLE users_rebuild RENAME TO users'))
+
+
+@contextmanager
+def schema_lock(path):
+    """Блокировка файла path на время миграции: её ждут все процессы хоста, импортирующие приложение.
+
+    Воркеры gunicorn, `flask jobs-worker` и CLI стартуют одновременно; без блокировки двое видят, что колонки
+    или таблицы нет, и второй ALTER/CREATE падает. Под блокировкой следующий процесс проверяет схему
+    уже после первого и ничего не делает.
+    """
+    with open(path, 'a') as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def upgrade_schema():
+    """Доводит существующую БД до текущих моделей: новые таблицы, недостающие колонки и индексы."""
+    db.create_all()
+    inspector = inspect(db.engine)
+    for table, column, ddl in SCHEMA_UPGRADES:
+        if column not in {c['name'] for c in inspector.get_columns(table)}:
+            db.session.execute(text(f'ALTER TABLE {table} ADD COLUMN {column} {ddl}'))
+    # логин уникален только среди живых пользователей (ux_users_login_live)
+    if _login_unique_constraint():
+        _rebuild_users_table()
+    # индекс по id дублировал первичный ключ; индекс по full_name COLLATE NOCASE заменён ix_users_name_key
+    db.session.execute(text('DROP INDEX IF EXISTS ix_users_live'))
+    db.session.execute(text('DROP INDEX IF EXISTS ix_users_full_name'))
+    fill_name_keys(db.session)
+    db.session.commit()
+    for table in db.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(db.engine, checkfirst=True)
@@ -0,0 +1,211 @@
+import os
+import secrets
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+
+from flask import current_app
+from sqlalchemy import update
+from werkzeug.security import generate_password_hash, check_password_hash
+
+from app.models import db, User
+
+# уровни стоимости хеша для PASSWORD_HASH_POLICY: имя -> метод werkzeug.
+# scrypt:N:r:p занимает около 128 * N * r байт памяти на один хеш; цены и память на своей машине —
+# python -m benchmarks.bench_password_hash
+HASH_POLICIES = {
+    'scrypt-high': 'scrypt:65536:8:1',
+    'scrypt': 'scrypt:32768:8:1',   # умолчание werkzeug
+    'scrypt-low': 'scrypt:16384:8:1',
+    'pbkdf2': 'pbkdf2:sha256:600000',
+    'pbkdf2-low': 'pbkdf2:sha256:260000',
+}
+
+
+def hash_password(password):
+    """Хеш пароля методом из PASSWORD_HASH_METHOD (в тестах — дешёвый, см. app/tests/conftest.py)."""
+    return generate_password_hash(password, method=current_app.config['PASSWORD_HASH_METHOD'])
+
+
+@lru_cache(maxsize=None)
+def method_prefix(method):
+    """Как метод записан в начале хеша: werkzeug дописывает параметры по умолчанию ('scrypt' -> 'scrypt:32768:8:1')."""
+    return generate_password_hash('', method=method).split('$', 1)[0]
+
+
+def needs_rehash(pwhash, method=None):
+    """True, если хеш посчитан не тем методом или не с теми параметрами, что сейчас в PASSWORD_HASH_METHOD."""
+    method = method or current_app.config['PASSWORD_HASH_METHOD']
+    return pwhash.split('$', 1)[0] != method_prefix(method)
+
+
+class NegativeLoginCache:
+    """LRU с TTL для логинов, которых точно нет в БД."""
+
+    def __init__(self, max_size=10000, ttl=300):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._items = OrderedDict()   # login -> когда добавлен
+        self._lock = threading.Lock()
+
+    def __contains__(self, login):
+        now = time.monotonic()
+        with self._lock:
+            added = self._items.get(login)
+            if added is None:
+                return False
+            if now - added > self.ttl:
+                del self._items[login]
+                return False
+            self._items.move_to_end(login)
+            return True
+
+    def add(self, login):
+        with self._lock:
+            self._items[login] = time.monotonic()
+            self._items.move_to_end(login)
+            while len(self._items) > self.max_size:
+                self._items.popitem(last=False)
+
+    def discard(self, login):
+        with self._lock:
+            self._items.pop(login, None)
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+
+    def __len__(self):
+        return len(self._items)
+
+
+class LoginVerifier:
+    """Проверка пароля при входе с одинаковым временем ответа для существующих и несуществующих логинов.
+
+    Если логина нет, первый раз проверяется заранее посчитанный фиктивный хеш (реальная цена scrypt;
+    считается при прогреве воркера, см. app/health.py), а логин попадает в negative-кеш. Повторные
+    попытки с тем же логином уже не тратят CPU: ответ просто выдерживается на «бюджет» — скользящее
+    среднее времени настоящих проверок хешей текущего метода (у каждого метода своё: входы со старыми
+    хешами до их пересчёта его не искажают). time.sleep не занимает CPU, а от флуда защищает
+    LoginThrottle, который отсекает попытки ещё до проверки.
+
+    После удачного входа хеш, посчитанный по старой политике, пересчитывается текущей
+    (upgrade_hash) — в фоновом потоке, чтобы вход не ждал второго дорогого хеширования.
+    """
+
+    # вес нового замера в скользящем среднем
+    ALPHA = 0.2
+
+    def __init__(self, app=None):
+        self.negative = NegativeLoginCache()
+        # префикс метода хеша (method_prefix) -> скользящее среднее времени проверки / фиктивный хеш
+        self.budgets = {}
+        self.max_sleep = None
+        self._dummy_hashes = {}
+        self._lock = threading.Lock()
+        self._executor = None
+        self._executor_pid = None
+        self._rehashing = set()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('LOGIN_NEGATIVE_CACHE_SIZE', 10000)
+        app.config.setdefault('LOGIN_NEGATIVE_CACHE_TTL', 300)
+        # потолок выдержки для повторных попыток с несуществующим логином, секунд; по умолчанию нет.
+        # Потолок ниже цены хеша снова отличает несуществующие логины от неверного пароля по времени ответа
+        app.config.setdefault('LOGIN_NEGATIVE_MAX_SLEEP', None)
+        app.config.setdefault('PASSWORD_HASH_POLICY', os.environ.get('PASSWORD_HASH_POLICY', 'scrypt'))
+        policy = app.config['PASSWORD_HASH_POLICY']
+        if policy not in HASH_POLICIES:
+            raise ValueError(f'unknown PASSWORD_HASH_POLICY {policy!r}, expected one of {", ".join(HASH_POLICIES)}')
+        # явный PASSWORD_HASH_METHOD важнее политики (так тесты ставят дешёвый хеш)
+        app.config.setdefault('PASSWORD_HASH_METHOD', os.environ.get('PASSWORD_HASH_METHOD') or HASH_POLICIES[policy])
+        app.config.setdefault('PASSWORD_REHASH_ON_LOGIN', True)
+        self.negative = NegativeLoginCache(app.config['LOGIN_NEGATIVE_CACHE_SIZE'],
+                                           app.config['LOGIN_NEGATIVE_CACHE_TTL'])
+        self.max_sleep = app.config['LOGIN_NEGATIVE_MAX_SLEEP']
+        app.extensions['login_verifier'] = self
+
+    @property
+    def dummy_hash(self):
+        # считаем один раз на метод, теми же параметрами, что и настоящие хеши
+        prefix = method_prefix(current_app.config['PASSWORD_HASH_METHOD'])
+        pwhash = self._dummy_hashes.get(prefix)
+        if pwhash is None:
+            with self._lock:
+                pwhash = self._dummy_hashes.get(prefix)
+                if pwhash is None:
+                    pwhash = self._dummy_hashes[prefix] = hash_password(secrets.token_urlsafe(16))
+        return pwhash
+
+    @property
+    def budget(self):
+        """Бюджет для текущего PASSWORD_HASH_METHOD или None, пока таких проверок не было."""
+        return self.budgets.get(method_prefix(current_app.config['PASSWORD_HASH_METHOD']))
+
+    def _timed_check(self, pwhash, password):
+        start = time.perf_counter()
+        ok = check_password_hash(pwhash, password)
+        elapsed = time.perf_counter() - start
+        prefix = pwhash.split('$', 1)[0]
+        with self._lock:
+            budget = self.budgets.get(prefix)
+            self.budgets[prefix] = elapsed if budget is None else (1 - self.ALPHA) * budget + self.ALPHA * elapsed
+        return ok
+
+    def verify(self, login, user, password):
+        """True, если user найден и пароль верный. user — результат поиска по login (или None)."""
+        if user is not None:
+            return self._timed_check(user.password_hash, password)
+        # Поиск в БД выполняется всегда, так что устаревшая запись в кеше (пользователя уже создали)
+        # влияет только на то, как мы тратим время на отказ, но не на результат.
+        budget = self.budget
+        if login in self.negative and budget is not None:
+            time.sleep(budget if self.max_sleep is None else min(budget, self.max_sleep))
+            return False
+        self._timed_check(self.dummy_hash, password)
+        self.negative.add(login)
+        return False
+
+    def upgrade_hash(self, user, password):
+        """Пересчитать устаревший хеш user в фоне. Вызывать только после успешной проверки password.
+
+        Возвращает Future (результат — True, если хеш заменён) или None, если пересчитывать не нужно.
+        """
+        app = current_app._get_current_object()
+        if not app.config['PASSWORD_REHASH_ON_LOGIN'] or not needs_rehash(user.password_hash):
+            return None
+        with self._lock:
+            if user.id in self._rehashing:
+                return None
+            self._rehashing.add(user.id)
+        return self._get_executor().submit(self._rehash, app, user.id, user.password_hash, password)
+
+    def _get_executor(self):
+        # поток свой в каждом процессе: после fork у воркера gunicorn его нет
+        with self._lock:
+            if self._executor_pid != os.getpid():
+                self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='rehash')
+                self._executor_pid = os.getpid()
+            return self._executor
+
+    def _rehash(self, app, user_id, old_hash, password):
+        try:
+            with app.app_context():
+                new_hash = hash_password(password)
+                # замена только поверх того же хеша: если пароль успели сменить, ничего не трогаем.
+                # version и updated_at не трогаем — для редактирования и API пользователь не изменился
+                result = db.session.execute(update(User)
+                                            .where(User.id == user_id, User.password_hash == old_hash)
+                                            .values(password_hash=new_hash, updated_at=User.updated_at))
+                db.session.commit()
+                return result.rowcount == 1
+        except Exception:
+            app.logger.exception('password rehash failed for user %s', user_id)
+            return False
+        finally:
+            with self._lock:
+                self._rehashing.discard(user_id)
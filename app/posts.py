@@ -0,0 +1,61 @@
+from flask import abort
+from sqlalchemy import delete, func, select, tuple_
+from sqlalchemy.exc import IntegrityError
+
+from app.models import db, Post, Comment, CommentStats
+from app.shared_cache import shared_cache
+
+# сколько символов текста показывать в ленте
+EXCERPT_LENGTH = 100
+
+
+def seed_posts(generate_post, count=5):
+    """Заполняет пустую таблицу posts сгенерированными постами (комментарии создаются при первом просмотре).
+
+    id задаются явно, поэтому если два воркера стартуют одновременно, второй упрётся
+    в первичный ключ и просто откатится.
+    """
+    if db.session.scalar(select(Post.id).limit(1)) is not None:
+        return False
+    # комментарии, привязанные к индексам старого списка постов, больше ни к чему не относятся
+    db.session.execute(delete(Comment))
+    db.session.execute(delete(CommentStats))
+    db.session.add_all(Post(id=i + 1, **generate_post(i)) for i in range(count))
+    try:
+        db.session.commit()
+    except IntegrityError:
+        db.session.rollback()
+        return False
+    feed_page.invalidate()
+    return True
+
+
+# страницы ленты общие для всех воркеров хоста (см. app/shared_cache.py)
+@shared_cache.cached('posts', ttl=300)
+def feed_page(after=None, limit=10):
+    """Страница ленты: новые посты первыми, keyset-пагинация по (date, id).
+
+    Из БД берутся только поля карточки и первые EXCERPT_LENGTH символов текста.
+    after — id последнего поста предыдущей страницы. Возвращает (строки, id для следующей страницы).
+    """
+    query = (
+        select(Post.id, Post.title, Post.author, Post.date, Post.image_id,
+               func.substr(Post.text, 1, EXCERPT_LENGTH).label('excerpt'),
+               (func.length(Post.text) > EXCERPT_LENGTH).label('truncated'))
+        .order_by(Post.date.desc(), Post.id.desc())
+        .limit(limit + 1)
+    )
+    if after is not None:
+        anchor = select(Post.date).where(Post.id == after).scalar_subquery()
+        query = query.where(tuple_(Post.date, Post.id) < tuple_(anchor, after))
+    rows = db.session.execute(query).all()
+    next_after = rows[limit - 1].id if len(rows) > limit else None
+    return rows[:limit], next_after
+
+
+def get_post_or_404(post_id):
+    """Единственный путь поиска поста по id: identity map сессии, затем первичный ключ."""
+    post = db.session.get(Post, post_id)
+    if post is None:
+        abort(404)
+    return post
@@ -0,0 +1,233 @@
+import cProfile
+import io
+import os
+import pstats
+import re
+import sqlite3
+import sys
+import threading
+import time
+from collections import Counter
+from pathlib import Path
+
+from flask import Blueprint, Response, abort, current_app, g, redirect, render_template, request, url_for
+from flask_login import current_user
+
+from app.sqlstats import query_stats
+from app.users import admin_required
+
+profiling_bp = Blueprint('profiling', __name__)
+
+# имя сохранённого профиля: время-эндпоинт-pid.prof
+PROFILE_NAME = re.compile(r'^[\w.-]+\.prof$')
+SORT_KEYS = ('cumulative', 'tottime', 'ncalls', 'filename')
+
+
+def _profile_requested():
+    return request.headers.get('X-Profile') == '1' or request.args.get('_profile') == '1'
+
+
+class RequestProfiler:
+    """Профилирование одного запроса «на месте» через cProfile.
+
+    Запрос с заголовком `X-Profile: 1` или параметром `?_profile=1` от администратора выполняется
+    под cProfile, статистика сохраняется в PROFILE_DIR, а её имя возвращается в заголовке X-Profile-Id.
+    Посмотреть — /admin/profiles/<имя> (текст pstats) или ?raw=1 (файл для snakeviz и т.п.).
+    Для потоковых ответов в профиль попадает только работа до начала отправки тела.
+    """
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('PROFILE_ENABLED', True)
+        app.config.setdefault('PROFILE_DIR', os.path.join(app.instance_path, 'profiles'))
+        # сколько профилей хранить; старые удаляются
+        app.config.setdefault('PROFILE_KEEP', 100)
+        app.extensions['request_profiler'] = self
+        if app.config['PROFILE_ENABLED']:
+            app.before_request(self._start)
+            app.after_request(self._stop)
+
+    def _start(self):
+        # current_user (а с ним загрузка пользователя) — только если профиль действительно просят
+        if not _profile_requested() or not current_user.is_authenticated or not current_user.is_admin:
+            return
+        g.profiler = cProfile.Profile()
+        g.profiler.enable()
+
+    def _stop(self, response):
+        profiler = g.pop('profiler', None)
+        if profiler is None:
+            return response
+        profiler.disable()
+        directory = Path(current_app.config['PROFILE_DIR'])
+        directory.mkdir(parents=True, exist_ok=True)
+        name = f'{time.strftime("%Y%m%d-%H%M%S")}-{request.endpoint or "unknown"}-{os.getpid()}.prof'
+        profiler.dump_stats(directory / name)
+        self._prune(directory, current_app.config['PROFILE_KEEP'])
+        response.headers['X-Profile-Id'] = name
+        return response
+
+    @staticmethod
+    def _prune(directory, keep):
+        files = sorted(directory.glob('*.prof'), key=lambda p: p.stat().st_mtime, reverse=True)
+        for path in files[keep:]:
+            path.unlink(missing_ok=True)
+
+
+class StackSampler:
+    """Семплирующий профилировщик с низкими накладными расходами.
+
+    Фоновый поток в каждом воркере раз в PROFILE_SAMPLE_INTERVAL секунд снимает стеки всех потоков
+    (sys._current_frames, без sys.setprofile) и считает их в памяти. Раз в PROFILE_SAMPLE_FLUSH секунд
+    счётчики добавляются в общий для воркеров SQLite-файл, а /admin/profile/stacks отдаёт сумму
+    в формате collapsed stacks («кадр;кадр;кадр число»), который понимают flamegraph.pl и speedscope.
+    """
+
+    def __init__(self, path=None, interval=0.01, flush_interval=5.0, app=None):
+        self.path = path
+        self.interval = interval
+        self.flush_interval = flush_interval
+        self.counts = Counter()
+        self._labels = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._thread_pid = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('PROFILE_SAMPLING', os.environ.get('PROFILE_SAMPLING') == '1')
+        app.config.setdefault('PROFILE_SAMPLES_PATH', os.environ.get(
+            'PROFILE_SAMPLES_PATH', os.path.join(app.instance_path, 'stacks.db')))
+        app.config.setdefault('PROFILE_SAMPLE_INTERVAL', 0.01)
+        app.config.setdefault('PROFILE_SAMPLE_FLUSH', 5.0)
+        self.path = app.config['PROFILE_SAMPLES_PATH']
+        self.interval = app.config['PROFILE_SAMPLE_INTERVAL']
+        self.flush_interval = app.config['PROFILE_SAMPLE_FLUSH']
+        app.extensions['stack_sampler'] = self
+        if app.config['PROFILE_SAMPLING']:
+            # поток запускается в первом запросе уже в воркере, а не в мастере gunicorn до fork
+            app.before_request(self.ensure_running)
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.path != self.path:
+            conn = sqlite3.connect(self.path, timeout=2.0, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('CREATE TABLE IF NOT EXISTS stacks (stack TEXT PRIMARY KEY, count INTEGER NOT NULL)')
+            self._local.conn = conn
+            self._local.path = self.path
+        return conn
+
+    def _label(self, code):
+        label = self._labels.get(code)
+        if label is None:
+            label = self._labels[code] = f'{code.co_name} ({Path(code.co_filename).name}:{code.co_firstlineno})'
+        return label
+
+    def sample(self):
+        """Один снимок стеков всех потоков, кроме текущего."""
+        me = threading.get_ident()
+        stacks = []
+        for ident, frame in sys._current_frames().items():
+            if ident == me:
+                continue
+            labels = []
+            while frame is not None:
+                labels.append(self._label(frame.f_code))
+                frame = frame.f_back
+            stacks.append(';'.join(reversed(labels)))
+        with self._lock:
+            self.counts.update(stacks)
+
+    def flush(self):
+        with self._lock:
+            counts, self.counts = self.counts, Counter()
+        if counts:
+            conn = self._connect()
+            conn.execute('BEGIN IMMEDIATE')
+            conn.executemany('INSERT INTO stacks(stack, count) VALUES (?, ?) '
+                             'ON CONFLICT(stack) DO UPDATE SET count = count + excluded.count', counts.items())
+            conn.execute('COMMIT')
+
+    def collapsed(self):
+        rows = self._connect().execute('SELECT stack, count FROM stacks ORDER BY stack')
+        return ''.join(f'{stack} {count}\n' for stack, count in rows)
+
+    def clear(self):
+        with self._lock:
+            self.counts.clear()
+        self._connect().execute('DELETE FROM stacks')
+
+    def ensure_running(self):
+        if self._thread_pid == os.getpid():
+            return
+        self._thread_pid = os.getpid()
+        threading.Thread(target=self._run, name='stack-sampler', daemon=True).start()
+
+    def _run(self):
+        last_flush = time.monotonic()
+        while True:
+            time.sleep(self.interval)
+            self.sample()
+            if time.monotonic() - last_flush >= self.flush_interval:
+                last_flush = time.monotonic()
+                try:
+                    self.flush()
+                except sqlite3.Error:
+                    pass
+
+
+request_profiler = RequestProfiler()
+stack_sampler = StackSampler()
+
+
+@profiling_bp.route('/admin/profiles')
+@admin_required
+def profiles():
+    directory = Path(current_app.config['PROFILE_DIR'])
+    files = sorted(directory.glob('*.prof'), key=lambda p: p.stat().st_mtime, reverse=True) if directory.is_dir() else []
+    return render_template('profiles.html', title='Профили запросов', files=[p.name for p in files])
+
+
+@profiling_bp.route('/admin/profiles/<name>')
+@admin_required
+def profile_view(name):
+    path = Path(current_app.config['PROFILE_DIR']) / name
+    if not PROFILE_NAME.match(name) or not path.is_file():
+        abort(404)
+    if request.args.get('raw') == '1':
+        return Response(path.read_bytes(), mimetype='application/octet-stream',
+                        headers={'Content-Disposition': f'attachment; filename={name}'})
+    sort = request.args.get('sort')
+    out = io.StringIO()
+    pstats.Stats(str(path), stream=out).sort_stats(sort if sort in SORT_KEYS else 'cumulative').print_stats(50)
+    return Response(out.getvalue(), mimetype='text/plain')
+
+
+@profiling_bp.route('/admin/profile/stacks')
+@admin_required
+def stacks():
+    # сначала сбрасываем то, что накопил этот воркер, чтобы ответ был свежим
+    stack_sampler.flush()
+    return Response(stack_sampler.collapsed(), mimetype='text/plain',
+                    headers={'Content-Disposition': 'inline; filename=stacks.collapsed'})
+
+
+@profiling_bp.route('/admin/sql')
+@admin_required
+def sql_stats():
+    sort = request.args.get('sort', 'total')
+    rows = query_stats.top(request.args.get('limit', 20, type=int), sort)
+    return render_template('sql_stats.html', title='Статистика SQL', rows=rows, sort=sort,
+                           pid=os.getpid(), slow_ms=current_app.config['SQL_SLOW_QUERY_MS'])
+
+
+@profiling_bp.route('/admin/sql/reset', methods=['POST'])
+@admin_required
+def sql_stats_reset():
+    query_stats.reset()
+    return redirect(url_for('profiling.sql_stats'))
@@ -0,0 +1,63 @@
+import time
+from datetime import datetime, timedelta
+
+import click
+from sqlalchemy import delete, select
+
+from app.jobs import jobs
+from app.models import db, User
+
+PURGE_JOB = 'users.purge'
+
+
+def purge_deleted_users(batch_size=100, pause=0.0, grace=timedelta(0)):
+    """Физически удаляет мягко удалённых пользователей небольшими пачками.
+
+    Каждая пачка — отдельная короткая транзакция, между пачками можно сделать паузу,
+    чтобы запросы пользователей успевали получить блокировку записи SQLite.
+    Возвращает число удалённых строк.
+    """
+    total = 0
+    while True:
+        cutoff = datetime.utcnow() - grace
+        ids = db.session.scalars(
+            select(User.id)
+            .where(User.deleted_at.is_not(None), User.deleted_at <= cutoff)
+            .limit(batch_size)
+        ).all()
+        if not ids:
+            break
+        db.session.execute(delete(User).where(User.id.in_(ids)))
+        db.session.commit()
+        total += len(ids)
+        if pause:
+            time.sleep(pause)
+    return total
+
+
+def init_app(app):
+    """Очистка идёт в одном месте — в воркере очереди (`flask jobs-worker`), а не в каждом воркере gunicorn.
+
+    Удаление пользователя ставит задачу PURGE_JOB; сколько бы их ни накопилось, обработчик делает
+    один проход. Воркер очереди запускается процессом worker из Procfile. Где отдельного процесса нет,
+    то же делает cron:
+
+        */5 * * * * cd /srv/weblabs && flask --app app.app jobs-worker --once
+
+    `flask --app app.app purge-users` чистит только удалённых пользователей — остальные задачи
+    (уведомления) при этом копятся в очереди.
+    """
+    app.config.setdefault('USERS_PURGE_BATCH', 100)
+    app.config.setdefault('USERS_PURGE_PAUSE', 0.05)
+
+    @jobs.handler(PURGE_JOB)
+    def purge_job(kind, payloads):
+        purged = purge_deleted_users(app.config['USERS_PURGE_BATCH'], app.config['USERS_PURGE_PAUSE'])
+        if purged:
+            app.logger.info('purged %s deleted users', purged)
+
+    @app.cli.command('purge-users')
+    @click.option('--batch-size', default=100, show_default=True)
+    def purge_users_command(batch_size):
+        """Удалить из БД мягко удалённых пользователей."""
+        click.echo(f'purged: {purge_deleted_users(batch_size, app.config["USERS_PURGE_PAUSE"])}')
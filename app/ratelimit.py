@@ -0,0 +1,227 @@
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+
+
+class TokenBucketLimiter:
+    """Token bucket'ы в памяти процесса: O(1) на операцию, ограниченный размер, LRU-вытеснение.
+
+    capacity — сколько попыток можно сделать подряд, refill_rate — токенов в секунду.
+    Полные «вёдра» не хранятся: отсутствие ключа и есть полный bucket.
+    """
+
+    def __init__(self, capacity, refill_rate, max_keys=10000):
+        self.capacity = float(capacity)
+        self.refill_rate = float(refill_rate)
+        self.max_keys = max_keys
+        self._buckets = OrderedDict()   # key -> (tokens, updated_at)
+        self._lock = threading.Lock()
+
+    def _tokens(self, key, now):
+        state = self._buckets.get(key)
+        if state is None:
+            return self.capacity
+        tokens, updated = state
+        return min(self.capacity, tokens + (now - updated) * self.refill_rate)
+
+    def _retry_after(self, tokens):
+        if tokens >= 1:
+            return 0.0
+        return (1 - tokens) / self.refill_rate
+
+    def check(self, key, now=None):
+        """Сколько секунд ждать до следующей попытки (0 — можно сейчас). Токен не списывается."""
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            if key in self._buckets:
+                self._buckets.move_to_end(key)
+            return self._retry_after(self._tokens(key, now))
+
+    def consume(self, key, now=None):
+        """Списать токен. Возвращает True, если токен был."""
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            tokens = self._tokens(key, now)
+            ok = tokens >= 1
+            if ok:
+                tokens -= 1
+            self._buckets[key] = (tokens, now)
+            self._buckets.move_to_end(key)
+            while len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+            return ok
+
+    def refund(self, key, now=None):
+        """Вернуть списанный токен (попытка оказалась не в счёт)."""
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            if key in self._buckets:
+                self._buckets[key] = (min(self.capacity, self._tokens(key, now) + 1), now)
+
+    def reset(self, key):
+        with self._lock:
+            self._buckets.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._buckets.clear()
+
+    def __len__(self):
+        return len(self._buckets)
+
+
+class SQLiteTokenBucketLimiter:
+    """Тот же token bucket, но состояние лежит в SQLite-файле и общее для всех воркеров хоста.
+
+    Время берётся из time.time(): monotonic у каждого процесса своё.
+    """
+
+    # как часто (в операциях записи) чистить устаревшие ключи
+    PRUNE_EVERY = 256
+
+    def __init__(self, path, capacity, refill_rate, max_keys=10000):
+        self.path = str(path)
+        self.capacity = float(capacity)
+        self.refill_rate = float(refill_rate)
+        self.max_keys = max_keys
+        self._local = threading.local()
+        self._writes = 0
+        with self._connect() as conn:
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('CREATE TABLE IF NOT EXISTS buckets ('
+                         'key TEXT PRIMARY KEY, tokens REAL NOT NULL, updated REAL NOT NULL)')
+            conn.execute('CREATE INDEX IF NOT EXISTS ix_buckets_updated ON buckets(updated)')
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=1.0, isolation_level=None)
+            self._local.conn = conn
+        return conn
+
+    def _tokens(self, row, now):
+        if row is None:
+            return self.capacity
+        tokens, updated = row
+        return min(self.capacity, tokens + (now - updated) * self.refill_rate)
+
+    def check(self, key, now=None):
+        now = time.time() if now is None else now
+        row = self._connect().execute('SELECT tokens, updated FROM buckets WHERE key = ?', (key,)).fetchone()
+        tokens = self._tokens(row, now)
+        return 0.0 if tokens >= 1 else (1 - tokens) / self.refill_rate
+
+    def consume(self, key, now=None):
+        now = time.time() if now is None else now
+        conn = self._connect()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            row = conn.execute('SELECT tokens, updated FROM buckets WHERE key = ?', (key,)).fetchone()
+            tokens = self._tokens(row, now)
+            ok = tokens >= 1
+            if ok:
+                tokens -= 1
+            conn.execute('INSERT OR REPLACE INTO buckets(key, tokens, updated) VALUES (?, ?, ?)',
+                         (key, tokens, now))
+            self._writes += 1
+            if self._writes % self.PRUNE_EVERY == 0:
+                self._prune(conn, now)
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        return ok
+
+    def _prune(self, conn, now):
+        # ключи, успевшие полностью восстановиться, не нужны
+        full_after = self.capacity / self.refill_rate
+        conn.execute('DELETE FROM buckets WHERE updated < ?', (now - full_after,))
+        # если всё равно больше лимита — выкидываем самые давние
+        conn.execute('DELETE FROM buckets WHERE key IN ('
+                     'SELECT key FROM buckets ORDER BY updated DESC LIMIT -1 OFFSET ?)', (self.max_keys,))
+
+    def refund(self, key, now=None):
+        now = time.time() if now is None else now
+        conn = self._connect()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            row = conn.execute('SELECT tokens, updated FROM buckets WHERE key = ?', (key,)).fetchone()
+            if row is not None:
+                conn.execute('UPDATE buckets SET tokens = ?, updated = ? WHERE key = ?',
+                             (min(self.capacity, self._tokens(row, now) + 1), now, key))
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+
+    def reset(self, key):
+        self._connect().execute('DELETE FROM buckets WHERE key = ?', (key,))
+
+    def clear(self):
+        self._connect().execute('DELETE FROM buckets')
+
+
+class LoginThrottle:
+    """Ограничение попыток входа по IP и по логину.
+
+    Токен списывается до проверки пароля, одной операцией на bucket (try_acquire): параллельные
+    запросы не могут все пройти проверку раньше, чем кто-то из них спишет токен. Когда любой
+    из bucket'ов пуст, запрос отклоняется до обращения к БД и проверки хеша.
+    Удачный вход токен по IP возвращает, а bucket логина сбрасывает.
+    """
+
+    def __init__(self, app=None):
+        self.by_ip = None
+        self.by_login = None
+        self.enabled = False
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('LOGIN_RATELIMIT_ENABLED', True)
+        # (попыток, за сколько секунд восстанавливаются все попытки)
+        app.config.setdefault('LOGIN_RATELIMIT_IP', (20, 60))
+        app.config.setdefault('LOGIN_RATELIMIT_LOGIN', (5, 60))
+        app.config.setdefault('LOGIN_RATELIMIT_MAX_KEYS', 10000)
+        # None — состояние в памяти воркера; путь к файлу — общий SQLite для всех воркеров
+        app.config.setdefault('LOGIN_RATELIMIT_STORAGE', None)
+
+        self.enabled = app.config['LOGIN_RATELIMIT_ENABLED']
+        self.by_ip = self._make(app.config, 'LOGIN_RATELIMIT_IP', 'ip')
+        self.by_login = self._make(app.config, 'LOGIN_RATELIMIT_LOGIN', 'login')
+        app.extensions['login_throttle'] = self
+
+    @staticmethod
+    def _make(config, key, suffix):
+        capacity, period = config[key]
+        max_keys = config['LOGIN_RATELIMIT_MAX_KEYS']
+        storage = config['LOGIN_RATELIMIT_STORAGE']
+        if storage:
+            path = Path(storage)
+            path = path.with_name(f'{path.stem}-{suffix}{path.suffix}')
+            return SQLiteTokenBucketLimiter(path, capacity, capacity / period, max_keys)
+        return TokenBucketLimiter(capacity, capacity / period, max_keys)
+
+    def try_acquire(self, ip, login):
+        """Списать попытку с обоих bucket'ов. 0 — попытку можно выполнять, иначе — через сколько секунд повторить."""
+        if not self.enabled:
+            return 0.0
+        login = login.lower()
+        if not self.by_ip.consume(ip):
+            return self.by_ip.check(ip)
+        if not self.by_login.consume(login):
+            # попытка не состоялась — токен IP не должен пропасть
+            self.by_ip.refund(ip)
+            return self.by_login.check(login)
+        return 0.0
+
+    def succeeded(self, ip, login):
+        if self.enabled:
+            self.by_ip.refund(ip)
+            self.by_login.reset(login.lower())
+
+    def clear(self):
+        self.by_ip.clear()
+        self.by_login.clear()
@@ -0,0 +1,79 @@
+from flask import current_app, g
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import Session
+
+from app.models import db
+
+
+def _enable_wal(dbapi_conn, conn_record):
+    # в WAL читатели не ждут писателя и наоборот
+    cur = dbapi_conn.cursor()
+    cur.execute('PRAGMA journal_mode=WAL')
+    cur.close()
+
+
+class ReadReplica:
+    """Отдельный пул соединений только для чтения для страниц, которые ничего не пишут.
+
+    По умолчанию это та же SQLite-БД, открытая с mode=ro. Основная БД переводится в WAL,
+    поэтому читатели видят последний закоммиченный снимок и не ждут блокировок писателя;
+    окно устаревания равно нулю — данные видны сразу после commit.
+    Если задать SQLALCHEMY_READONLY_URI (например, периодически обновляемую копию файла),
+    окно устаревания равно периоду обновления этой копии.
+    Для БД в памяти реплики нет — чтение идёт через основной engine.
+    """
+
+    def __init__(self, db, app=None):
+        self.db = db
+        self._engines = {}
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('SQLALCHEMY_READONLY_URI', None)
+        app.config.setdefault('SQLITE_WAL', True)
+        app.extensions['read_replica'] = self
+        app.teardown_appcontext(self._close_session)
+        if app.config['SQLITE_WAL']:
+            with app.app_context():
+                if self.db.engine.url.get_backend_name() == 'sqlite':
+                    event.listen(self.db.engine, 'connect', _enable_wal)
+
+    def _create_engine(self, app):
+        uri = app.config['SQLALCHEMY_READONLY_URI']
+        if uri:
+            return create_engine(uri)
+        url = self.db.engine.url
+        if (url.get_backend_name() != 'sqlite' or url.database in (None, '', ':memory:')
+                or url.query.get('mode') == 'memory'):
+            return self.db.engine
+        return create_engine(f'sqlite:///file:{url.database}?mode=ro&uri=true')
+
+    @property
+    def engine(self):
+        app = current_app._get_current_object()
+        engine = self._engines.get(app)
+        if engine is None:
+            engine = self._engines[app] = self._create_engine(app)
+        return engine
+
+    @property
+    def session(self):
+        """Сессия только для чтения, живёт до конца app context."""
+        if 'ro_session' not in g:
+            g.ro_session = Session(bind=self.engine, autoflush=False)
+        return g.ro_session
+
+    def _close_session(self, exc=None):
+        session = g.pop('ro_session', None)
+        if session is not None:
+            session.close()
+
+    def dispose(self):
+        for engine in self._engines.values():
+            if engine is not self.db.engine:
+                engine.dispose()
+        self._engines.clear()
+
+
+read_replica = ReadReplica(db)
@@ -0,0 +1,83 @@
+from urllib.parse import parse_qsl
+
+from flask import current_app, request
+from werkzeug.exceptions import RequestEntityTooLarge
+
+# размер куска при чтении тела запроса
+CHUNK_SIZE = 8192
+
+
+def init_app(app):
+    # ограничения для страниц, которые показывают присланные данные (лаба 2)
+    app.config.setdefault('ECHO_MAX_QUERY_PARAMS', 100)
+    app.config.setdefault('ECHO_MAX_HEADERS', 100)
+    app.config.setdefault('ECHO_MAX_FORM_FIELDS', 100)
+    app.config.setdefault('ECHO_MAX_FORM_SIZE', 64 * 1024)
+
+
+def query_items():
+    """Параметры URL парами (ключ, значение); 413, если их больше ECHO_MAX_QUERY_PARAMS.
+
+    Число параметров считается по сырой строке запроса, до разбора.
+    """
+    raw = request.query_string
+    limit = current_app.config['ECHO_MAX_QUERY_PARAMS']
+    if raw and raw.count(b'&') + 1 > limit:
+        raise RequestEntityTooLarge()
+    return parse_qsl(raw.decode('latin-1'), keep_blank_values=True, encoding='utf-8', errors='replace')
+
+
+def header_items():
+    """Заголовки парами; 413, если их больше ECHO_MAX_HEADERS."""
+    headers = request.headers
+    if len(headers) > current_app.config['ECHO_MAX_HEADERS']:
+        raise RequestEntityTooLarge()
+    return list(headers.items())
+
+
+def iter_urlencoded(stream, max_fields, max_size, chunk_size=CHUNK_SIZE):
+    """Потоковый разбор application/x-www-form-urlencoded.
+
+    Тело читается кусками; как только превышен размер или число полей — RequestEntityTooLarge,
+    остаток тела не читается. В памяти одновременно держится один кусок и одно незаконченное поле.
+    """
+    size = 0
+    fields = 0
+    tail = b''
+    while True:
+        chunk = stream.read(chunk_size)
+        size += len(chunk)
+        if size > max_size:
+            raise RequestEntityTooLarge()
+        if chunk:
+            *parts, tail = (tail + chunk).split(b'&')
+        else:
+            parts, tail = [tail], b''
+        for part in parts:
+            if not part:
+                continue
+            fields += 1
+            if fields > max_fields:
+                raise RequestEntityTooLarge()
+            yield from parse_qsl(part.decode('latin-1'), keep_blank_values=True, encoding='utf-8', errors='replace')
+        if not chunk:
+            return
+
+
+def form_items():
+    """Поля формы парами с ограничениями ECHO_MAX_FORM_SIZE и ECHO_MAX_FORM_FIELDS.
+
+    Слишком большое тело отклоняется по Content-Length ещё до чтения. Разбор потоковый и прерывается
+    с 413 на первом превышении; результат — не больше лимитов, поэтому его можно спокойно собрать в список
+    до начала ответа (после отправки заголовков вернуть 413 уже нельзя).
+    """
+    max_size = current_app.config['ECHO_MAX_FORM_SIZE']
+    max_fields = current_app.config['ECHO_MAX_FORM_FIELDS']
+    if request.content_length is not None and request.content_length > max_size:
+        raise RequestEntityTooLarge()
+    if request.mimetype == 'application/x-www-form-urlencoded':
+        return list(iter_urlencoded(request.stream, max_fields, max_size))
+    # multipart werkzeug и так разбирает потоково — ограничиваем число частей и размер полей в памяти
+    request.max_form_parts = max_fields
+    request.max_form_memory_size = max_size
+    return list(request.form.items(multi=True))
@@ -0,0 +1,185 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import namedtuple
+from datetime import datetime
+from functools import lru_cache, wraps
+
+# признак промаха (None тоже может быть закешированным значением)
+MISS = object()
+
+
+def default_path(app):
+    # instance — каталог приложения, а не общий для всех /dev/shm: файл кеша не подменит другой пользователь хоста
+    return os.path.join(app.instance_path, 'shared-cache.db')
+
+
+def db_scope(uri):
+    """Короткий хеш URI базы: записи кеша разных БД не смешиваются, даже если файл кеша общий."""
+    return hashlib.blake2s(uri.encode(), digest_size=6).hexdigest()
+
+
+@lru_cache(maxsize=None)
+def _record(fields):
+    return namedtuple('Record', fields)
+
+
+def _encode(value):
+    """Значение в JSON-совместимый вид. Строки запросов (Row, namedtuple) и datetime помечаются,
+    чтобы _decode вернул объекты с тем же доступом по атрибутам, что и в шаблонах."""
+    if isinstance(value, datetime):
+        return {'__datetime__': value.isoformat()}
+    if hasattr(value, '_fields'):
+        return {'__row__': list(value._fields), 'values': [_encode(v) for v in value]}
+    if isinstance(value, (list, tuple)):
+        return [_encode(v) for v in value]
+    if isinstance(value, dict):
+        return {str(k): _encode(v) for k, v in value.items()}
+    if value is None or isinstance(value, (str, int, float, bool)):
+        return value
+    raise TypeError(f'shared cache cannot store {type(value).__name__}')
+
+
+def _decode(obj):
+    if '__datetime__' in obj:
+        return datetime.fromisoformat(obj['__datetime__'])
+    if '__row__' in obj:
+        return _record(tuple(obj['__row__']))(*obj['values'])
+    return obj
+
+
+class SharedCache:
+    """Кеш, общий для всех воркеров gunicorn на хосте.
+
+    Хранилище — SQLite-файл в instance (права 0600), открытый с mmap: чтение идёт из страничного кеша ОС,
+    а блокировки SQLite дают безопасную запись из нескольких процессов. Значения хранятся в JSON, а не
+    pickle — содержимое файла не может заставить воркер выполнить чужой код. Строки запросов
+    возвращаются как namedtuple, datetime — как datetime.
+
+    Ключ = хеш URI базы + пространство имён + его поколение + версия кода + аргументы. invalidate(namespace)
+    увеличивает поколение, и все старые записи этого пространства сразу перестают находиться
+    во всех воркерах; сами строки потом вытесняются. Записи живут не дольше TTL, при переполнении
+    удаляются давно не читавшиеся (приближённый LRU: время доступа обновляется не чаще раза в TOUCH_INTERVAL).
+    """
+
+    TOUCH_INTERVAL = 5.0
+    # как часто (в операциях записи) проверять переполнение
+    EVICT_EVERY = 64
+
+    # полный ключ: namespace:поколение:версия:ключ; поколение подставляется в том же запросе
+    FULL_KEY = "? || ':' || COALESCE((SELECT generation FROM generations WHERE namespace = ?), 0) || ':' || ?"
+
+    def __init__(self, path=None, max_entries=10000, scope='', app=None):
+        self.path = path
+        self.max_entries = max_entries
+        self.scope = scope
+        self._local = threading.local()
+        self._writes = 0
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        # пустая строка выключает кеш (функции под декоратором вызываются напрямую)
+        app.config.setdefault('SHARED_CACHE_PATH', os.environ.get('SHARED_CACHE_PATH', default_path(app)))
+        app.config.setdefault('SHARED_CACHE_MAX_ENTRIES', 10000)
+        self.path = app.config['SHARED_CACHE_PATH'] or None
+        self.max_entries = app.config['SHARED_CACHE_MAX_ENTRIES']
+        self.scope = db_scope(app.config.get('SQLALCHEMY_DATABASE_URI') or '')
+        self._local = threading.local()
+        app.extensions['shared_cache'] = self
+
+    @property
+    def enabled(self):
+        return bool(self.path)
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.path != self.path:
+            # файл создаётся сразу с правами 0600; журналы WAL SQLite создаёт с теми же правами
+            os.close(os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600))
+            os.chmod(self.path, 0o600)
+            conn = sqlite3.connect(self.path, timeout=2.0, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            # это кеш: durability не нужна
+            conn.execute('PRAGMA synchronous=OFF')
+            conn.execute('PRAGMA mmap_size=67108864')
+            conn.execute('CREATE TABLE IF NOT EXISTS entries ('
+                         'key TEXT PRIMARY KEY, value TEXT NOT NULL, expires REAL NOT NULL, accessed REAL NOT NULL)')
+            conn.execute('CREATE INDEX IF NOT EXISTS ix_entries_accessed ON entries(accessed)')
+            conn.execute('CREATE TABLE IF NOT EXISTS generations ('
+                         'namespace TEXT PRIMARY KEY, generation INTEGER NOT NULL)')
+            self._local.conn = conn
+            self._local.path = self.path
+        return conn
+
+    def _namespace(self, namespace):
+        return f'{self.scope}/{namespace}' if self.scope else namespace
+
+    def get(self, namespace, key, version=1):
+        namespace = self._namespace(namespace)
+        now = time.time()
+        row = self._connect().execute(
+            f'SELECT key, value, expires, accessed FROM entries WHERE key = {self.FULL_KEY}',
+            (namespace, namespace, f'{version}:{key}')).fetchone()
+        if row is None or row[2] < now:
+            return MISS
+        if now - row[3] > self.TOUCH_INTERVAL:
+            self._connect().execute('UPDATE entries SET accessed = ? WHERE key = ?', (now, row[0]))
+        return json.loads(row[1], object_hook=_decode)
+
+    def set(self, namespace, key, value, ttl=60, version=1):
+        namespace = self._namespace(namespace)
+        now = time.time()
+        conn = self._connect()
+        conn.execute(
+            f'INSERT OR REPLACE INTO entries(key, value, expires, accessed) VALUES ({self.FULL_KEY}, ?, ?, ?)',
+            (namespace, namespace, f'{version}:{key}', json.dumps(_encode(value), ensure_ascii=False), now + ttl, now))
+        self._writes += 1
+        if self._writes % self.EVICT_EVERY == 0:
+            self.evict(now)
+
+    def invalidate(self, namespace):
+        if not self.enabled:
+            return
+        namespace = self._namespace(namespace)
+        self._connect().execute(
+            'INSERT INTO generations(namespace, generation) VALUES (?, 1) '
+            'ON CONFLICT(namespace) DO UPDATE SET generation = generation + 1', (namespace,))
+
+    def evict(self, now=None):
+        now = time.time() if now is None else now
+        conn = self._connect()
+        conn.execute('DELETE FROM entries WHERE expires < ?', (now,))
+        conn.execute('DELETE FROM entries WHERE key IN ('
+                     'SELECT key FROM entries ORDER BY accessed DESC LIMIT -1 OFFSET ?)', (self.max_entries,))
+
+    def clear(self):
+        if self.enabled:
+            self._connect().execute('DELETE FROM entries')
+
+    def cached(self, namespace, ttl=60, version=1):
+        """Декоратор: результат функции кешируется по её аргументам.
+
+        version — версия формата значения; увеличивается при изменении того, что возвращает функция.
+        У обёртки есть .invalidate() для сброса всего пространства имён.
+        """
+        def decorator(fn):
+            @wraps(fn)
+            def wrapper(*args, **kwargs):
+                if not self.enabled:
+                    return fn(*args, **kwargs)
+                key = repr((args, sorted(kwargs.items())))
+                value = self.get(namespace, key, version)
+                if value is MISS:
+                    value = fn(*args, **kwargs)
+                    self.set(namespace, key, value, ttl, version)
+                return value
+            wrapper.invalidate = lambda: self.invalidate(namespace)
+            return wrapper
+        return decorator
+
+
+shared_cache = SharedCache()
@@ -0,0 +1,101 @@
+import re
+import threading
+import time
+
+from flask import has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+# литералы, которые могли попасть в текст запроса мимо bind-параметров
+_LITERALS = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+# IN (?, ?, ?) разной длины — одна форма
+_PARAM_LISTS = re.compile(r'\(\s*\?(?:\s*,\s*\?)+\s*\)')
+_SPACES = re.compile(r'\s+')
+
+
+def normalize(statement):
+    """Форма запроса: литералы и списки параметров заменены на ?, пробелы схлопнуты."""
+    shape = _LITERALS.sub('?', statement)
+    shape = _PARAM_LISTS.sub('(?, ...)', shape)
+    return _SPACES.sub(' ', shape).strip()
+
+
+class QueryStats:
+    """Статистика SQL по формам запросов: сколько раз, суммарное и максимальное время.
+
+    Считается на событиях Engine (before/after_cursor_execute) для всех движков процесса — основного
+    и read-only реплики. На запрос уходит два вызова perf_counter и поиск в словаре: форма запроса
+    кешируется по его тексту, а SQLAlchemy и так генерирует одинаковый текст для одинаковых запросов.
+    Запросы дольше SQL_SLOW_QUERY_MS пишутся в лог вместе с эндпоинтом. Статистика своя у каждого воркера.
+    """
+
+    # сюда считаются формы сверх SQL_STATS_MAX_SHAPES
+    OTHER = '<other>'
+
+    def __init__(self, app=None):
+        self.stats = {}
+        self._shapes = {}
+        self._lock = threading.Lock()
+        self.enabled = False
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('SQL_STATS_ENABLED', True)
+        app.config.setdefault('SQL_SLOW_QUERY_MS', 100)
+        app.config.setdefault('SQL_STATS_MAX_SHAPES', 1000)
+        self.slow_ms = app.config['SQL_SLOW_QUERY_MS']
+        self.max_shapes = app.config['SQL_STATS_MAX_SHAPES']
+        self.logger = app.logger
+        app.extensions['sql_stats'] = self
+        if app.config['SQL_STATS_ENABLED'] and not self.enabled:
+            self.enabled = True
+            event.listen(Engine, 'before_cursor_execute', self._before)
+            event.listen(Engine, 'after_cursor_execute', self._after)
+            # упавший запрос не доходит до after_cursor_execute — его время снимается здесь
+            event.listen(Engine, 'handle_error', self._error)
+
+    def _before(self, conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('query_start', []).append(time.perf_counter())
+
+    @staticmethod
+    def _error(context):
+        conn = context.connection
+        starts = conn.info.get('query_start') if conn is not None else None
+        if starts:
+            starts.pop()
+
+    def _after(self, conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - conn.info['query_start'].pop()
+        shape = self._shapes.get(statement)
+        if shape is None:
+            shape = normalize(statement)
+            if len(self._shapes) < self.max_shapes:
+                self._shapes[statement] = shape
+        with self._lock:
+            entry = self.stats.get(shape)
+            if entry is None:
+                if len(self.stats) >= self.max_shapes:
+                    shape = self.OTHER
+                entry = self.stats.setdefault(shape, [0, 0.0, 0.0])
+            entry[0] += 1
+            entry[1] += elapsed
+            if elapsed > entry[2]:
+                entry[2] = elapsed
+        if elapsed * 1000 >= self.slow_ms:
+            endpoint = f'{request.method} {request.endpoint}' if has_request_context() else '-'
+            self.logger.warning('slow query %.1f ms [%s]: %s', elapsed * 1000, endpoint, shape)
+
+    def top(self, n=20, sort='total'):
+        """[(форма, count, total, max)] по убыванию sort: total, count или max."""
+        key = {'count': 1, 'total': 2, 'max': 3}.get(sort, 2)
+        with self._lock:
+            rows = [(shape, count, total, longest) for shape, (count, total, longest) in self.stats.items()]
+        return sorted(rows, key=lambda row: row[key], reverse=True)[:n]
+
+    def reset(self):
+        with self._lock:
+            self.stats.clear()
+
+
+query_stats = QueryStats()
@@ -1,8 +1,57 @@
+# app/tests/conftest.py
+import os
+import sqlite3
+import tempfile
 import pytest
 from datetime import datetime, timedelta
 from flask import template_rendered
 from contextlib import contextmanager
+
+# Тесты не трогают instance/app.db: каждый процесс (в том числе каждый воркер pytest-xdist,
+# `pytest -n auto`) работает со своей SQLite-БД в памяти. Её схема и данные строятся один раз
+# при импорте приложения и сохраняются как шаблон; перед каждым тестом БД восстанавливается
+# из шаблона через sqlite3 backup — это миллисекунды, а не пересоздание файла.
+WORKER = os.environ.get('PYTEST_XDIST_WORKER', 'main')
+TEST_DB_NAME = f'weblabs-test-{WORKER}'
+# дешёвый хеш вместо scrypt: пароли в тестах проверяются десятки раз
+TEST_PASSWORD_HASH = 'pbkdf2:sha256:1'
+
+os.environ['DATABASE_URL'] = f'sqlite:///file:/{TEST_DB_NAME}?mode=memory&cache=shared&uri=true'
+os.environ['PASSWORD_HASH_METHOD'] = TEST_PASSWORD_HASH
+# БД в памяти с cache=shared живёт, пока открыто хотя бы одно соединение — держим своё
+_LIVE_DB = sqlite3.connect(f'file:/{TEST_DB_NAME}?mode=memory&cache=shared', uri=True)
+
+# общий кеш воркеров в тестах выключен: тесты пересоздают БД, и закешированные роли/посты устаревали бы
+os.environ.setdefault('SHARED_CACHE_PATH', '')
+# очередь задач и файл-заглушка отправки — во временном каталоге, а не в instance/
+_JOBS_DIR = tempfile.mkdtemp(prefix='weblabs-jobs-')
+os.environ.setdefault('JOBS_QUEUE_PATH', os.path.join(_JOBS_DIR, 'jobs.db'))
+os.environ.setdefault('JOBS_LOCAL_SINK_PATH', os.path.join(_JOBS_DIR, 'outbox.jsonl'))
+# журнал пишется сразу после commit: фоновый поток не должен писать в БД, которую тесты пересоздают
+os.environ.setdefault('AUDIT_FLUSH_INTERVAL', '0')
+
 from app.app import app as flask_app   # если app/app.py существует
+from app.models import db, User, Role
+from werkzeug.security import generate_password_hash
+
+
+def _build_template():
+    """Роли и администратор поверх схемы и постов, созданных при импорте app.app; копия — в шаблон."""
+    with flask_app.app_context():
+        admin_role = Role(name='admin', description='Администраторы')
+        db.session.add_all([admin_role, Role(name='user', description='Обычные пользователи')])
+        db.session.flush()
+        db.session.add(User(login='admin', password_hash=generate_password_hash('Zalanet_514', TEST_PASSWORD_HASH),
+                            last_name='Adminov', first_name='Admin', patronymic='A.', role_id=admin_role.id))
+        db.session.commit()
+        db.session.remove()
+    template = sqlite3.connect(':memory:')
+    _LIVE_DB.backup(template)
+    return template
+
+
+_TEMPLATE_DB = _build_template()
+
 
 @pytest.fixture
 def app():
@@ -42,59 +91,10 @@ def posts_list():
 
 
 
-# app/tests/conftest.py
-import shutil
-from pathlib import Path
-import pytest
-
-# project_root — предполагается: project/... , файл conftest.py в app/tests
-PROJECT_ROOT = Path(__file__).resolve().parents[2]
-
-# Жёстко: источник — project_root/instance/app.db
-SOURCE_DB = PROJECT_ROOT / 'instance' / 'app.db'
-# Резервная копия — project_root/app/app_back.db
-BACKUP_DB = PROJECT_ROOT / 'app' / 'app_back.db'
-
-@pytest.fixture(scope='session', autouse=True)
-def backup_and_restore_instance_db():
-    """
-    1) Перед тестовой сессией: если instance/app.db существует -> копируем в app/app_back.db
-       (если не существует — отмечаем, что бэкапа не делали).
-    2) После тестов: если бэкап был сделан — копируем app/app_back.db обратно в instance/app.db.
-    Бэкап НЕ удаляется автоматически.
-    """
-    # гарантируем папки
-    BACKUP_DB.parent.mkdir(parents=True, exist_ok=True)
-    SOURCE_DB.parent.mkdir(parents=True, exist_ok=True)
-
-    did_backup = False
-    try:
-        if SOURCE_DB.exists():
-            shutil.copy2(SOURCE_DB, BACKUP_DB)
-            did_backup = True
-            print(f"[conftest] Backup created: {BACKUP_DB} <- {SOURCE_DB}")
-        else:
-            # источник не найден — ничего не копируем, но оставляем бэкап нетронутым
-            print(f"[conftest] Source DB not found: {SOURCE_DB}. No backup created.")
-        yield
-    finally:
-        # попытка аккуратно закрыть SQLAlchemy, если он подключён (снимает lock на sqlite)
-        try:
-            from app.models import db as sa_db
-            sa_db.session.remove()
-            sa_db.engine.dispose()
-        except Exception:
-            pass
-
-        # восстанавливаем только если ранее сделали бэкап
-        if did_backup and BACKUP_DB.exists():
-            try:
-                shutil.copy2(BACKUP_DB, SOURCE_DB)
-                print(f"[conftest] Restored: {SOURCE_DB} <- {BACKUP_DB}")
-            except Exception as exc:
-                print(f"[conftest] ERROR restoring DB: {exc}")
-        else:
-            if not did_backup:
-                print("[conftest] No backup was created before tests; restore skipped.")
-            else:
-                print(f"[conftest] Backup file missing ({BACKUP_DB}); restore skipped.")
+@pytest.fixture(autouse=True)
+def fresh_db():
+    """Каждый тест начинает с БД из шаблона."""
+    with flask_app.app_context():
+        db.session.remove()
+    _TEMPLATE_DB.backup(_LIVE_DB)
+    yield
@@ -0,0 +1,68 @@
+import pytest
+
+from app.app import app as flask_app
+from app.models import db, User, Role
+from app.passwords import hash_password
+
+
+@pytest.fixture
+def client():
+    flask_app.config['TESTING'] = True
+    with flask_app.app_context():
+        role = Role.query.filter_by(name='user').one()
+        db.session.add_all([User(login=f'api{i}', password_hash=hash_password('x'), last_name=f'Апиев{i}',
+                                 first_name='Иван', role_id=role.id) for i in range(5)])
+        db.session.commit()
+    return flask_app.test_client()
+
+
+def test_users_api_pages_by_cursor_with_projection(client, mocker):
+    from sqlalchemy.orm import Session
+    execute = mocker.spy(Session, 'execute')
+    rv = client.get('/api/users?limit=4')
+    assert rv.status_code == 200
+    page = rv.get_json()
+    assert [u['login'] for u in page['items']] == ['admin', 'api0', 'api1', 'api2']
+    assert set(page['items'][0]) == {'id', 'login', 'full_name', 'role'}
+    assert page['items'][0]['role'] == 'admin'
+    rest = client.get(f'/api/users?limit=4&after={page["next"]}').get_json()
+    assert [u['login'] for u in rest['items']] == ['api3', 'api4'] and rest['next'] is None
+
+    items = client.get('/api/users?fields=login,created_at').get_json()['items']
+    assert set(items[0]) == {'login', 'created_at'} and 'T' in items[0]['created_at']
+    sql = str(execute.call_args[0][1])
+    # в SELECT только запрошенные колонки, без пароля и без JOIN ролей
+    assert 'password_hash' not in sql and 'JOIN' not in sql and 'last_name' not in sql.split('FROM')[0]
+    assert client.get('/api/users?fields=login,password_hash').status_code == 400
+
+
+def test_user_api_etag_and_conditional_requests(client):
+    with flask_app.app_context():
+        user = User.query.filter_by(login='api0').one()
+        user_id, version = user.id, user.version
+    rv = client.get(f'/api/users/{user_id}')
+    assert rv.status_code == 200 and rv.get_json()['login'] == 'api0'
+    etag, last_modified = rv.headers['ETag'], rv.headers['Last-Modified']
+    assert 'no-cache' in rv.headers['Cache-Control']
+
+    rv = client.get(f'/api/users/{user_id}', headers={'If-None-Match': etag})
+    assert rv.status_code == 304 and rv.data == b'' and rv.headers['ETag'] == etag
+    assert client.get(f'/api/users/{user_id}', headers={'If-Modified-Since': last_modified}).status_code == 304
+    # другая проекция — другое тело и другой тег
+    assert client.get(f'/api/users/{user_id}?fields=id', headers={'If-None-Match': etag}).status_code == 200
+
+    from app.models import update_user_versioned
+    with flask_app.app_context():
+        assert update_user_versioned(user_id, version, first_name='Пётр')
+        db.session.commit()
+    rv = client.get(f'/api/users/{user_id}', headers={'If-None-Match': etag})
+    assert rv.status_code == 200 and rv.headers['ETag'] != etag
+    assert rv.get_json()['full_name'] == 'Апиев0 Пётр'
+    etag = rv.headers['ETag']
+    # роль в ответе — её название; переименование роли меняет тег
+    with flask_app.app_context():
+        Role.query.filter_by(name='user').one().name = 'member'
+        db.session.commit()
+    rv = client.get(f'/api/users/{user_id}', headers={'If-None-Match': etag})
+    assert rv.status_code == 200 and rv.get_json()['role'] == 'member' and rv.headers['ETag'] != etag
+    assert client.get('/api/users/999999').status_code == 404
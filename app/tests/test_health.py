@@ -0,0 +1,110 @@
+import pytest
+
+from app.app import app as flask_app
+from app.health import warm_up
+
+
+@pytest.fixture
+def client():
+    flask_app.config['TESTING'] = True
+    return flask_app.test_client()
+
+
+@pytest.fixture
+def cold_worker(monkeypatch):
+    monkeypatch.setattr(warm_up, 'done', False)
+    return warm_up
+
+
+def test_readyz_warms_up_worker_once(client, cold_worker, mocker):
+    compile_templates = mocker.spy(cold_worker, '_compile_templates')
+    rv = client.get('/readyz')
+    assert rv.status_code == 200 and rv.get_json()['status'] == 'ready'
+    assert cold_worker.done
+    assert compile_templates.spy_return >= 10
+    # шаблоны уже скомпилированы и лежат в кеше jinja
+    assert 'users.html' in {key[1] for key in flask_app.jinja_env.cache.keys()}
+    client.get('/readyz')
+    assert compile_templates.call_count == 1
+
+
+def test_warm_up_precomputes_dummy_hash(client, cold_worker, mocker):
+    from app.passwords import method_prefix
+    verifier = flask_app.extensions['login_verifier']
+    mocker.patch.dict(verifier._dummy_hashes, clear=True)
+    assert client.get('/readyz').status_code == 200
+    assert method_prefix(flask_app.config['PASSWORD_HASH_METHOD']) in verifier._dummy_hashes
+
+
+def test_readyz_not_ready_until_warm_up_succeeds(client, cold_worker, mocker):
+    mocker.patch.object(cold_worker, '_open_connections', side_effect=[RuntimeError('db is down'), None])
+    rv = client.get('/readyz')
+    assert rv.status_code == 503 and rv.get_json()['status'] == 'warming'
+    assert not cold_worker.done
+    # упавший прогрев повторяется при следующей проверке
+    assert client.get('/readyz').status_code == 200
+
+
+def test_warm_worker_skips_the_lock(client):
+    assert client.get('/readyz').status_code == 200
+    # прогретый воркер отвечает, даже пока блокировку держит кто-то другой
+    with warm_up._lock:
+        assert warm_up.run(flask_app) is True
+
+
+def test_healthz_is_tiny_and_sessionless(client):
+    client.set_cookie('session', 'garbage')
+    rv = client.get('/healthz')
+    assert rv.status_code == 200 and rv.get_json() == {'status': 'ok'}
+    assert rv.headers['Cache-Control'] == 'no-store'
+    # cookie сессии не разбирался и не переотправлялся
+    assert 'Vary' not in rv.headers and 'Set-Cookie' not in rv.headers
+
+
+def test_readyz_reports_db_latency_pool_and_in_flight(client, monkeypatch):
+    from app.health import in_flight
+    # незакрытые ответы других тестов тоже числятся в работе
+    monkeypatch.setattr(in_flight, 'count', 0)
+    with client.get('/readyz') as rv:
+        body = rv.get_json()
+    assert body['status'] == 'ready' and body['in_flight'] == 0
+    assert body['db_ms'] >= 0
+    # у SQLite в памяти пул без ограничений
+    assert body['pool'] is None
+    assert 'Set-Cookie' not in client.get('/readyz').headers
+
+    monkeypatch.setitem(flask_app.config, 'READY_MAX_IN_FLIGHT', 2)
+    monkeypatch.setattr(in_flight, 'count', 2)
+    rv = client.get('/readyz')
+    assert rv.status_code == 503
+    assert rv.get_json()['status'] == 'busy' and rv.get_json()['in_flight'] == 2
+    # запрос перестаёт считаться, когда закрыто тело ответа
+    assert in_flight.count == 3
+    rv.close()
+    assert in_flight.count == 2
+
+
+def test_readyz_db_check_is_bounded(client, tmp_path, mocker):
+    import sqlite3
+    import time
+    from sqlalchemy import create_engine
+    from app.health import check_db, pool_status
+
+    path = tmp_path / 'locked.db'
+    engine = create_engine(f'sqlite:///{path}', pool_size=1, max_overflow=0)
+    assert check_db(engine, 0.1) >= 0
+    writer = sqlite3.connect(path, isolation_level=None)
+    writer.execute('BEGIN EXCLUSIVE')
+    start = time.perf_counter()
+    with pytest.raises(sqlite3.OperationalError):
+        check_db(engine, 0.1)
+    assert time.perf_counter() - start < 2
+    writer.execute('ROLLBACK')
+
+    with engine.connect():
+        assert pool_status(engine) == {'size': 1, 'checked_out': 1, 'saturated': True}
+    assert not pool_status(engine)['saturated']
+
+    mocker.patch('app.health.check_db', side_effect=sqlite3.OperationalError('database is locked'))
+    rv = client.get('/readyz')
+    assert rv.status_code == 503 and rv.get_json()['status'] == 'db_error'
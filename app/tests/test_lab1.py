@@ -1,7 +1,10 @@
 import pytest
 from flask import template_rendered
 from contextlib import contextmanager
-from app.app import posts_list, app
+from sqlalchemy import select
+from app.app import app
+from app.comments import comment_page
+from app.models import db, Post
 
 @contextmanager
 def captured_templates(app):
@@ -14,6 +17,14 @@ def captured_templates(app):
     finally:
         template_rendered.disconnect(record, app)
 
+def posts_list():
+    # посты в порядке ленты: новые первыми
+    with app.app_context():
+        return db.session.scalars(select(Post).order_by(Post.date.desc(), Post.id.desc())).all()
+
+def newest_post_url():
+    return f'/posts/{posts_list()[0].id}'
+
 @pytest.fixture
 def client():
     app.config['TESTING'] = True
@@ -59,12 +70,12 @@ def test_posts_page_shows_cards_for_posts(client):
     assert rv.status_code == 200
     html = rv.get_data(as_text=True)
     posts = posts_list()
-    assert posts[0]['title'] in html
+    assert posts[0].title in html
 
 # проверяет, что страница одного поста использует шаблон post.html
 def test_post_uses_post_template(client):
     with captured_templates(app) as templates:
-        rv = client.get('/posts/0')
+        rv = client.get(newest_post_url())
         assert rv.status_code == 200
         assert templates[0][0].name == 'post.html'
         _, context = templates[0]
@@ -73,30 +84,30 @@ def test_post_uses_post_template(client):
 # проверяет, что в шаблон одного поста передаются все нужные поля
 def test_post_context_contains_post(client):
     with captured_templates(app) as templates:
-        client.get('/posts/0')
+        client.get(newest_post_url())
         template, context = templates[0]
         post = context['post']
-        assert 'title' in post and 'text' in post and 'author' in post and 'date' in post
+        assert post.title and post.text and post.author and post.date
 
 # проверяет, что на странице поста видны заголовок, текст и имя автора
 def test_post_page_contains_title_author_text(client):
-    rv = client.get('/posts/0')
+    rv = client.get(newest_post_url())
     html = rv.get_data(as_text=True)
     p = posts_list()[0]
-    assert p['title'] in html
-    assert p['text'][:20] in html
-    assert p['author'] in html
+    assert p.title in html
+    assert p.text[:20] in html
+    assert p.author in html
 
 # проверяет, что на странице поста есть изображение
 def test_post_page_contains_image_src(client):
-    rv = client.get('/posts/0')
+    rv = client.get(newest_post_url())
     html = rv.get_data(as_text=True)
     p = posts_list()[0]
-    assert f'images/{p["image_id"]}' in html
+    assert f'images/{p.image_id}' in html
 
 # проверяет наличие формы добавления комментария
 def test_post_page_contains_comment_form(client):
-    rv = client.get('/posts/0')
+    rv = client.get(newest_post_url())
     html = rv.get_data(as_text=True)
     assert '<form' in html
     assert 'textarea' in html or 'input' in html
@@ -104,33 +115,58 @@ def test_post_page_contains_comment_form(client):
 
 # проверяет, что комментарии поста отображаются на странице
 def test_comments_rendered_on_post_page(client):
-    rv = client.get('/posts/0')
-    html = rv.get_data(as_text=True)
-    p = posts_list()[0]
-    assert 'comments' in p
-    if p['comments']:
-        assert p['comments'][0]['author'] in html
-        assert p['comments'][0]['text'][:10] in html
-
-# проверяет, что ответы на комментарии тоже выводятся
-def test_comment_replies_rendered(client):
-    rv = client.get('/posts/0')
+    rv = client.get(newest_post_url())
     html = rv.get_data(as_text=True)
-    p = posts_list()[0]
-    found_reply = False
-    for c in p['comments']:
-        for r in c.get('replies', []):
-            if r['text'][:8] in html:
-                found_reply = True
-                break
-    assert (not any(c.get('replies') for c in p['comments'])) or found_reply
+    with app.app_context():
+        comments, _ = comment_page(posts_list()[0].id)
+        assert comments
+        assert comments[0].author in html
+        assert comments[0].text[:10] in html
+
+# проверяет, что ответы не выводятся на странице, а отдаются JSON-эндпоинтом по запросу
+def test_comment_replies_loaded_on_demand(client):
+    for p in posts_list():
+        html = client.get(f'/posts/{p.id}').get_data(as_text=True)
+        with app.app_context():
+            comments, _ = comment_page(p.id)
+            with_replies = [c for c in comments if c.reply_count]
+            if not with_replies:
+                continue
+            c = with_replies[0]
+            replies, _ = comment_page(p.id, c.id)
+            assert replies[0].text[:20] not in html
+            assert f'Ответы ({c.reply_count})' in html
+        data = client.get(f'/comments/{c.id}/replies').get_json()
+        assert [r['text'] for r in data['items']] == [r.text for r in replies]
+        assert len(data['items']) == c.reply_count
+        return
+
+# проверяет постраничную загрузку комментариев верхнего уровня
+def test_comments_paginated(client):
+    client.get(newest_post_url())
+    app.config['COMMENTS_PAGE_SIZE'] = 1
+    try:
+        with captured_templates(app) as templates:
+            client.get(newest_post_url())
+            context = templates[0][1]
+        assert len(context['comments']) == 1
+        if context['comment_count'] > 1:
+            page = client.get(f"{newest_post_url()}/comments?after={context['next_after']}").get_json()
+            assert len(page['items']) == 1
+            assert page['items'][0]['id'] > context['comments'][0].id
+        else:
+            assert context['next_after'] is None
+    finally:
+        app.config['COMMENTS_PAGE_SIZE'] = 20
+    assert client.get(f'{newest_post_url()}/comments').get_json()['items']
+    assert client.get('/comments/999999/replies').status_code == 404
 
 # проверяет правильность формата даты на странице поста
 def test_date_format_on_post_page(client):
-    rv = client.get('/posts/0')
+    rv = client.get(newest_post_url())
     html = rv.get_data(as_text=True)
     p = posts_list()[0]
-    fmt = p['date'].strftime('%d.%m.%Y')
+    fmt = p.date.strftime('%d.%m.%Y')
     assert fmt in html
 
 # проверяет формат даты на странице со списком постов
@@ -139,11 +175,11 @@ def test_posts_page_dates_format(client):
     html = rv.get_data(as_text=True)
     posts = posts_list()
     for p in posts:
-        assert p['date'].strftime('%d.%m.%Y') in html
+        assert p.date.strftime('%d.%m.%Y') in html
 
-# проверяет, что при неверном индексе возвращается ошибка 404
+# проверяет, что при несуществующем id возвращается ошибка 404
 def test_invalid_post_returns_404(client):
-    n = len(posts_list())
+    n = max(p.id for p in posts_list()) + 1
     rv = client.get(f'/posts/{n}')
     assert rv.status_code == 404
 
@@ -151,7 +187,9 @@ def test_invalid_post_returns_404(client):
 def test_posts_page_has_links_to_posts(client):
     rv = client.get('/posts')
     html = rv.get_data(as_text=True)
-    assert '/posts/0' in html
+    # ссылки ведут на постоянные id постов, а не на позицию в списке
+    for p in posts_list():
+        assert f'/posts/{p.id}"' in html
 
 # проверяет, что количество постов в списке не равно нулю
 def test_number_of_posts_consistent(client):
@@ -159,5 +197,31 @@ def test_number_of_posts_consistent(client):
     html = rv.get_data(as_text=True)
     assert len(posts_list()) >= 1
 
+# лента отдаёт из БД только начало текста и листается по (date, id)
+def test_posts_feed_keyset_pagination_and_sql_excerpt(client):
+    from app.posts import feed_page, EXCERPT_LENGTH
+    posts = posts_list()
+    with app.app_context():
+        rows, next_after = feed_page(limit=2)
+        assert [r.id for r in rows] == [p.id for p in posts[:2]]
+        assert all(len(r.excerpt) <= EXCERPT_LENGTH for r in rows)
+        assert rows[0].excerpt == posts[0].text[:EXCERPT_LENGTH]
+        seen = [r.id for r in rows]
+        while next_after is not None:
+            rows, next_after = feed_page(after=next_after, limit=2)
+            seen += [r.id for r in rows]
+    assert seen == [p.id for p in posts]
+    app.config['POSTS_PAGE_SIZE'] = 2
+    try:
+        html = client.get('/posts').get_data(as_text=True)
+        assert f'/posts?after={posts[1].id}' in html
+        html = client.get(f'/posts?after={posts[1].id}').get_data(as_text=True)
+        assert posts[2].text[:20] in html and posts[0].text[:20] not in html
+    finally:
+        app.config['POSTS_PAGE_SIZE'] = 10
 
-
+# у страницы поста одно правило маршрутизации, отрицательные id не совпадают с ним
+def test_single_post_route_rule(client):
+    rules = [r for r in app.url_map.iter_rules() if r.rule == '/posts/<int:post_id>']
+    assert [r.endpoint for r in rules] == ['post']
+    assert client.get('/posts/-1').status_code == 404
@@ -142,3 +142,65 @@ def test_phone_11_digits_wrong_prefix(client):
     text = resp.get_data(as_text=True)
     # по строгим условиям — если не начинается с +7/8, должен быть 10 цифр
     assert 'Недопустимый ввод. Неверное количество цифр.' in text
+
+# слишком много параметров URL -> 413 без разбора
+def test_url_params_limit(client):
+    limit = app.config['ECHO_MAX_QUERY_PARAMS']
+    qs = '&'.join(f'p{i}=1' for i in range(limit + 1))
+    assert client.get(f'/show/url?{qs}').status_code == 413
+    assert client.get('/show/url?a=1&a=2').status_code == 200
+
+# слишком много заголовков -> 413
+def test_headers_limit(client):
+    limit = app.config['ECHO_MAX_HEADERS']
+    headers = {f'X-H{i}': 'v' for i in range(limit + 1)}
+    assert client.get('/show/headers', headers=headers).status_code == 413
+
+# тело формы больше лимита отклоняется по Content-Length
+def test_form_size_limit(client):
+    big = 'x' * (app.config['ECHO_MAX_FORM_SIZE'] + 1)
+    assert client.post('/show/form', data={'a': big}).status_code == 413
+
+# слишком много полей формы (urlencoded и multipart) -> 413
+def test_form_fields_limit(client):
+    limit = app.config['ECHO_MAX_FORM_FIELDS']
+    data = {f'f{i}': 'v' for i in range(limit + 1)}
+    assert client.post('/show/form', data=data).status_code == 413
+    assert client.post('/show/form', data=data, content_type='multipart/form-data').status_code == 413
+
+# повторяющиеся ключи выводятся отдельными строками
+def test_form_repeated_keys(client):
+    resp = client.post('/show/form', data='a=1&a=2&b=%D1%8F', content_type='application/x-www-form-urlencoded')
+    text = resp.get_data(as_text=True)
+    assert '<td>1</td>' in text and '<td>2</td>' in text and '<td>я</td>' in text
+
+# потоковый разбор: поля на границе кусков собираются, при превышении лимита чтение прекращается
+def test_iter_urlencoded_streaming():
+    import io
+    from werkzeug.exceptions import RequestEntityTooLarge
+    from app.request_limits import iter_urlencoded
+    body = io.BytesIO(b'alpha=1&beta=22&gamma=333')
+    assert list(iter_urlencoded(body, max_fields=10, max_size=100, chunk_size=4)) == [
+        ('alpha', '1'), ('beta', '22'), ('gamma', '333')]
+    body = io.BytesIO(b'a=1&' * 1000)
+    with pytest.raises(RequestEntityTooLarge):
+        list(iter_urlencoded(body, max_fields=5, max_size=10 ** 6, chunk_size=16))
+    assert body.tell() < 100
+
+# каждая страница show_* рендерит шаблон ровно один раз
+@pytest.mark.parametrize('method, url, cookie', [
+    ('get', '/show/cookies', None),
+    ('get', '/show/cookies', '1'),
+    ('get', '/show/url?a=1', None),
+    ('get', '/show/headers', None),
+    ('post', '/show/form', None),
+])
+def test_show_pages_render_once(client, captured_templates, method, url, cookie):
+    if cookie:
+        client.set_cookie(key='lab2_cookie', value=cookie)
+    with captured_templates as templates:
+        resp = getattr(client, method)(url, data={'a': '1'} if method == 'post' else None)
+        assert resp.status_code == 200
+        resp.get_data()  # страница отдаётся потоком — дочитываем
+    renders = [t for t, _ in templates if t.name == 'show_params.html']
+    assert len(renders) == 1
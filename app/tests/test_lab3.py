@@ -2,10 +2,10 @@ import time
 import urllib.parse
 
 import pytest
-from werkzeug.security import generate_password_hash
 
 from app.app import app as flask_app
 from app.models import User, db
+from app.passwords import hash_password
 
 
 TEST_USER = "admin"
@@ -22,7 +22,7 @@ def app():
     with flask_app.app_context():
         user = User.query.filter_by(login=TEST_USER).first()
         if not user:
-            user = User(login=TEST_USER, password_hash=generate_password_hash(TEST_PASS))
+            user = User(login=TEST_USER, password_hash=hash_password(TEST_PASS))
             db.session.add(user)
             db.session.commit()
     yield flask_app
@@ -162,3 +162,211 @@ def test_logout_revokes_access_to_secret(client):
     r2 = client.get("/secret", follow_redirects=False)
     assert r2.status_code in (302, 303)
     assert "/login" in r2.headers.get("Location", "")
+
+
+def test_login_throttled_before_password_check(client, mocker):
+    from app.app import login_throttle, login_verifier
+    login_throttle.clear()
+    # существующий логин: без ограничения каждый запрос проверял бы настоящий хеш
+    for _ in range(5):
+        rv = client.post("/login", data={"username": TEST_USER, "password": "bad"})
+        assert rv.status_code == 401
+    verify = mocker.spy(login_verifier, "verify")
+    rv = client.post("/login", data={"username": TEST_USER, "password": TEST_PASS})
+    assert rv.status_code == 429
+    assert int(rv.headers["Retry-After"]) >= 1
+    assert "Слишком много попыток входа" in _text(rv)
+    # отказ до поиска пользователя и проверки пароля
+    verify.assert_not_called()
+    # другой логин с того же IP пока проходит, отказ по логину не съел токен IP
+    assert client.post("/login", data={"username": "other", "password": "bad"}).status_code == 401
+    assert login_throttle.by_ip.check("127.0.0.1") == 0
+    login_throttle.clear()
+
+
+def test_login_throttle_keys_on_client_behind_trusted_proxy(client, monkeypatch, mocker):
+    from werkzeug.middleware.proxy_fix import ProxyFix
+    from app.app import login_throttle
+    login_throttle.clear()
+    # по умолчанию прокси не доверяем: подделанный X-Forwarded-For не меняет ключ
+    acquire = mocker.spy(login_throttle, "try_acquire")
+    client.post("/login", data={"username": "ghost", "password": "bad"}, headers={"X-Forwarded-For": "203.0.113.9"})
+    assert acquire.call_args[0][0] == "127.0.0.1"
+    login_throttle.clear()
+    # TRUSTED_PROXIES=1: адрес клиента — последний в X-Forwarded-For
+    monkeypatch.setattr(flask_app, "wsgi_app", ProxyFix(flask_app.wsgi_app, x_for=1, x_proto=1))
+    capacity = flask_app.config["LOGIN_RATELIMIT_IP"][0]
+    for i in range(capacity):
+        rv = client.post("/login", data={"username": f"ghost{i}", "password": "bad"},
+                         headers={"X-Forwarded-For": "203.0.113.1"})
+        assert rv.status_code == 401
+    rv = client.post("/login", data={"username": "ghost-last", "password": "bad"},
+                     headers={"X-Forwarded-For": "203.0.113.1"})
+    assert rv.status_code == 429
+    # другой посетитель за тем же прокси не страдает от чужого перебора
+    rv = client.post("/login", data={"username": TEST_USER, "password": TEST_PASS},
+                     headers={"X-Forwarded-For": "203.0.113.2"})
+    assert rv.status_code in (302, 303)
+    login_throttle.clear()
+
+
+def test_login_throttle_is_atomic_under_parallel_burst():
+    import threading
+    from app.ratelimit import LoginThrottle
+    from flask import Flask
+    app = Flask(__name__)
+    app.config["LOGIN_RATELIMIT_LOGIN"] = (5, 60)
+    throttle = LoginThrottle(app)
+    start = threading.Barrier(20)
+    results = []
+
+    def attempt():
+        start.wait()
+        results.append(throttle.try_acquire("10.0.0.1", "victim"))
+
+    threads = [threading.Thread(target=attempt) for _ in range(20)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert sum(1 for r in results if r == 0) == 5
+    # удачный вход возвращает токен IP и сбрасывает логин
+    ip_tokens = throttle.by_ip._tokens("10.0.0.1", time.monotonic())
+    throttle.succeeded("10.0.0.1", "victim")
+    assert throttle.by_ip._tokens("10.0.0.1", time.monotonic()) >= ip_tokens + 1
+    assert throttle.try_acquire("10.0.0.1", "victim") == 0
+
+
+def test_sqlite_token_bucket_is_shared_between_instances(tmp_path):
+    from app.ratelimit import SQLiteTokenBucketLimiter
+    # два экземпляра на одном файле — как два воркера
+    first = SQLiteTokenBucketLimiter(tmp_path / "rl.db", capacity=2, refill_rate=1)
+    second = SQLiteTokenBucketLimiter(tmp_path / "rl.db", capacity=2, refill_rate=1)
+    assert first.consume("a", now=100) and second.consume("a", now=100)
+    assert not first.consume("a", now=100)
+    assert second.check("a", now=100) == pytest.approx(1.0)
+    second.refund("a", now=100)
+    assert first.consume("a", now=100)
+    assert first.check("a", now=101.5) == 0
+    first.reset("a")
+    assert second.check("a", now=100) == 0
+
+
+def test_token_bucket_refill_and_lru_bound():
+    from app.ratelimit import TokenBucketLimiter
+    limiter = TokenBucketLimiter(capacity=2, refill_rate=1, max_keys=3)
+    assert limiter.consume("a", now=0) and limiter.consume("a", now=0)
+    assert not limiter.consume("a", now=0)
+    assert limiter.check("a", now=0) > 0
+    assert limiter.check("a", now=1) == 0
+    for key in "bcde":
+        limiter.consume(key, now=1)
+    # размер ограничен, самый давний ключ вытеснен
+    assert len(limiter) == 3
+    assert limiter.check("a", now=1) == 0
+
+
+def test_unknown_login_pays_dummy_hash_once_then_sleeps(client, mocker):
+    import app.passwords as passwords
+    from app.app import login_throttle, login_verifier
+    from app.passwords import method_prefix
+    login_throttle.clear()
+    login_verifier.negative.clear()
+    check = mocker.spy(passwords, "check_password_hash")
+    sleep = mocker.patch("app.passwords.time.sleep")
+
+    rv = client.post("/login", data={"username": "ghost01", "password": "x"})
+    assert rv.status_code == 401
+    # первый отказ — настоящая проверка фиктивного хеша
+    assert check.call_count == 1
+    with flask_app.app_context():
+        assert check.call_args[0][0] == login_verifier.dummy_hash
+    assert "ghost01" in login_verifier.negative
+
+    rv = client.post("/login", data={"username": "ghost01", "password": "y"})
+    assert rv.status_code == 401
+    # повтор — без scrypt, только выдержка на бюджет
+    assert check.call_count == 1
+    with flask_app.app_context():
+        sleep.assert_called_once_with(login_verifier.budget)
+
+    # выдержка — полная цена хеша, без потолка: иначе время ответа выдавало бы, что логина нет
+    mocker.patch.dict(login_verifier.budgets, {method_prefix(flask_app.config["PASSWORD_HASH_METHOD"]): 5.0})
+    client.post("/login", data={"username": "ghost01", "password": "z"})
+    sleep.assert_called_with(5.0)
+    login_throttle.clear()
+
+
+def test_negative_budget_is_kept_per_hash_method(client, mocker, monkeypatch):
+    from app.app import login_throttle, login_verifier
+    login_throttle.clear()
+    mocker.patch.dict(login_verifier.budgets, clear=True)
+    monkeypatch.setitem(flask_app.config, "PASSWORD_REHASH_ON_LOGIN", False)
+    monkeypatch.setitem(flask_app.config, "PASSWORD_HASH_METHOD", "pbkdf2:sha256:2")
+    # вход со старым хешем не задаёт бюджет отказов для текущего метода
+    assert login(client, follow=False).status_code in (302, 303)
+    with flask_app.app_context():
+        assert login_verifier.budget is None
+        assert set(login_verifier.budgets) == {"pbkdf2:sha256:1"}
+        assert login_verifier.dummy_hash.startswith("pbkdf2:sha256:2$")
+    login_throttle.clear()
+
+
+def test_outdated_hash_upgraded_in_background_after_login(client, mocker, monkeypatch):
+    from app.app import login_throttle, login_verifier
+    from app.passwords import needs_rehash
+    login_throttle.clear()
+    monkeypatch.setitem(flask_app.config, "PASSWORD_HASH_METHOD", "pbkdf2:sha256:2")
+    upgrade = mocker.spy(login_verifier, "upgrade_hash")
+
+    rv = login(client, follow=False)
+    assert rv.status_code in (302, 303)
+    # вход не ждёт пересчёта: хеш меняет фоновый поток
+    assert upgrade.spy_return.result(timeout=5) is True
+    with flask_app.app_context():
+        user = User.query.filter_by(login=TEST_USER).one()
+        assert user.password_hash.startswith("pbkdf2:sha256:2$")
+        assert not needs_rehash(user.password_hash)
+        assert user.version == 1
+
+    # хеш уже по текущей политике — повторный вход ничего не пересчитывает
+    client.get("/logout")
+    assert login(client, follow=False).status_code in (302, 303)
+    assert upgrade.spy_return is None
+    login_throttle.clear()
+
+
+def test_unknown_hash_policy_rejected():
+    from flask import Flask
+    from app.passwords import LoginVerifier
+    app = Flask(__name__)
+    app.config["PASSWORD_HASH_POLICY"] = "md5"
+    with pytest.raises(ValueError):
+        LoginVerifier(app)
+
+
+@pytest.mark.parametrize("url", ["/", "/about", "/posts", "/posts/1"])
+def test_public_pages_cacheable_for_anonymous(client, url):
+    rv = client.get(url)
+    assert rv.status_code == 200
+    cache_control = rv.headers["Cache-Control"]
+    assert cache_control.startswith("public")
+    assert "s-maxage=60" in cache_control and "stale-while-revalidate=300" in cache_control
+    assert "Cookie" in rv.headers["Vary"]
+    assert "Set-Cookie" not in rv.headers
+
+
+def test_public_pages_private_when_authenticated_or_flashed(client):
+    from app.app import login_throttle
+    login_throttle.clear()
+    login(client, follow=False)
+    # страница с flash-сообщением о входе: сессия меняется — в общий кеш нельзя
+    rv = client.get("/")
+    assert "Вход выполнен успешно." in _text(rv)
+    assert rv.headers["Cache-Control"] == "private, max-age=0"
+    rv = client.get("/about")
+    assert rv.headers["Cache-Control"] == "private, max-age=0"
+    assert "Cookie" in rv.headers["Vary"]
+    # остальные страницы кеш не трогает
+    assert "Cache-Control" not in client.get("/secret").headers
+    login_throttle.clear()
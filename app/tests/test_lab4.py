@@ -1,13 +1,11 @@
-import tempfile
-import os
 import pytest
-from werkzeug.security import generate_password_hash
 from flask import url_for
 
 # импорт приложения и моделей
 from app.app import app as flask_app
 from app.models import db, User, Role
 from app.validators import validate_password
+from app.passwords import hash_password
 
 
 
@@ -17,49 +15,10 @@ from app.validators import validate_password
 
 @pytest.fixture
 def client():
-    db_fd, db_path = tempfile.mkstemp(prefix="test_db_", suffix=".sqlite")
-    os.close(db_fd)
-
+    # БД с ролями admin/user и администратором admin восстанавливается перед каждым тестом (conftest.py)
     flask_app.config['TESTING'] = True
     flask_app.config['WTF_CSRF_ENABLED'] = False
-    flask_app.config['SQLALCHEMY_DATABASE_URI'] = f"sqlite:///{db_path}"
-    flask_app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
-
-    with flask_app.app_context():
-        # Не вызывать init_app, если SQLAlchemy уже зарегистрирован в приложении.
-        if 'sqlalchemy' not in flask_app.extensions:
-            db.init_app(flask_app)
-
-        # Гарантируем чистую БД для тестов
-        db.drop_all()
-        db.create_all()
-
-        # seed roles и admin
-        r_admin = Role(name='admin', description='Администраторы')
-        r_user = Role(name='user', description='Обычные пользователи')
-        db.session.add_all([r_admin, r_user])
-        db.session.commit()
-
-        admin = User(
-            login='admin',
-            password_hash=generate_password_hash('Zalanet_514'),
-            last_name='Adminov',
-            first_name='Admin',
-            patronymic='A.',
-            role_id=r_admin.id
-        )
-        db.session.add(admin)
-        db.session.commit()
-
-    client = flask_app.test_client()
-
-    yield client
-
-    # teardown
-    try:
-        os.remove(db_path)
-    except Exception:
-        pass
+    return flask_app.test_client()
 
 
 def login(client, username='admin', password='Zalanet_514'):
@@ -139,7 +98,7 @@ def test_edit_user_requires_auth_and_updates(client):
     login(client)
     # создаём тестового юзера для редактирования
     with flask_app.app_context():
-        u = User(login='toedit', password_hash=generate_password_hash('Pp1pppppp'), last_name='Old', first_name='Name')
+        u = User(login='toedit', password_hash=hash_password('Pp1pppppp'), last_name='Old', first_name='Name')
         db.session.add(u); db.session.commit()
         uid = u.id
     # GET формы
@@ -148,6 +107,7 @@ def test_edit_user_requires_auth_and_updates(client):
     assert 'Редактирование пользователя' in rv.get_data(as_text=True)
     # POST изменений (логин/пароль недоступны в форме редактирования)
     rv2 = client.post(f'/user/{uid}/edit', data={
+        'version': '1',
         'last_name': 'NewLast',
         'first_name': 'NewFirst',
         'patronymic': 'NewPatr',
@@ -162,14 +122,101 @@ def test_edit_user_requires_auth_and_updates(client):
 def test_delete_user_flow(client):
     login(client)
     with flask_app.app_context():
-        u = User(login='todelete', password_hash=generate_password_hash('Aa1111111'), last_name='Del', first_name='Me')
+        u = User(login='todelete', password_hash=hash_password('Aa1111111'), last_name='Del', first_name='Me')
         db.session.add(u); db.session.commit()
         uid = u.id
     # удаление
     rv = client.post(f'/user/{uid}/delete', follow_redirects=True)
     assert 'Пользователь удалён.' in rv.get_data(as_text=True)
+    # удаление мягкое: строка помечена и скрыта со всех страниц
     with flask_app.app_context():
-        assert User.query.get(uid) is None
+        assert db.session.get(User, uid).deleted_at is not None
+    assert 'Del Me' not in client.get('/users').get_data(as_text=True)
+    assert client.get(f'/user/{uid}').status_code == 404
+    assert client.get(f'/user/{uid}/edit').status_code == 404
+    assert client.post(f'/user/{uid}/delete').status_code == 404
+
+def test_purge_removes_soft_deleted_users_in_batches(client):
+    from app.purge import purge_deleted_users
+    login(client)
+    with flask_app.app_context():
+        users = [User(login=f'gone{i}', password_hash='x', last_name='Gone', first_name=str(i)) for i in range(5)]
+        db.session.add_all(users); db.session.commit()
+        ids = [u.id for u in users]
+    for uid in ids[:3]:
+        client.post(f'/user/{uid}/delete')
+    with flask_app.app_context():
+        assert purge_deleted_users(batch_size=2) == 3
+        assert db.session.get(User, ids[0]) is None
+        assert db.session.get(User, ids[3]) is not None
+        assert purge_deleted_users(batch_size=2) == 0
+
+
+def test_login_of_deleted_user_is_free_immediately(client):
+    from sqlalchemy.exc import IntegrityError
+    login(client)
+    with flask_app.app_context():
+        u = User(login='reused', password_hash='x', last_name='Old')
+        db.session.add(u); db.session.commit()
+        uid = u.id
+    client.post(f'/user/{uid}/delete')
+    # очистка ещё не прошла, а логин уже свободен
+    rv = client.post('/user/create', data={'login': 'reused', 'password': 'StrongPass1', 'last_name': 'New',
+                                           'first_name': 'N', 'patronymic': '', 'role': ''}, follow_redirects=True)
+    assert 'Пользователь успешно создан.' in rv.get_data(as_text=True)
+    with flask_app.app_context():
+        assert db.session.get(User, uid).deleted_at is not None
+        # среди живых логин по-прежнему уникален
+        db.session.add(User(login='reused', password_hash='x'))
+        with pytest.raises(IntegrityError):
+            db.session.commit()
+        db.session.rollback()
+
+
+def test_upgrade_schema_drops_old_login_unique(file_db_app):
+    from sqlalchemy import text
+    from app.models import upgrade_schema
+    app, _ = file_db_app
+    with app.app_context():
+        # users как в старой lab4_init.sql: UNIQUE на всю таблицу и индекс по id
+        db.session.execute(text('DROP TABLE users'))
+        db.session.execute(text('CREATE TABLE users (id INTEGER PRIMARY KEY AUTOINCREMENT, login TEXT NOT NULL UNIQUE, '
+                                'password_hash TEXT NOT NULL, last_name TEXT, first_name TEXT, patronymic TEXT, '
+                                'role_id INTEGER, created_at DATETIME DEFAULT CURRENT_TIMESTAMP)'))
+        db.session.execute(text('CREATE INDEX ix_users_live ON users (id)'))
+        db.session.execute(text("INSERT INTO users (login, password_hash, last_name) VALUES ('old', 'x', 'Старый')"))
+        db.session.commit()
+        upgrade_schema()
+        indexes = {row[1]: row for row in db.session.execute(text('PRAGMA index_list(users)'))}
+        assert 'ux_users_login_live' in indexes and 'ix_users_live' not in indexes
+        assert not any(row[3] == 'u' for row in indexes.values())
+        u = User.query.filter_by(login='old').one()
+        assert (u.full_name, u.version) == ('Старый', 1)
+        # ключ сортировки досчитан для строк, записанных до его появления
+        assert u.full_name_key == 'старый' and 'ix_users_name_key' in indexes
+        u.deleted_at = u.created_at
+        db.session.add(User(login='old', password_hash='y'))
+        db.session.commit()
+
+def test_schema_lock_serializes_migrations(tmp_path):
+    import threading
+    from app.models import schema_lock
+    order = []
+
+    def other():
+        with schema_lock(tmp_path / 'schema.lock'):
+            order.append('other')
+
+    with schema_lock(tmp_path / 'schema.lock'):
+        thread = threading.Thread(target=other)
+        thread.start()
+        thread.join(0.2)
+        # второй процесс (здесь поток со своим дескриптором) ждёт, пока первый не закончит миграцию
+        assert thread.is_alive()
+        order.append('first')
+    thread.join(5)
+    assert order == ['first', 'other']
+
 
 def test_change_password_errors_and_success(client):
     # используем admin из фикстуры
@@ -215,3 +262,301 @@ def test_password_validator_edge_cases():
     # недопустимый символ
     res = validate_password('GoodPass1🙂')
     assert any('Недопустимый символ' in s for s in res)
+
+@pytest.fixture
+def file_db_app(tmp_path):
+    # реплика имеет смысл только для файловой БД; тестовая БД в памяти читается через основной engine
+    from flask import Flask
+    from app.replica import ReadReplica
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = f"sqlite:///{tmp_path / 'app.db'}"
+    db.init_app(app)
+    replica = ReadReplica(db, app)
+    with app.app_context():
+        db.create_all()
+    yield app, replica
+    with app.app_context():
+        replica.dispose()
+        db.engine.dispose()
+
+
+def test_user_pages_read_from_replica_without_staleness(client, file_db_app):
+    from app.replica import read_replica
+    with flask_app.app_context():
+        assert read_replica.engine is db.engine
+    app, replica = file_db_app
+    with app.app_context():
+        assert replica.engine is not db.engine
+        assert replica.engine.url.query.get('mode') == 'ro'
+        # запись через основной engine видна читателю сразу после commit
+        u = User(login='freshuser', password_hash='x', last_name='Fresh', first_name='User')
+        db.session.add(u); db.session.commit()
+        assert replica.session.get(User, u.id).full_name == 'Fresh User'
+    with flask_app.app_context():
+        u = User(login='freshuser', password_hash=hash_password('Pp1pppppp'), last_name='Fresh', first_name='User')
+        db.session.add(u); db.session.commit()
+        uid = u.id
+    assert 'Fresh User' in client.get('/users').get_data(as_text=True)
+    assert 'freshuser' in client.get(f'/user/{uid}').get_data(as_text=True)
+    assert client.get('/user/999999').status_code == 404
+
+def test_replica_session_is_read_only(file_db_app):
+    from sqlalchemy.exc import OperationalError
+    app, replica = file_db_app
+    with app.app_context():
+        db.session.add(User(login='ro', password_hash='x')); db.session.commit()
+        u = replica.session.scalars(db.select(User)).first()
+        u.last_name = 'Hacked'
+        with pytest.raises(OperationalError):
+            replica.session.commit()
+
+def test_edit_user_conflict_on_stale_version(client):
+    from app.models import update_user_versioned
+    login(client)
+    with flask_app.app_context():
+        u = User(login='racer', password_hash=hash_password('Pp1pppppp'), last_name='Old', first_name='Name')
+        db.session.add(u); db.session.commit()
+        uid = u.id
+    form_html = client.get(f'/user/{uid}/edit').get_data(as_text=True)
+    assert 'name="version" value="1"' in form_html
+    # другой администратор успел сохранить изменения
+    with flask_app.app_context():
+        assert update_user_versioned(uid, 1, last_name='Other')
+        db.session.commit()
+    rv = client.post(f'/user/{uid}/edit', data={
+        'version': '1', 'last_name': 'Mine', 'first_name': 'Name', 'patronymic': '', 'role': ''
+    })
+    assert rv.status_code == 409
+    text = rv.get_data(as_text=True)
+    assert 'уже изменил кто-то другой' in text
+    assert 'name="version" value="2"' in text
+    with flask_app.app_context():
+        assert db.session.get(User, uid).last_name == 'Other'
+    # повторная отправка с актуальной версией проходит
+    rv = client.post(f'/user/{uid}/edit', data={
+        'version': '2', 'last_name': 'Mine', 'first_name': 'Name', 'patronymic': '', 'role': ''
+    }, follow_redirects=True)
+    assert 'Данные пользователя обновлены.' in rv.get_data(as_text=True)
+    with flask_app.app_context():
+        u = db.session.get(User, uid)
+        assert (u.last_name, u.version) == ('Mine', 3)
+    # форма без версии (старая или чужой клиент) проверку не обходит
+    rv = client.post(f'/user/{uid}/edit', data={'last_name': 'Blind', 'first_name': 'Name', 'role': ''})
+    assert rv.status_code == 409
+    assert 'name="version" value="3"' in rv.get_data(as_text=True)
+    with flask_app.app_context():
+        assert db.session.get(User, uid).last_name == 'Mine'
+
+
+def test_user_rows_are_light_and_match_orm_fio(client):
+    from app.models import UserRow, user_rows
+    with flask_app.app_context():
+        db.session.add(User(login='norole', password_hash='x', last_name='Безролев', first_name='Пётр'))
+        db.session.commit()
+        rows = {r.id: r for r in user_rows()}
+        for u in User.query.filter(User.not_deleted()):
+            assert isinstance(rows[u.id], UserRow)
+            assert rows[u.id].fio() == u.fio()
+            assert rows[u.id].role_name == (u.role.name if u.role else None)
+        assert not hasattr(rows[u.id], '__dict__')
+    text = client.get('/users').get_data(as_text=True)
+    assert 'Adminov Admin A.' in text and 'admin' in text
+    assert 'Безролев Пётр' in text and '(нет роли)' in text
+
+
+def test_full_name_is_stored_and_sorts_users(client):
+    from app.models import update_user_versioned
+    with flask_app.app_context():
+        db.session.add_all([
+            User(login='b', password_hash='x', last_name='бобров', first_name='Борис'),
+            User(login='a', password_hash='x', last_name='Albertov', first_name='Al', patronymic=''),
+            # строчная кириллица: NOCASE поставил бы её после всех заглавных «Б…»
+            User(login='c', password_hash='x', last_name='аксенов', first_name='Борис'),
+        ])
+        db.session.commit()
+        u = User.query.filter_by(login='a').one()
+        assert u.full_name == 'Albertov Al' == u.fio()
+        # БД пересчитывает колонку при частичном UPDATE
+        assert update_user_versioned(u.id, u.version, last_name='abramov')
+        db.session.commit()
+        db.session.refresh(u)
+        assert u.full_name == 'abramov Al'
+    text = client.get('/users?sort=name').get_data(as_text=True)
+    # без учёта регистра: abramov < Adminov
+    assert (text.index('abramov Al') < text.index('Adminov Admin A.') < text.index('аксенов Борис')
+            < text.index('бобров Борис'))
+    with flask_app.app_context():
+        assert User.query.filter_by(login='a').one().full_name_key == 'abramov al'
+    text = client.get('/users').get_data(as_text=True)
+    assert text.index('Adminov Admin A.') < text.index('бобров Борис') < text.index('abramov Al')
+
+
+@pytest.fixture
+def job_queue(tmp_path):
+    from app.jobs import jobs, LocalSink
+    saved = jobs.path, jobs.default_handler, dict(jobs.handlers)
+    jobs.path = str(tmp_path / 'jobs.db')
+    jobs.default_handler = LocalSink(str(tmp_path / 'outbox.jsonl'))
+    yield jobs, tmp_path / 'outbox.jsonl'
+    jobs.path, jobs.default_handler, jobs.handlers = saved
+
+
+def test_user_events_are_queued_after_commit_and_delivered(client, job_queue):
+    import json
+    jobs, outbox = job_queue
+    login(client)
+    client.post('/user/create', data={'login': 'queued1', 'password': 'StrongPass1', 'last_name': 'Q',
+                                      'first_name': 'Q', 'patronymic': '', 'role': ''})
+    with flask_app.app_context():
+        uid = User.query.filter_by(login='queued1').one().id
+        # откатанная транзакция в очередь ничего не ставит
+        jobs.on_commit('user.updated', {'user_id': uid})
+        db.session.rollback()
+    client.post(f'/user/{uid}/delete')
+    # обработчик запроса только поставил задачи, отправляет воркер
+    # события создания и удаления плюс очистка удалённых
+    assert jobs.counts() == {'pending': 3} and not outbox.exists()
+    with flask_app.app_context():
+        assert jobs.work() == 3
+        # удалённого пользователя физически убрал воркер очереди
+        assert db.session.get(User, uid) is None
+    events = [json.loads(line) for line in outbox.read_text(encoding='utf-8').splitlines()]
+    assert [(e['kind'], e['user_id']) for e in events] == [('user.created', uid), ('user.deleted', uid)]
+    assert jobs.counts() == {}
+
+
+def test_failed_jobs_are_retried_in_batches_then_dead(client, job_queue):
+    jobs, outbox = job_queue
+    batches = []
+
+    @jobs.handler('flaky')
+    def flaky(kind, payloads):
+        batches.append([p['n'] for p in payloads])
+        raise ConnectionError('smtp down')
+
+    for n in range(3):
+        jobs.enqueue('flaky', {'n': n}, now=0)
+    assert jobs.work(now=0) == 0
+    assert batches == [[0, 1, 2]]
+    # до истечения задержки повтора задачи не берутся
+    assert jobs.work(now=1) == 0 and len(batches) == 1
+    for attempt in range(2, jobs.max_attempts + 1):
+        jobs.work(now=10 ** attempt)
+    assert len(batches) == jobs.max_attempts
+    assert jobs.counts() == {'dead': 3}
+
+
+def test_audit_log_is_batched_append_only_and_filterable(client):
+    from datetime import datetime, timedelta
+    from app.audit import audit
+    from app.models import AuditEvent
+    login(client)
+    with flask_app.app_context():
+        admin_id = User.query.filter_by(login='admin').one().id
+    saved = audit.flush_interval, audit.flush_size
+    audit.flush_interval, audit.flush_size = 3600, 1000
+    try:
+        for i in range(3):
+            client.post('/user/create', data={'login': f'audited{i}', 'password': 'StrongPass1', 'last_name': 'A',
+                                              'first_name': str(i), 'patronymic': '', 'role': ''})
+        with flask_app.app_context():
+            # события пока в буфере, транзакции пользователей их не писали
+            assert AuditEvent.query.count() == 0
+            assert audit.flush() == 3
+            assert AuditEvent.query.count() == 3
+    finally:
+        audit.flush_interval, audit.flush_size = saved
+    with flask_app.app_context():
+        first_id = User.query.filter_by(login='audited0').one().id
+        with pytest.raises(Exception, match='append-only'):
+            db.session.execute(db.delete(AuditEvent))
+        db.session.rollback()
+    client.post(f'/user/{first_id}/delete')
+
+    text = client.get(f'/audit?target={first_id}').get_data(as_text=True)
+    assert text.count('<td>user.') == 2 and 'user.deleted' in text and 'user.created' in text
+    flask_app.config['AUDIT_PAGE_SIZE'] = 2
+    try:
+        page = client.get(f'/audit?actor={admin_id}').get_data(as_text=True)
+        assert page.count('<td>user.') == 2 and 'user.deleted' in page and 'after=' in page
+        tomorrow = (datetime.utcnow() + timedelta(days=1)).date().isoformat()
+        assert 'Записей нет' in client.get(f'/audit?since={tomorrow}').get_data(as_text=True)
+        assert client.get('/audit?since=garbage').status_code == 400
+    finally:
+        flask_app.config['AUDIT_PAGE_SIZE'] = 50
+
+
+def test_audit_log_is_admin_only(client):
+    from app.passwords import hash_password
+    with flask_app.app_context():
+        role = Role.query.filter_by(name='user').one()
+        db.session.add(User(login='plain', password_hash=hash_password('Plain_123'), role_id=role.id))
+        db.session.commit()
+    assert client.get('/audit').status_code == 302
+    login(client, 'plain', 'Plain_123')
+    assert client.get('/audit').status_code == 403
+    assert 'Журнал действий' not in client.get('/users').get_data(as_text=True)
+
+
+def test_data_generator_is_deterministic_and_consistent(tmp_path):
+    from sqlalchemy import create_engine, text
+    from app.datagen import generate
+
+    def build(name):
+        engine = create_engine(f"sqlite:///{tmp_path / name}")
+        db.metadata.create_all(engine)
+        generate(engine, users=200, posts=4, comments=3, seed=7, image_ids=['img'], password_hash='x')
+        with engine.connect() as conn:
+            dump = [conn.execute(text(f'SELECT * FROM {t} ORDER BY 1')).all()
+                    for t in ('roles', 'users', 'posts', 'comments', 'comment_stats')]
+        engine.dispose()
+        return dump
+
+    roles, users, posts, comments, stats = build('a.db')
+    assert build('b.db') == [roles, users, posts, comments, stats]
+    assert len(users) == 200 and len(posts) == 4 and len(roles) == 4
+    assert all(u.full_name and u.full_name[0] in 'АБВГДЕЁЖЗИЙКЛМНОПРСТУФХЦЧШЩЭЮЯ' for u in users)
+    # роль admin генератор не раздаёт
+    admin_id = next(r.id for r in roles if r.name == 'admin')
+    assert all(u.role_id != admin_id for u in users)
+    # счётчики совпадают с деревом комментариев
+    for s in stats:
+        rows = [c for c in comments if c.post_id == s.post_id]
+        assert s.top_level == sum(c.parent_id is None for c in rows) == 3
+        assert s.total == len(rows)
+        for c in rows:
+            assert c.reply_count == sum(r.parent_id == c.id for r in rows)
+
+
+def test_gen_data_requires_separate_database(tmp_path):
+    from sqlalchemy import create_engine, text
+    from werkzeug.security import check_password_hash
+    runner = flask_app.test_cli_runner()
+    result = runner.invoke(args=['gen-data', '--users', '5'])
+    assert result.exit_code != 0 and '--database' in result.output
+    with flask_app.app_context():
+        assert User.query.count() == 1
+    result = runner.invoke(args=['gen-data', '--users', '5', '--database', str(tmp_path / 'gen.db'),
+                                 '--password', 'Bench_pass1'])
+    assert result.exit_code == 0 and 'Bench_pass1' not in result.output
+    engine = create_engine(f"sqlite:///{tmp_path / 'gen.db'}")
+    with engine.connect() as conn:
+        hashes = conn.execute(text('SELECT DISTINCT password_hash FROM users')).scalars().all()
+    engine.dispose()
+    assert len(hashes) == 1 and check_password_hash(hashes[0], 'Bench_pass1')
+
+
+def test_viewer_resolved_once_per_request_and_reset_on_login(client):
+    from flask import render_template_string
+    from flask_login import login_user, logout_user
+    from app.view_context import viewer
+    with flask_app.test_request_context('/users'):
+        anon = viewer()
+        assert not anon.is_authenticated and viewer() is anon
+        admin = User.query.filter_by(login='admin').one()
+        login_user(admin)
+        # в шаблоне — сам объект пользователя, не LocalProxy
+        assert viewer() is admin
+        assert render_template_string('{{ is_authenticated }} {{ current_user.login }}') == 'True admin'
+        logout_user()
+        assert not viewer().is_authenticated
@@ -0,0 +1,60 @@
+import threading
+
+import pytest
+
+from app.app import app as flask_app
+from app.models import db, User, Role
+from app.passwords import hash_password
+from app.profiling import stack_sampler
+
+
+@pytest.fixture
+def client(tmp_path):
+    flask_app.config['TESTING'] = True
+    flask_app.config['PROFILE_DIR'] = str(tmp_path / 'profiles')
+    with flask_app.app_context():
+        role = Role.query.filter_by(name='user').one()
+        db.session.add(User(login='plain', password_hash=hash_password('Plain_123'), role_id=role.id))
+        db.session.commit()
+    return flask_app.test_client()
+
+
+def login(client, username='admin', password='Zalanet_514'):
+    client.post('/login', data={'username': username, 'password': password})
+
+
+def test_admin_can_profile_a_request_in_place(client, tmp_path):
+    assert 'X-Profile-Id' not in client.get('/users?_profile=1').headers
+    login(client)
+    rv = client.get('/users', headers={'X-Profile': '1'})
+    name = rv.headers['X-Profile-Id']
+    assert name.endswith('.prof') and 'users.users_list' in name
+    assert (tmp_path / 'profiles' / name).is_file()
+    assert 'X-Profile-Id' not in client.get('/posts').headers
+    name = client.get('/posts?_profile=1').headers['X-Profile-Id']
+    report = client.get(f'/admin/profiles/{name}').get_data(as_text=True)
+    assert 'function calls' in report and 'feed_page' in report
+    assert name in client.get('/admin/profiles').get_data(as_text=True)
+    assert client.get('/admin/profiles/..%2Fapp.db').status_code == 404
+
+
+def test_profiling_is_admin_only(client, tmp_path):
+    login(client, 'plain', 'Plain_123')
+    assert 'X-Profile-Id' not in client.get('/users?_profile=1').headers
+    assert not (tmp_path / 'profiles').exists()
+    assert client.get('/admin/profiles').status_code == 403
+    assert client.get('/admin/profile/stacks').status_code == 403
+
+
+def test_sampled_stacks_are_served_collapsed(client, tmp_path, monkeypatch):
+    monkeypatch.setattr(stack_sampler, 'path', str(tmp_path / 'stacks.db'))
+    # снимок делается из другого потока, пока этот ждёт его в join
+    sampler = threading.Thread(target=stack_sampler.sample)
+    sampler.start()
+    sampler.join()
+    login(client)
+    body = client.get('/admin/profile/stacks').get_data(as_text=True)
+    line = next(l for l in body.splitlines() if 'test_sampled_stacks_are_served_collapsed' in l)
+    stack, count = line.rsplit(' ', 1)
+    assert int(count) == 1 and stack.split(';')[-1].endswith(')') and '(threading.py:' in stack
+
@@ -0,0 +1,101 @@
+import os
+import stat
+import time
+from datetime import datetime
+
+from sqlalchemy import literal, select
+
+from app.models import db
+from app.shared_cache import SharedCache, MISS, shared_cache
+
+
+def make_cache(tmp_path, **kwargs):
+    return SharedCache(path=str(tmp_path / 'cache.db'), **kwargs)
+
+
+# два экземпляра на одном файле — как два воркера gunicorn
+def test_values_shared_between_workers(tmp_path):
+    w1, w2 = make_cache(tmp_path), make_cache(tmp_path)
+    w1.set('posts', 'page1', [{'id': 1}, {'id': 2}])
+    assert w2.get('posts', 'page1') == [{'id': 1}, {'id': 2}]
+    assert w2.get('posts', 'page2') is MISS
+    # другая версия формата значения — другой ключ
+    assert w2.get('posts', 'page1', version=2) is MISS
+
+
+def test_invalidate_bumps_namespace_generation(tmp_path):
+    w1, w2 = make_cache(tmp_path), make_cache(tmp_path)
+    w1.set('roles', 'all', ['admin'])
+    w1.set('posts', 'page1', ['p'])
+    w2.invalidate('roles')
+    assert w1.get('roles', 'all') is MISS
+    assert w1.get('posts', 'page1') == ['p']
+
+
+def test_ttl_and_lru_eviction(tmp_path):
+    cache = make_cache(tmp_path, max_entries=2)
+    cache.set('ns', 'old', 1, ttl=-1)
+    assert cache.get('ns', 'old') is MISS
+    for i, key in enumerate('abc'):
+        cache.set('ns', key, i)
+        cache._connect().execute("UPDATE entries SET accessed = ? WHERE key LIKE ?", (time.time() - 100 + i, f'%:{key}'))
+    cache.evict()
+    assert cache.get('ns', 'a') is MISS
+    assert cache.get('ns', 'b') == 1 and cache.get('ns', 'c') == 2
+
+
+def test_cached_decorator(tmp_path):
+    cache = make_cache(tmp_path)
+    calls = []
+
+    @cache.cached('squares', ttl=60)
+    def square(x):
+        calls.append(x)
+        return x * x
+
+    assert square(3) == 9 and square(3) == 9
+    assert calls == [3]
+    square.invalidate()
+    assert square(3) == 9
+    assert calls == [3, 3]
+    # выключенный кеш просто вызывает функцию
+    cache.path = None
+    square(3)
+    assert calls == [3, 3, 3]
+
+
+def test_rows_and_datetimes_round_trip_as_json(app, tmp_path):
+    cache = make_cache(tmp_path)
+    with app.app_context():
+        rows = db.session.execute(select(literal(1).label('id'), literal('admin').label('name'))).all()
+    cache.set('roles', 'all', (rows, datetime(2025, 3, 10, 12, 30)))
+    cached_rows, when = cache.get('roles', 'all')
+    assert [(r.id, r.name) for r in cached_rows] == [(1, 'admin')]
+    assert when == datetime(2025, 3, 10, 12, 30)
+    # в файле — JSON, а не pickle
+    raw = cache._connect().execute('SELECT value FROM entries').fetchone()[0]
+    assert raw.startswith('[') and 'admin' in raw
+    assert stat.S_IMODE(os.stat(tmp_path / 'cache.db').st_mode) == 0o600
+
+
+def test_entries_scoped_by_database(tmp_path):
+    main, bench = make_cache(tmp_path, scope='main'), make_cache(tmp_path, scope='bench')
+    main.set('posts', 'page1', ['real'])
+    assert bench.get('posts', 'page1') is MISS
+    bench.invalidate('posts')
+    assert main.get('posts', 'page1') == ['real']
+
+
+def test_app_pages_with_cache_enabled(app, client, monkeypatch, tmp_path):
+    monkeypatch.setattr(shared_cache, 'path', str(tmp_path / 'cache.db'))
+    first = client.get('/posts')
+    # вторая страница собрана из закешированных строк
+    second = client.get('/posts')
+    assert first.status_code == second.status_code == 200
+    assert first.data == second.data
+    assert shared_cache._connect().execute('SELECT count(*) FROM entries').fetchone()[0] >= 1
+    client.post('/login', data={'username': 'admin', 'password': 'Zalanet_514'})
+    for _ in range(2):
+        rv = client.get('/user/create')
+        assert rv.status_code == 200
+        assert 'admin' in rv.get_data(as_text=True)
@@ -0,0 +1,51 @@
+import pytest
+from sqlalchemy import text
+from sqlalchemy.exc import OperationalError
+
+from app.models import db
+from app.sqlstats import normalize, query_stats
+
+
+def login(client, username='admin', password='Zalanet_514'):
+    client.post('/login', data={'username': username, 'password': password})
+
+
+def test_normalize_groups_statements_by_shape():
+    assert normalize("SELECT * FROM users WHERE id IN (?, ?, ?)\n  AND login = 'x'") == \
+        normalize("SELECT * FROM users WHERE id IN (?, ?) AND login = 'it''s'") == \
+        'SELECT * FROM users WHERE id IN (?, ...) AND login = ?'
+    assert normalize('SELECT users_1.id FROM users AS users_1 LIMIT 10') == \
+        'SELECT users_1.id FROM users AS users_1 LIMIT ?'
+
+
+def test_sql_stats_are_collected_and_served_to_admin(client, caplog, monkeypatch):
+    query_stats.reset()
+    for _ in range(3):
+        client.get('/users')
+    top = query_stats.top(50, 'count')
+    users_select = next(row for row in top if 'FROM users LEFT OUTER JOIN roles' in row[0])
+    shape, count, total, longest = users_select
+    assert count == 3 and 0 < longest <= total
+    # медленные запросы попадают в лог с эндпоинтом
+    monkeypatch.setattr(query_stats, 'slow_ms', 0)
+    client.get('/users')
+    monkeypatch.undo()
+    assert any('[GET users.users_list]' in r.getMessage() and 'FROM users' in r.getMessage() for r in caplog.records)
+    assert client.get('/admin/sql').status_code == 302
+    login(client)
+    page = client.get('/admin/sql?sort=count').get_data(as_text=True)
+    assert 'FROM users LEFT OUTER JOIN roles' in page
+    client.post('/admin/sql/reset')
+    assert all('LEFT OUTER JOIN roles' not in row[0] for row in query_stats.top(50))
+
+
+def test_failed_statement_does_not_leak_start_time(app):
+    with app.app_context():
+        with db.engine.connect() as conn:
+            with pytest.raises(OperationalError):
+                conn.execute(text('SELECT * FROM no_such_table'))
+            assert conn.info.get('query_start') == []
+            # следующий запрос на том же соединении меряется от своего начала
+            query_stats.reset()
+            conn.execute(text('SELECT 1'))
+            assert query_stats.top(1)[0][1] == 1
@@ -1,26 +1,64 @@
 
-from flask import Blueprint, render_template, request, redirect, url_for, flash, abort
+from datetime import datetime
+from functools import wraps
+from flask import Blueprint, render_template, request, redirect, url_for, flash, abort, current_app
 from flask_login import login_required, current_user
-from werkzeug.security import generate_password_hash, check_password_hash
-from app.models import db, User, Role
+from werkzeug.security import check_password_hash
+from sqlalchemy import select, update
+from app.models import db, User, Role, update_user_versioned, user_rows
 from app.validators import validate_user_input, validate_password
+from app.replica import read_replica
+from app.passwords import hash_password
+from app.shared_cache import shared_cache
+from app.jobs import jobs, user_event
+from app.audit import audit, audit_page
+from app.purge import PURGE_JOB
 
 users_bp = Blueprint('users', __name__, template_folder='templates')
 
+
+def admin_required(view):
+    """Как login_required, но пускает только администраторов; остальным — 403."""
+    @login_required
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        if not current_user.is_admin:
+            abort(403)
+        return view(*args, **kwargs)
+    return wrapper
+
+
+@shared_cache.cached('roles', ttl=300)
+def roles_list():
+    # для выпадающего списка ролей нужны только id и название
+    return db.session.execute(select(Role.id, Role.name).order_by(Role.id)).all()
+
+
+def _user_changed(kind, user_id):
+    # журнал и уведомления пишутся после commit и вне транзакции запроса (app/audit.py, app/jobs.py)
+    audit.on_commit(kind, actor_id=current_user.id, target_id=user_id)
+    jobs.on_commit(kind, user_event(user_id, current_user.id))
+
+
 @users_bp.route('/users')
 def users_list():
-    users = User.query.order_by(User.id).all()
-    return render_template('users.html', users=users)
+    # только чтение — через read-only пул, чтобы не ждать пишущие запросы
+    # ?sort=name — по ФИО (сортирует БД по индексу), иначе по порядку создания
+    sort = 'name' if request.args.get('sort') == 'name' else 'id'
+    users = user_rows(read_replica.session, by_name=sort == 'name')
+    return render_template('users.html', users=users, sort=sort)
 
 @users_bp.route('/user/<int:user_id>')
 def user_view(user_id):
-    u = User.query.get_or_404(user_id)
+    u = read_replica.session.query(User).filter(User.id == user_id, User.not_deleted()).first()
+    if u is None:
+        abort(404)
     return render_template('user_view.html', user=u)
 
 @users_bp.route('/user/create', methods=['GET','POST'])
 @login_required
 def user_create():
-    roles = Role.query.all()
+    roles = roles_list()
     if request.method == 'POST':
         data = request.form
         errors = validate_user_input(data, require_password=True)
@@ -30,7 +68,7 @@ def user_create():
         # создание пользователя
         new_user = User(
             login = data['login'],
-            password_hash = generate_password_hash(data['password']),
+            password_hash = hash_password(data['password']),
             last_name = data.get('last_name') or None,
             first_name = data.get('first_name') or None,
             patronymic = data.get('patronymic') or None,
@@ -38,6 +76,8 @@ def user_create():
         )
         try:
             db.session.add(new_user)
+            db.session.flush()
+            _user_changed('user.created', new_user.id)
             db.session.commit()
             flash('Пользователь успешно создан.', 'success')
             return redirect(url_for('users.users_list'))
@@ -50,46 +90,74 @@ def user_create():
 @users_bp.route('/user/<int:user_id>/edit', methods=['GET','POST'])
 @login_required
 def user_edit(user_id):
-    u = User.query.get_or_404(user_id)
-    roles = Role.query.all()
+    u = User.query.filter(User.id == user_id, User.not_deleted()).first_or_404()
+    roles = roles_list()
     if request.method == 'POST':
         data = request.form
         errors = validate_user_input(data, require_password=False, require_login=False)
         if errors:
             return render_template('user_form.html', errors=errors, form=data, roles=roles, edit=True, user=u)
-        # обновляем поля (без логина и пароля)
-        u.last_name = data.get('last_name') or None
-        u.first_name = data.get('first_name') or None
-        u.patronymic = data.get('patronymic') or None
-        u.role_id = int(data['role']) if data.get('role') else None
+        # версия, с которой открывали форму; без неё проверить, что данные не устарели, нельзя
+        version = data.get('version', type=int)
+        if version is None:
+            flash('Форма устарела: откройте её заново и сохраните снова.', 'warning')
+            return render_template('user_form.html', roles=roles, form=_edit_form(u), edit=True, user=u), 409
+        # обновляем поля (без логина и пароля) одним UPDATE ... WHERE id = ? AND version = ?
         try:
+            updated = update_user_versioned(
+                u.id, version,
+                last_name=data.get('last_name') or None,
+                first_name=data.get('first_name') or None,
+                patronymic=data.get('patronymic') or None,
+                role_id=int(data['role']) if data.get('role') else None,
+            )
+            if updated:
+                _user_changed('user.updated', u.id)
             db.session.commit()
-            flash('Данные пользователя обновлены.', 'success')
-            return redirect(url_for('users.users_list'))
         except Exception as e:
             db.session.rollback()
             flash('Ошибка при обновлении: ' + str(e), 'danger')
             return render_template('user_form.html', errors={'db': 'Ошибка сохранения'}, form=data, roles=roles, edit=True, user=u)
-    # GET
-    form = {
+        if not updated:
+            # кто-то успел изменить пользователя — показываем актуальные данные
+            db.session.refresh(u)
+            flash('Данные пользователя уже изменил кто-то другой. Проверьте их и сохраните снова.', 'warning')
+            return render_template('user_form.html', roles=roles, form=_edit_form(u), edit=True, user=u), 409
+        flash('Данные пользователя обновлены.', 'success')
+        return redirect(url_for('users.users_list'))
+    return render_template('user_form.html', roles=roles, form=_edit_form(u), edit=True, user=u)
+
+
+def _edit_form(u):
+    return {
         'last_name': u.last_name or '',
         'first_name': u.first_name or '',
         'patronymic': u.patronymic or '',
-        'role': str(u.role_id) if u.role_id else ''
+        'role': str(u.role_id) if u.role_id else '',
+        'version': str(u.version),
     }
-    return render_template('user_form.html', roles=roles, form=form, edit=True, user=u)
 
 @users_bp.route('/user/<int:user_id>/delete', methods=['POST'])
 @login_required
 def user_delete(user_id):
-    u = User.query.get_or_404(user_id)
+    # мягкое удаление: один короткий UPDATE, строку потом уберёт воркер очереди (app/purge.py)
     try:
-        db.session.delete(u)
+        result = db.session.execute(
+            update(User)
+            .where(User.id == user_id, User.not_deleted())
+            .values(deleted_at=datetime.utcnow(), version=User.version + 1)
+        )
+        if result.rowcount:
+            _user_changed('user.deleted', user_id)
+            jobs.on_commit(PURGE_JOB, {})
         db.session.commit()
-        flash('Пользователь удалён.', 'success')
     except Exception as e:
         db.session.rollback()
         flash('Ошибка при удалении: ' + str(e), 'danger')
+        return redirect(url_for('users.users_list'))
+    if result.rowcount == 0:
+        abort(404)
+    flash('Пользователь удалён.', 'success')
     return redirect(url_for('users.users_list'))
 
 @users_bp.route('/change_password', methods=['GET','POST'])
@@ -112,10 +180,37 @@ def change_password():
                 flash(v, 'danger')
             return render_template('change_password.html', errors=errors)
         # всё ок
-        current_user.password_hash = generate_password_hash(new)
+        updated = update_user_versioned(current_user.id, current_user.version,
+                                        password_hash=hash_password(new))
+        if updated:
+            _user_changed('user.password_changed', current_user.id)
         db.session.commit()
+        if not updated:
+            flash('Данные пользователя изменились во время смены пароля. Повторите попытку.', 'danger')
+            return render_template('change_password.html', errors={}), 409
         flash('Пароль успешно изменён.', 'success')
         return redirect(url_for('users.users_list'))
     return render_template('change_password.html', errors={})
 
 
+
+
+@users_bp.route('/audit')
+@admin_required
+def audit_log():
+    """Журнал действий с фильтрами ?actor=&target=&since=&until= и страницами ?after=.
+
+    since и until — даты или дата-время в ISO (ГГГГ-ММ-ДД[ЧЧ:ММ]); until не включается.
+    """
+    args = request.args
+    try:
+        since = datetime.fromisoformat(args['since']) if args.get('since') else None
+        until = datetime.fromisoformat(args['until']) if args.get('until') else None
+    except ValueError:
+        abort(400)
+    filters = {'actor': args.get('actor', type=int), 'target': args.get('target', type=int),
+               'since': since, 'until': until}
+    events, next_after = audit_page(read_replica.session, after=args.get('after', type=int),
+                                    limit=current_app.config['AUDIT_PAGE_SIZE'], **filters)
+    return render_template('audit.html', events=events, next_after=next_after,
+                           filters={k: v for k, v in args.items() if k != 'after' and v})
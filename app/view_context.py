@@ -0,0 +1,35 @@
+from flask import g, has_request_context
+from flask_login import current_user, user_logged_in, user_logged_out
+
+
+def viewer():
+    """Текущий пользователь запроса — сам объект (User или AnonymousUserMixin), а не LocalProxy.
+
+    Разрешается один раз за запрос и хранится в g; login_user/logout_user сбрасывают запомненное.
+    """
+    user = g.get('viewer')
+    if user is None:
+        user = g.viewer = current_user._get_current_object()
+    return user
+
+
+def _forget_viewer(sender, user=None, **extra):
+    g.pop('viewer', None)
+
+
+def init_app(app):
+    """Подключать после LoginManager.init_app: наш current_user в шаблонах перекрывает прокси Flask-Login.
+
+    Шаблоны получают готовые значения: current_user — объект пользователя без прокси, is_authenticated —
+    обычный bool. Обращение к ним в цикле по строкам (users.html) — поиск в словаре контекста,
+    без LocalProxy и свойств Flask-Login на каждой строке.
+    """
+    @app.context_processor
+    def inject_viewer():
+        if not has_request_context():
+            return {}
+        user = viewer()
+        return {'current_user': user, 'is_authenticated': user.is_authenticated}
+
+    user_logged_in.connect(_forget_viewer, app)
+    user_logged_out.connect(_forget_viewer, app)
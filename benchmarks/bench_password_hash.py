@@ -0,0 +1,52 @@
+"""Цена хеширования паролей для уровней PASSWORD_HASH_POLICY: хешей в секунду и память на хеш.
+
+Запуск из корня проекта:
+
+    python -m benchmarks.bench_password_hash [--seconds 2] [--policy scrypt --policy pbkdf2 ...]
+
+Каждый уровень меряется в отдельном процессе: пиковый RSS процесса (ru_maxrss) до и после
+хеширования даёт память одного хеша — у scrypt она выделяется внутри OpenSSL и tracemalloc её не видит.
+Хешей в секунду на один поток; воркер gunicorn, занятый хешем, столько же не обслуживает другие запросы.
+"""
+import argparse
+import multiprocessing
+import resource
+import time
+
+from werkzeug.security import check_password_hash, generate_password_hash
+
+from app.passwords import HASH_POLICIES
+
+
+def measure(method, seconds):
+    before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    pwhash = generate_password_hash('Password1', method=method)
+    count = 0
+    start = time.perf_counter()
+    while time.perf_counter() - start < seconds:
+        check_password_hash(pwhash, 'Password1')
+        count += 1
+    elapsed = time.perf_counter() - start
+    # ru_maxrss в Linux — в килобайтах
+    peak = (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - before) * 1024
+    return count / elapsed, peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--seconds', type=float, default=2.0, help='сколько секунд мерить каждый уровень')
+    parser.add_argument('--policy', action='append', choices=list(HASH_POLICIES),
+                        help='какие уровни мерить (по умолчанию все)')
+    args = parser.parse_args()
+
+    ctx = multiprocessing.get_context('spawn')
+    print('policy        method                  hashes/s   ms/hash   memory, MiB')
+    for name in args.policy or HASH_POLICIES:
+        method = HASH_POLICIES[name]
+        with ctx.Pool(1) as pool:
+            rate, peak = pool.apply(measure, (method, args.seconds))
+        print(f'{name:12}  {method:22}  {rate:8.1f}   {1000 / rate:7.1f}   {peak / 2**20:11.1f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,74 @@
+"""Бенчмарк сопоставления URL (werkzeug Map) по всем правилам приложения и blueprint'ов.
+
+Запуск из корня проекта:
+
+    python -m benchmarks.bench_routing [--iterations 20000] [--extra 0,100,1000]
+
+Для каждого правила строится пример пути и замеряется adapter.match(path).
+Затем карта дополняется N фиктивными правилами, чтобы увидеть, как растут накладные
+расходы на маршрутизацию с ростом числа маршрутов.
+"""
+import argparse
+import time
+
+from werkzeug.routing import Map, Rule
+
+from app.app import app
+
+
+def sample_paths(url_map):
+    """(endpoint, метод, путь) для каждого правила; 1 подходит для всех используемых конвертеров."""
+    adapter = url_map.bind('localhost')
+    paths = []
+    for rule in url_map.iter_rules():
+        method = sorted(rule.methods - {'HEAD', 'OPTIONS'})[0]
+        path = adapter.build(rule.endpoint, {arg: 1 for arg in rule.arguments}, method=method)
+        paths.append((rule.endpoint, method, path))
+    return paths
+
+
+def with_extra_rules(url_map, count):
+    rules = [rule.empty() for rule in url_map.iter_rules()]
+    rules += [Rule(f'/bench/{i}/<int:item_id>', endpoint=f'bench_{i}') for i in range(count)]
+    return Map(rules, converters=url_map.converters)
+
+
+def time_matches(url_map, paths, iterations):
+    adapter = url_map.bind('localhost')
+    start = time.perf_counter()
+    for _ in range(iterations):
+        for _, method, path in paths:
+            adapter.match(path, method=method)
+    elapsed = time.perf_counter() - start
+    return elapsed / (iterations * len(paths))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--iterations', type=int, default=20000)
+    parser.add_argument('--extra', default='0,100,1000', help='сколько фиктивных правил добавлять, через запятую')
+    args = parser.parse_args()
+
+    paths = sample_paths(app.url_map)
+    print(f'rules: {len(paths)}')
+    adapter = app.url_map.bind('localhost')
+    time_matches(app.url_map, paths, 100)  # прогрев: werkzeug компилирует матчер при первом обращении
+    per_rule = []
+    for endpoint, method, path in paths:
+        start = time.perf_counter()
+        for _ in range(args.iterations):
+            adapter.match(path, method=method)
+        per_rule.append(((time.perf_counter() - start) / args.iterations, endpoint, method, path))
+    for seconds, endpoint, method, path in sorted(per_rule, reverse=True):
+        print(f'{seconds * 1e6:8.2f} us  {endpoint:32} {method:5} {path}')
+
+    print()
+    print('extra rules   avg match, us')
+    for extra in (int(n) for n in args.extra.split(',')):
+        url_map = with_extra_rules(app.url_map, extra)
+        avg = time_matches(url_map, paths, max(1, args.iterations // 10))
+        print(f'{extra:11d}   {avg * 1e6:8.2f}')
+
+
+if __name__ == '__main__':
+    main()
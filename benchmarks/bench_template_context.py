@@ -0,0 +1,76 @@
+"""Накладные расходы на строку в users.html: current_user через LocalProxy против is_authenticated из контекста.
+
+Запуск из корня проекта:
+
+    python -m benchmarks.bench_template_context [--rows 1000] [--repeat 50]
+
+Приложение поднимается на SQLite в памяти с выключенным общим кешем (instance/ не трогается). Внутри запроса вошедшего
+пользователя рендерится строка таблицы users.html для N строк в трёх вариантах: как было
+(`current_user.is_authenticated` — прокси Flask-Login на каждой строке), как стало (`is_authenticated`
+из view_context) и без проверки вовсе. Шаблоны компилируются один раз, замеряется только рендеринг. Разница с последним — цена проверки на строку.
+Для сравнения — время рендеринга всего users.html.
+"""
+import argparse
+import os
+import time
+
+os.environ.setdefault('DATABASE_URL', 'sqlite://')
+os.environ.setdefault('SHARED_CACHE_PATH', '')
+
+import flask_login
+from flask import render_template
+from flask_login import login_user
+
+from app.app import app
+from app.models import User, UserRow
+
+ROW = '''{% for u in users %}<tr><td>{{ loop.index }}</td><td>{{ u.full_name }}</td><td>
+<a href="/user/{{ u.id }}">Просмотр</a>
+{% if CHECK %}<a href="/user/{{ u.id }}/edit">Редактировать</a>{% endif %}
+</td></tr>{% endfor %}'''
+
+VARIANTS = (
+    ('proxy', ROW.replace('CHECK', 'current_user.is_authenticated'), {'current_user': flask_login.current_user}),
+    ('context', ROW.replace('CHECK', 'is_authenticated'), {}),
+    ('none', ROW.replace('CHECK', 'true'), {}),
+)
+
+
+def best_of(repeat, render):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        render()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, default=1000)
+    parser.add_argument('--repeat', type=int, default=50)
+    args = parser.parse_args()
+
+    users = [UserRow(i, f'Иванов{i} Иван Иванович', 'user') for i in range(1, args.rows + 1)]
+    with app.test_request_context('/users'):
+        login_user(User(id=1, login='bench', password_hash='x', first_name='Иван'))
+        times = {}
+        for name, source, extra in VARIANTS:
+            template = app.jinja_env.from_string(source)
+            # контекст собирается как в render_template: context processors, затем свои переменные
+            context = {'users': users, **extra}
+            app.update_template_context(context)
+            template.render(context)
+            times[name] = best_of(args.repeat, lambda: template.render(context))
+        page = best_of(args.repeat, lambda: render_template('users.html', users=users, sort=None))
+
+    print(f'rows: {args.rows}')
+    print('variant    total, ms   per row, us   check per row, us')
+    for name, elapsed in times.items():
+        print(f'{name:8}  {elapsed * 1000:10.2f}   {elapsed / args.rows * 1e6:11.2f}   '
+              f'{(elapsed - times["none"]) / args.rows * 1e6:17.3f}')
+    print(f'users.html: {page * 1000:.2f} ms')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,74 @@
+"""Память на строку в списке пользователей: ORM-объекты User против UserRow из Core-запроса.
+
+Запуск из корня проекта:
+
+    python -m benchmarks.bench_user_rows [--rows 100000]
+
+Таблицы создаются во временной БД в памяти, заполняются N пользователями с ролями,
+затем tracemalloc измеряет, сколько памяти удерживает готовый к рендерингу список
+(для ORM — вместе с сессией и её identity map, как в обработчике запроса).
+"""
+import argparse
+import gc
+import time
+import tracemalloc
+
+from sqlalchemy import create_engine, insert
+from sqlalchemy.orm import Session, joinedload
+
+from app.models import db, Role, User, user_rows
+
+
+def make_engine(rows):
+    engine = create_engine('sqlite://')
+    db.metadata.create_all(engine)
+    with engine.begin() as conn:
+        conn.execute(insert(Role), [{'id': 1, 'name': 'admin'}, {'id': 2, 'name': 'user'}])
+        conn.execute(insert(User), [
+            {'login': f'user{i}', 'password_hash': 'x', 'last_name': f'Иванов{i}', 'first_name': 'Иван',
+             'patronymic': 'Иванович', 'role_id': 1 + i % 2}
+            for i in range(rows)
+        ])
+    return engine
+
+
+def load_orm(session):
+    # так список грузился раньше, плюс роль сразу, чтобы шаблон не делал запрос на каждую строку
+    return session.query(User).options(joinedload(User.role)).filter(User.not_deleted()).order_by(User.id).all()
+
+
+def measure(engine, load):
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    start = time.perf_counter()
+    session = Session(engine)
+    users = load(session)
+    # то, что читает шаблон users.html
+    for u in users:
+        u.fio()
+    elapsed = time.perf_counter() - start
+    gc.collect()
+    held = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    count = len(users)
+    session.close()
+    return count, held, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, default=100000)
+    args = parser.parse_args()
+
+    engine = make_engine(args.rows)
+    print(f'rows: {args.rows}')
+    print('path        bytes/row   total, MiB   time, s')
+    for name, load in (('orm', load_orm), ('user_rows', user_rows)):
+        count, held, elapsed = measure(engine, load)
+        assert count == args.rows
+        print(f'{name:10}  {held / count:9.0f}   {held / 2**20:10.1f}   {elapsed:7.2f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,34 @@
+"""Настройки gunicorn: `gunicorn -c gunicorn.conf.py app.app:app` (см. Procfile).
+
+Воркеры перезапускаются после max_requests запросов (± jitter, чтобы не все разом) — так
+ограничивается медленный рост памяти процесса (lru_cache, ORM, фрагментация). Новый воркер
+прогревается в post_worker_init до того, как начнёт принимать соединения (app/health.py).
+Значения можно переопределить переменными окружения.
+"""
+import multiprocessing
+import os
+
+bind = os.environ.get('GUNICORN_BIND') or f"0.0.0.0:{os.environ.get('PORT', '8000')}"
+workers = int(os.environ.get('WEB_CONCURRENCY', multiprocessing.cpu_count() * 2 + 1))
+# потоки в каждом воркере: запрос, ждущий SQLite или сон LoginVerifier, не занимает весь процесс
+worker_class = 'gthread'
+threads = int(os.environ.get('GUNICORN_THREADS', 4))
+# прогрев открывает столько соединений пула, сколько потоков разом их попросят
+os.environ.setdefault('WARMUP_DB_CONNECTIONS', str(threads))
+
+max_requests = int(os.environ.get('GUNICORN_MAX_REQUESTS', 1000))
+max_requests_jitter = int(os.environ.get('GUNICORN_MAX_REQUESTS_JITTER', max_requests // 10))
+# сколько ждать, пока уходящий воркер доделает текущие запросы
+graceful_timeout = int(os.environ.get('GUNICORN_GRACEFUL_TIMEOUT', 30))
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 30))
+keepalive = 5
+
+# heartbeat-файл воркера — в памяти, а не на диске, где запись может подвиснуть
+if os.path.isdir('/dev/shm'):
+    worker_tmp_dir = '/dev/shm'
+
+
+def post_worker_init(worker):
+    # приложение уже загружено в воркере, соединения ещё не принимаются
+    from app.health import warm_up
+    warm_up.run(worker.wsgi)